@@ -52,7 +52,7 @@ def send_email(subject: str, recipients: list[str], html: str) -> None:
 
     # ✅ Отправка через SendGrid API (HTTPS)
     if backend == "sendgrid":
-        import requests
+        from app.services.http_transport import HttpTransport
 
         api_key = current_app.config.get("SENDGRID_API_KEY")
         sender = current_app.config.get("MAIL_DEFAULT_SENDER")
@@ -68,7 +68,7 @@ def send_email(subject: str, recipients: list[str], html: str) -> None:
             "content": [{"type": "text/html", "value": html}],
         }
 
-        resp = requests.post(
+        resp = HttpTransport.post(
             url,
             headers={
                 "Authorization": f"Bearer {api_key}",
@@ -3,7 +3,12 @@ from flask_login import login_required
 from app.auth.decorators import admin_required
 from app.extensions import db
 from app.models import Provider, AIModel, Stage, StageAssignment
-from app.services.ai_providers import test_provider_connection
+from app.services.ai_providers import test_provider_connection, ProviderConcurrency, ProviderRegistry
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.http_transport import HttpTransport
+from app.services.config_snapshot import ConfigSnapshot
+from app.services.llm_cache import LLMCache
+from app.services.output_limits import OutputTokenLimits
 
 assistants_bp = Blueprint('assistants', __name__, url_prefix='/assistants')
 
@@ -33,7 +38,8 @@ def providers():
     all_providers = Provider.query.order_by(Provider.name).all()
     return render_template('assistants/providers.html',
                            title='Управление провайдерами',
-                           providers=all_providers)
+                           providers=all_providers,
+                           circuits=CircuitBreaker.states())
 
 
 @assistants_bp.route('/providers/<int:provider_id>/edit', methods=['GET', 'POST'])
@@ -69,6 +75,9 @@ def edit_provider(provider_id):
         provider.additional_config = json.dumps(config) if config else None
 
         db.session.commit()
+        ConfigSnapshot.bump_version()
+        ProviderRegistry.invalidate(provider.id)
+        LLMCache.invalidate(model_ids=[model.id for model in provider.models])
         flash(f"Провайдер {provider.display_name} обновлен", "success")
         return redirect(url_for('assistants.providers'))
 
@@ -95,12 +104,29 @@ def toggle_provider(provider_id):
     provider = Provider.query.get_or_404(provider_id)
     provider.is_active = not provider.is_active
     db.session.commit()
+    ConfigSnapshot.bump_version()
+    ProviderRegistry.invalidate(provider.id)
+    LLMCache.invalidate(model_ids=[model.id for model in provider.models])
 
     status = "активирован" if provider.is_active else "деактивирован"
     flash(f"Провайдер {provider.display_name} {status}", "success")
     return redirect(url_for('assistants.providers'))
 
 
+@assistants_bp.route('/providers/<int:provider_id>/circuit/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_provider_circuit(provider_id):
+    """Вернуть в работу провайдера и его модели, отключённые после серии ошибок"""
+    provider = Provider.query.get_or_404(provider_id)
+    CircuitBreaker.reset("provider", provider.id)
+    for model in provider.models:
+        CircuitBreaker.reset("model", model.id)
+
+    flash(f"Провайдер {provider.display_name} снова принимает запросы", "success")
+    return redirect(url_for('assistants.providers'))
+
+
 @assistants_bp.route('/providers/<int:provider_id>/test', methods=['POST'])
 @login_required
 @admin_required
@@ -185,6 +211,7 @@ def create_model():
         )
         db.session.add(model)
         db.session.commit()
+        ConfigSnapshot.bump_version()
 
         flash(f"Модель {display_name} создана", "success")
         return redirect(url_for('assistants.models'))
@@ -236,6 +263,8 @@ def edit_model(model_id):
         model.is_active = is_active
 
         db.session.commit()
+        ConfigSnapshot.bump_version()
+        LLMCache.invalidate(model_ids=[model_id])
         flash(f"Модель {display_name} обновлена", "success")
         return redirect(url_for('assistants.models'))
 
@@ -254,14 +283,11 @@ def delete_model(model_id):
     """Удаление модели"""
     model = AIModel.query.get_or_404(model_id)
 
-    # Проверяем, не используется ли модель в активных назначениях
-    active_assignments = StageAssignment.query.filter(
-        db.or_(
-            StageAssignment.model_id == model_id,
-            StageAssignment.fallback_model_id == model_id
-        ),
-        StageAssignment.is_active == True
-    ).count()
+    # Проверяем, не используется ли модель в активных назначениях (основной или в цепочке резервных)
+    active_assignments = sum(
+        1 for assignment in StageAssignment.query.filter_by(is_active=True)
+        if assignment.model_id == model_id or model_id in assignment.fallback_model_ids
+    )
 
     if active_assignments > 0:
         flash(
@@ -272,6 +298,8 @@ def delete_model(model_id):
     display_name = model.display_name
     db.session.delete(model)
     db.session.commit()
+    ConfigSnapshot.bump_version()
+    LLMCache.invalidate(model_ids=[model_id])
 
     flash(f"Модель {display_name} удалена", "success")
     return redirect(url_for('assistants.models'))
@@ -285,6 +313,8 @@ def toggle_model(model_id):
     model = AIModel.query.get_or_404(model_id)
     model.is_active = not model.is_active
     db.session.commit()
+    ConfigSnapshot.bump_version()
+    LLMCache.invalidate(model_ids=[model_id])
 
     status = "активирована" if model.is_active else "деактивирована"
     flash(f"Модель {model.display_name} {status}", "success")
@@ -300,21 +330,28 @@ def toggle_model(model_id):
 @admin_required
 def stages():
     """Управление этапами обработки и назначением моделей"""
-    all_stages = Stage.query.order_by(Stage.order).all()
+    # Служебные шаги (поиск) выполняются без модели
+    all_stages = Stage.query.filter_by(kind=Stage.KIND_LLM).order_by(Stage.order).all()
     active_models = AIModel.query.filter_by(is_active=True).join(Provider).filter(Provider.is_active == True).order_by(
         Provider.name, AIModel.name).all()
 
-    # Получаем текущие назначения
+    # Получаем текущие назначения и длину ответов этапов (выученные лимиты max_tokens)
     assignments = {}
+    output_limits = {}
     for stage in all_stages:
         active_assignment = StageAssignment.query.filter_by(stage_id=stage.id, is_active=True).first()
         assignments[stage.id] = active_assignment
+        if active_assignment:
+            output_limits[stage.id] = OutputTokenLimits.learned(
+                stage.id, [active_assignment.model_id] + active_assignment.fallback_model_ids
+            )
 
     return render_template('assistants/stages.html',
                            title='Настройка этапов обработки',
                            stages=all_stages,
                            models=active_models,
-                           assignments=assignments)
+                           assignments=assignments,
+                           output_limits=output_limits)
 
 
 @assistants_bp.route('/stages/<int:stage_id>/assign', methods=['POST'])
@@ -322,9 +359,23 @@ def stages():
 @admin_required
 def assign_model(stage_id):
     """Назначить модель на этап"""
+    import json
     stage = Stage.query.get_or_404(stage_id)
     model_id = request.form.get('model_id', type=int)
-    fallback_model_id = request.form.get('fallback_model_id', type=int)
+    # Резервные модели по порядку полей формы (пустые и повторы пропускаются)
+    fallback_chain = []
+    for fallback_model_id in request.form.getlist('fallback_model_id', type=int):
+        if fallback_model_id and fallback_model_id != model_id and fallback_model_id not in fallback_chain:
+            fallback_chain.append(fallback_model_id)
+    routing_policy = request.form.get('routing_policy', StageAssignment.ROUTING_ORDERED)
+    if routing_policy not in (StageAssignment.ROUTING_ORDERED, StageAssignment.ROUTING_LATENCY):
+        routing_policy = StageAssignment.ROUTING_ORDERED
+    timeout_seconds = request.form.get('timeout_seconds', type=int)
+    hedge_enabled = request.form.get('hedge_enabled') == 'on'
+    hedge_after_ms = request.form.get('hedge_after_ms', type=int)
+    cache_ttl_seconds = request.form.get('cache_ttl_seconds', type=int)
+    fusion_group = request.form.get('fusion_group', '').strip()[:64]
+    max_tokens = request.form.get('max_tokens', type=int)
 
     if not model_id:
         flash("Выберите модель", "error")
@@ -339,11 +390,21 @@ def assign_model(stage_id):
     assignment = StageAssignment(
         stage_id=stage_id,
         model_id=model_id,
-        fallback_model_id=fallback_model_id if fallback_model_id else None,
+        fallback_model_id=fallback_chain[0] if fallback_chain else None,
+        fallback_chain=json.dumps(fallback_chain) if fallback_chain else None,
+        routing_policy=routing_policy,
+        timeout_seconds=timeout_seconds if timeout_seconds and timeout_seconds > 0 else None,
+        hedge_enabled=hedge_enabled and bool(fallback_chain),
+        hedge_after_ms=hedge_after_ms if hedge_after_ms and hedge_after_ms > 0 else None,
+        cache_ttl_seconds=cache_ttl_seconds if cache_ttl_seconds is not None and cache_ttl_seconds >= 0 else None,
+        fusion_group=fusion_group or None,
+        max_tokens=max_tokens if max_tokens and max_tokens > 0 else None,
         is_active=True
     )
     db.session.add(assignment)
     db.session.commit()
+    ConfigSnapshot.bump_version()
+    LLMCache.invalidate(stage_id=stage_id)
 
     flash(f"Этап '{stage.display_name}' → {model.display_name}", "success")
     return redirect(url_for('assistants.stages'))
@@ -356,7 +417,60 @@ def unassign_model(stage_id):
     """Убрать назначение с этапа"""
     StageAssignment.query.filter_by(stage_id=stage_id, is_active=True).update({'is_active': False})
     db.session.commit()
+    ConfigSnapshot.bump_version()
+    LLMCache.invalidate(stage_id=stage_id)
 
     stage = Stage.query.get_or_404(stage_id)
     flash(f"Назначение для этапа '{stage.display_name}' удалено", "success")
-    return redirect(url_for('assistants.stages'))
\ No newline at end of file
+    return redirect(url_for('assistants.stages'))
+
+
+# ============================================================================
+# Кэш ответов моделей
+# ============================================================================
+
+@assistants_bp.route('/cache/stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Счётчики кэша ответов моделей (в пределах процесса)"""
+    return jsonify({
+        'success': True,
+        'stats': LLMCache.stats()
+    })
+
+
+@assistants_bp.route('/concurrency/stats')
+@login_required
+@admin_required
+def concurrency_stats():
+    """Очереди к провайдерам по классам приоритета (в пределах процесса)"""
+    return jsonify({
+        'success': True,
+        'providers': ProviderConcurrency.stats()
+    })
+
+
+@assistants_bp.route('/transport/stats')
+@login_required
+@admin_required
+def transport_stats():
+    """
+    Соединения к внешним API: запросы, новые соединения и доля переиспользования,
+    а также клиенты провайдеров (в пределах процесса)
+    """
+    return jsonify({
+        'success': True,
+        'origins': HttpTransport.stats(),
+        'clients': ProviderRegistry.stats()
+    })
+
+
+@assistants_bp.route('/cache/clear', methods=['POST'])
+@login_required
+@admin_required
+def clear_cache():
+    """Очистить кэш ответов моделей"""
+    LLMCache.invalidate()
+    flash("Кэш ответов моделей очищен", "success")
+    return redirect(url_for('assistants.stages'))
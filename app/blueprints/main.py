@@ -1,11 +1,22 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, url_for, Response, stream_with_context, current_app
 from flask_login import login_required, current_user
 from app.services.pipeline_processor import PipelineProcessor
+from app.services.job_queue import JobQueue
+from app.services.batch_processor import BatchProcessor
+from app.services.speculative import SpeculativeRuns
+from app.services.token_budget import TokenBudget
+from app.services import priority as priorities
 import json
 
 main_bp = Blueprint("main", __name__)
 
 
+@main_bp.before_app_request
+def start_job_supervisor():
+    """Надзор за заданиями пула веб-процесса (JOB_EXECUTOR=thread) запускается с первым запросом"""
+    JobQueue.start_supervisor(current_app._get_current_object())
+
+
 @main_bp.route("/")
 def index():
     """Главная страница"""
@@ -21,15 +32,19 @@ def index():
 @login_required
 def process_news():
     """
-    Обработка новости через конвейер этапов
+    Постановка новости в очередь на обработку через конвейер этапов
 
     Ожидает JSON:
     {
         "news_text": "текст новости",
-        "stage_ids": [1, 2, 3]
+        "stage_ids": [1, 2, 3],
+        "deadline_seconds": 60,  # опционально: лимит времени обработки
+        "priority": "interactive"  # опционально: interactive | normal | bulk, не выше класса роли
     }
 
-    Возвращает JSON с результатами обработки
+    Сразу возвращает 202 и ID задания; результаты отдаёт GET /jobs/<id>.
+    Текст длиннее допустимого (INPUT_MAX_TOKENS, при PIPELINE_CHUNKING — на фрагмент;
+    по оценке) отклоняется с 413 или обрезается (INPUT_OVERFLOW); оценка возвращается в поле input
     """
     try:
         data = request.get_json()
@@ -65,17 +80,274 @@ def process_news():
                 "error": "Некорректные ID этапов"
             }), 400
 
-        # Обрабатываем новость через конвейер
-        result = PipelineProcessor.process_news(
+        try:
+            deadline_seconds = float(data["deadline_seconds"]) if data.get("deadline_seconds") else None
+        except (ValueError, TypeError):
+            return jsonify({
+                "success": False,
+                "error": "Некорректный лимит времени"
+            }), 400
+
+        # Размер текста — до постановки в очередь, а не после запросов к провайдерам
+        news_text, input_info, error = TokenBudget.guard(news_text)
+        if error:
+            return jsonify({
+                "success": False,
+                "error": error,
+                "input": input_info
+            }), 413
+
+        # Ставим задание в очередь — конвейер выполнит пул исполнителей
+        job = JobQueue.enqueue(
             user_id=current_user.id,
             news_text=news_text,
-            stage_ids=stage_ids
+            stage_ids=stage_ids,
+            deadline_seconds=deadline_seconds,
+            priority=priorities.for_user(current_user, data.get("priority"))
         )
 
-        return jsonify(result)
+        return jsonify({
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "priority": job.priority,
+            "input": input_info,
+            "status_url": url_for("main.job_status", job_id=job.id),
+            "events_url": url_for("main.job_events", job_id=job.id)
+        }), 202
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": f"Ошибка сервера: {str(e)}"
+        }), 500
+
+
+@main_bp.route("/process/speculative", methods=["POST"])
+@login_required
+def process_speculative():
+    """
+    Упреждающий запуск дешёвых этапов (SPECULATIVE_STAGES), пока редактор ещё
+    вводит текст; задание POST /process с тем же текстом заберёт их результаты
+
+    Ожидает JSON:
+    {
+        "news_text": "текущий текст новости",
+        "stage_ids": [1, 2, 3]   # этапы, выбранные в форме
+    }
+
+    Возвращает JSON:
+    {
+        "success": true,
+        "started": bool,
+        "run": {"key", "stages": [...], "status": "running" | "done"} | null
+    }
+    """
+    config = current_app.config
+    if not config.get("SPECULATIVE_ENABLED", False) or config.get("JOB_EXECUTOR", "thread") != "thread":
+        return jsonify({"success": True, "started": False, "run": None})
+
+    data = request.get_json(silent=True) or {}
+    news_text = (data.get("news_text") or "").strip()
+    stage_ids = data.get("stage_ids", [])
+
+    if not isinstance(stage_ids, list):
+        return jsonify({
+            "success": False,
+            "error": "Не выбраны этапы обработки"
+        }), 400
+
+    try:
+        stage_ids = [int(sid) for sid in stage_ids]
+    except (ValueError, TypeError):
+        return jsonify({
+            "success": False,
+            "error": "Некорректные ID этапов"
+        }), 400
+
+    # Текст обрезается так же, как его обрежет POST /process; слишком длинный не обрабатывается заранее
+    news_text, _, error = TokenBudget.guard(news_text)
+    if error:
+        return jsonify({"success": True, "started": False, "run": None})
+
+    run = SpeculativeRuns.start(current_user.id, news_text, stage_ids, priorities.for_user(current_user))
+    return jsonify({
+        "success": True,
+        "started": run is not None,
+        "run": run.to_dict() if run else None
+    }), 202 if run else 200
+
+
+@main_bp.route("/process/speculative/cancel", methods=["POST"])
+@login_required
+def cancel_speculative():
+    """Отменить упреждающие прогоны пользователя (текст очищен)"""
+    return jsonify({
+        "success": True,
+        "cancelled": SpeculativeRuns.cancel(current_user.id)
+    })
+
+
+@main_bp.route("/process/batch", methods=["POST"])
+@login_required
+def process_batch():
+    """
+    Пакетная обработка нескольких новостей через одни и те же этапы
+
+    Ожидает JSON:
+    {
+        "items": ["текст новости", ...] или [{"id": "...", "news_text": "..."}, ...],
+        "stage_ids": [1, 2, 3],
+        "concurrency": 4,   # опционально, не больше BATCH_MAX_WORKERS
+        "deadline_seconds": 60,  # опционально: лимит времени на одну новость
+        "priority": "bulk",  # опционально: interactive | normal | bulk (по умолчанию bulk), не выше класса роли
+        "stream": false     # true — результаты отдаются построчно (NDJSON) по мере готовности
+    }
+
+    Возвращает JSON:
+    {
+        "success": bool,
+        "items": [{"id", "index", "success", "results": [...], "error"}],  # в порядке items
+        "error": str | null
+    }
+    """
+    try:
+        data = request.get_json()
+
+        if not data:
+            return jsonify({
+                "success": False,
+                "error": "Не переданы данные"
+            }), 400
+
+        items, error = BatchProcessor.normalize_items(data.get("items"))
+        if error:
+            return jsonify({
+                "success": False,
+                "error": error
+            }), 400
+
+        stage_ids = data.get("stage_ids", [])
+        if not stage_ids or not isinstance(stage_ids, list):
+            return jsonify({
+                "success": False,
+                "error": "Не выбраны этапы обработки"
+            }), 400
+
+        try:
+            stage_ids = [int(sid) for sid in stage_ids]
+            concurrency = int(data["concurrency"]) if data.get("concurrency") else None
+            deadline_seconds = float(data["deadline_seconds"]) if data.get("deadline_seconds") else None
+        except (ValueError, TypeError):
+            return jsonify({
+                "success": False,
+                "error": "Некорректные параметры запроса"
+            }), 400
+
+        # Этапы, модели и промпты загружаем один раз на весь пакет
+        priority = priorities.for_user(current_user, data.get("priority"), default=priorities.BULK)
+        plan, error = PipelineProcessor.build_plan(current_user.id, stage_ids, priority)
+        if error:
+            return jsonify({
+                "success": False,
+                "error": error
+            }), 400
+
+        results = BatchProcessor.iter_results(plan, items, concurrency, deadline_seconds)
+
+        if data.get("stream"):
+            def generate():
+                for item_result in results:
+                    yield json.dumps(item_result, ensure_ascii=False) + "\n"
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype="application/x-ndjson",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "X-Accel-Buffering": "no"
+                }
+            )
+
+        item_results = sorted(results, key=lambda item_result: item_result["index"])
+        return jsonify({
+            "success": all(item_result["success"] for item_result in item_results),
+            "items": item_results,
+            "error": None
+        })
 
     except Exception as e:
         return jsonify({
             "success": False,
             "error": f"Ошибка сервера: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+@main_bp.route("/jobs/<job_id>", methods=["GET"])
+@login_required
+def job_status(job_id):
+    """
+    Состояние задания обработки
+
+    Возвращает JSON:
+    {
+        "success": true,
+        "job": {
+            "job_id": str,
+            "status": "queued" | "running" | "done" | "failed",
+            "success": bool | null,   # итог конвейера
+            "results": [...],         # результаты этапов (частичные, пока задание выполняется)
+            "error": str | null
+        }
+    }
+    """
+    job = JobQueue.get_job(job_id)
+
+    if not job or (job.user_id != current_user.id and not current_user.is_admin):
+        return jsonify({
+            "success": False,
+            "error": "Задание не найдено"
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "job": job.to_dict()
+    })
+
+
+@main_bp.route("/jobs/<job_id>/events", methods=["GET"])
+@login_required
+def job_events(job_id):
+    """
+    Server-Sent Events: поток результатов этапов задания по мере их готовности
+
+    События:
+        event: delta — фрагмент ответа модели ({"stage_id", "stage_name", "type": "delta", "text"})
+                       или сброс накопленного текста перед fallback ({"type": "reset"})
+        event: stage — результат этапа (stage_name, content, model_used, duration_ms, ...)
+        event: done  — задание завершено ({"status", "success", "error"})
+    """
+    job = JobQueue.get_job(job_id)
+
+    if not job or (job.user_id != current_user.id and not current_user.is_admin):
+        return jsonify({
+            "success": False,
+            "error": "Задание не найдено"
+        }), 404
+
+    def generate():
+        for event in JobQueue.stream_events(job_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            payload = json.dumps(event["data"], ensure_ascii=False)
+            yield f"event: {event['event']}\ndata: {payload}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
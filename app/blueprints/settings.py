@@ -89,7 +89,7 @@ def prompts():
     """Управление системными промптами"""
     from app.models import Stage, SystemPrompt
 
-    stages = Stage.query.order_by(Stage.order).all()
+    stages = Stage.query.filter_by(kind=Stage.KIND_LLM).order_by(Stage.order).all()
 
     # Получаем системные промпты для всех этапов
     prompts_dict = {}
@@ -146,7 +146,7 @@ def my_prompts():
     from app.models import Stage
     from app.services.prompt_manager import PromptManager
 
-    stages = Stage.query.filter_by(is_active=True).order_by(Stage.order).all()
+    stages = Stage.query.filter_by(is_active=True, kind=Stage.KIND_LLM).order_by(Stage.order).all()
 
     # Получаем пользовательские промпты
     user_prompts_dict = {}
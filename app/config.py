@@ -40,6 +40,137 @@ class Config:
     # Brave Search API
     BRAVE_SEARCH_API_KEY = os.getenv("BRAVE_SEARCH_API_KEY")
     BRAVE_SEARCH_ENABLED = os.getenv("BRAVE_SEARCH_ENABLED", "0") == "1"
+    BRAVE_SEARCH_COUNT = int(os.getenv("BRAVE_SEARCH_COUNT", "10"))
+    BRAVE_SEARCH_RPM = int(os.getenv("BRAVE_SEARCH_RPM", "0"))  # запросов в минуту на все процессы, 0 — без лимита
+
+    # лимиты rpm/tpm провайдеров и моделей (additional_config / default_params): сколько
+    # запрос может ждать освобождения лимита, сек
+    RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "20"))
+
+    # пулы keep-alive соединений к внешним API (по одному на адрес, общие для потоков процесса)
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))  # соединений на адрес
+    HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "0") == "1"  # ждать свободного вместо нового
+    HTTP_HTTP2 = os.getenv("HTTP_HTTP2", "0") == "1"  # нужен пакет httpx[http2]
+    HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))  # простой соединения HTTP/2
+
+    # повтор запросов при 429/5xx/529 и обрывах соединения (провайдер может переопределить
+    # ключами max_retries, retry_base_delay, retry_max_delay в additional_config)
+    RETRY_MAX_RETRIES = int(os.getenv("RETRY_MAX_RETRIES", "2"))
+    RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+    RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "10"))  # дольше просит провайдер — не ждать
+
+    # автомат отключения: после стольких временных ошибок подряд провайдер (модель)
+    # отключается на CIRCUIT_OPEN_SECONDS и запросы сразу идут на резервную модель; 0 — выключен
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+    # выбор модели этапа по политике "latency": статистика учитывается после стольких
+    # запросов к модели; модель с большей долей сбоев считается неисправной
+    ROUTING_MIN_SAMPLES = int(os.getenv("ROUTING_MIN_SAMPLES", "10"))
+    ROUTING_MAX_ERROR_RATE = float(os.getenv("ROUTING_MAX_ERROR_RATE", "0.2"))
+
+    # конвейер обработки: параллельный запуск независимых этапов
+    PIPELINE_CONCURRENT = os.getenv("PIPELINE_CONCURRENT", "1") == "1"
+    PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "5"))
+    # потоковая генерация: фрагменты ответа модели передаются в браузер по мере генерации
+    PIPELINE_STREAMING = os.getenv("PIPELINE_STREAMING", "1") == "1"
+    # общий лимит времени обработки новости, сек (0 — без лимита); запрос и
+    # назначение этапа могут задать свой
+    PIPELINE_DEADLINE_SECONDS = float(os.getenv("PIPELINE_DEADLINE_SECONDS", "0"))
+
+    # длинный текст (больше PIPELINE_CHUNK_TOKENS по оценке) этап обрабатывает по фрагментам с
+    # перекрытием: запросы к фрагментам идут параллельно (не больше CHUNK_WORKERS на этап), затем
+    # один запрос объединяет ответы; фрагменты укрупняются, если их больше CHUNK_MAX_CHUNKS
+    PIPELINE_CHUNKING = os.getenv("PIPELINE_CHUNKING", "1") == "1"
+    PIPELINE_CHUNK_TOKENS = int(os.getenv("PIPELINE_CHUNK_TOKENS", "3000"))
+    PIPELINE_CHUNK_OVERLAP_TOKENS = int(os.getenv("PIPELINE_CHUNK_OVERLAP_TOKENS", "200"))
+    PIPELINE_CHUNK_MAX_CHUNKS = int(os.getenv("PIPELINE_CHUNK_MAX_CHUNKS", "16"))
+    PIPELINE_CHUNK_WORKERS = int(os.getenv("PIPELINE_CHUNK_WORKERS", "4"))
+
+    # фоновые задания: POST /process ставит задание, GET /jobs/<id> отдаёт результаты
+    # JOB_EXECUTOR: thread — пул в веб-процессе, external — отдельный процесс `flask jobs-worker`
+    JOB_EXECUTOR = os.getenv("JOB_EXECUTOR", "thread")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+    # исполнитель раз в JOB_HEARTBEAT_SECONDS отмечает свои задания; задание без отметки дольше
+    # JOB_STALE_SECONDS (исполнитель упал или процесс перезапущен) возвращается в очередь
+    JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+    JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+
+    # пакетная обработка (POST /process/batch): сколько новостей обрабатывается одновременно
+    BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "4"))
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+    # лимит одновременных запросов к одному провайдеру (0 — без ограничения);
+    # переопределяется ключом max_concurrency в дополнительной конфигурации провайдера
+    PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "0"))
+
+    # классы приоритета запросов к провайдерам: interactive, normal, bulk. Роль задаёт наивысший
+    # доступный класс (запрос может его понизить); когда лимит провайдера исчерпан, слоты
+    # распределяются по весам классов, а запрос, ждущий дольше AGING_SECONDS, идёт первым;
+    # bulk не занимает последние RESERVED_SLOTS слотов провайдера
+    PRIORITY_BY_ROLE = os.getenv("PRIORITY_BY_ROLE", "admin:interactive,staff:interactive,user:normal")
+    PRIORITY_WEIGHTS = os.getenv("PRIORITY_WEIGHTS", "interactive:8,normal:4,bulk:1")
+    PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "30"))
+    PRIORITY_RESERVED_SLOTS = int(os.getenv("PRIORITY_RESERVED_SLOTS", "1"))
+
+    # объединение этапов: этапы с одной группой объединения (назначение этапа) и одной
+    # моделью выполняются одним запросом
+    PIPELINE_FUSION = os.getenv("PIPELINE_FUSION", "1") == "1"
+
+    # упреждающая обработка: этапы SPECULATIVE_STAGES запускаются в фоне, пока редактор вводит
+    # текст (POST /process/speculative), и задание с тем же текстом забирает их результаты;
+    # у пользователя не больше SPECULATIVE_MAX_PER_USER прогонов, незабранные живут TTL секунд
+    SPECULATIVE_ENABLED = os.getenv("SPECULATIVE_ENABLED", "1") == "1"
+    SPECULATIVE_STAGES = os.getenv("SPECULATIVE_STAGES", "classification,freshness_check")
+    SPECULATIVE_MIN_CHARS = int(os.getenv("SPECULATIVE_MIN_CHARS", "200"))
+    SPECULATIVE_MAX_PER_USER = int(os.getenv("SPECULATIVE_MAX_PER_USER", "1"))
+    SPECULATIVE_TTL_SECONDS = float(os.getenv("SPECULATIVE_TTL_SECONDS", "120"))
+    SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "2"))
+    SPECULATIVE_DEBOUNCE_MS = int(os.getenv("SPECULATIVE_DEBOUNCE_MS", "800"))
+
+    # снимок конфигурации конвейера: как часто проверять версию в БД (сек)
+    CONFIG_CHECK_INTERVAL = float(os.getenv("CONFIG_CHECK_INTERVAL", "2"))
+
+    # хеджирование (включается в назначении этапа): порог запуска резервной модели,
+    # пока для основной модели не накоплено HEDGE_MIN_SAMPLES замеров для p90
+    HEDGE_DEFAULT_AFTER_MS = int(os.getenv("HEDGE_DEFAULT_AFTER_MS", "5000"))
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+    # кэш ответов моделей: срок хранения по умолчанию (сек, 0 — кэш выключен; назначение
+    # этапа может задать свой) и размер LRU в памяти каждого процесса (байт)
+    LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+    LLM_CACHE_MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+
+    # размер входа: текст новости длиннее INPUT_MAX_TOKENS (оценка, 0 — без лимита) отклоняется
+    # (reject) или обрезается (trim) до постановки в обработку; запрос к модели не отправляется,
+    # если не помещается в её окно контекста (context_window в параметрах модели) или бюджет
+    # входа (max_input_tokens модели, иначе INPUT_TOKEN_BUDGET; 0 — только окно контекста).
+    # При PIPELINE_CHUNKING INPUT_MAX_TOKENS — лимит фрагмента: текст ограничен
+    # INPUT_MAX_TOKENS * PIPELINE_CHUNK_MAX_CHUNKS
+    INPUT_MAX_TOKENS = int(os.getenv("INPUT_MAX_TOKENS", "16000"))
+    INPUT_OVERFLOW = os.getenv("INPUT_OVERFLOW", "reject")
+    INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", "0"))
+
+    # лимит длины ответа (max_tokens) этапа без лимита в назначении и параметрах модели: перцентиль длины последних
+    # ответов этапа этой моделью плюс запас (в пределах MIN..MAX), когда накоплено MIN_SAMPLES
+    # ответов; пересчитывается раз в REFRESH_SECONDS
+    OUTPUT_TOKENS_LEARNING = os.getenv("OUTPUT_TOKENS_LEARNING", "1") == "1"
+    OUTPUT_TOKENS_MIN_SAMPLES = int(os.getenv("OUTPUT_TOKENS_MIN_SAMPLES", "20"))
+    OUTPUT_TOKENS_PERCENTILE = float(os.getenv("OUTPUT_TOKENS_PERCENTILE", "0.99"))
+    OUTPUT_TOKENS_HEADROOM = float(os.getenv("OUTPUT_TOKENS_HEADROOM", "0.2"))
+    OUTPUT_TOKENS_MIN = int(os.getenv("OUTPUT_TOKENS_MIN", "64"))
+    OUTPUT_TOKENS_MAX = int(os.getenv("OUTPUT_TOKENS_MAX", "8192"))
+    OUTPUT_TOKENS_REFRESH_SECONDS = float(os.getenv("OUTPUT_TOKENS_REFRESH_SECONDS", "60"))
+
+    # почти-дубликаты: результаты этапов NEAR_DUPLICATE_STAGES берутся у уже обработанной
+    # новости со сходством текста (MinHash) не ниже порога, если она не старше MAX_AGE_HOURS
+    NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "1") == "1"
+    NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+    NEAR_DUPLICATE_STAGES = os.getenv("NEAR_DUPLICATE_STAGES",
+                                      "classification,freshness_check,freshness_search,freshness_analysis")
+    NEAR_DUPLICATE_MAX_AGE_HOURS = float(os.getenv("NEAR_DUPLICATE_MAX_AGE_HOURS", "24"))
+    NEAR_DUPLICATE_INDEX_PATH = os.getenv("NEAR_DUPLICATE_INDEX_PATH")  # по умолчанию instance/near_duplicates.idx
+    # как часто процесс удаляет отпечатки старше MAX_AGE_HOURS и сжимает файл индекса (0 — никогда)
+    NEAR_DUPLICATE_COMPACT_SECONDS = float(os.getenv("NEAR_DUPLICATE_COMPACT_SECONDS", "3600"))
 
 
 class DevConfig(Config):
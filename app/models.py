@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from flask_login import UserMixin
 from app.extensions import db
@@ -122,9 +123,16 @@ class AIModel(TimestampMixin, db.Model):
 class Stage(TimestampMixin, db.Model):
     """
     Этап обработки новостей (классификация, проверка на свежесть, анализ, рекомендации)
+
+    Этапы образуют граф: depends_on перечисляет имена этапов, результаты которых
+    нужны на входе. Помимо AI-этапов (kind="llm") бывают служебные шаги без модели,
+    например поиск (kind="search").
     """
     __tablename__ = "stages"
 
+    KIND_LLM = "llm"
+    KIND_SEARCH = "search"
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True,
                      nullable=False)  # classification, freshness_check, analysis, recommendations
@@ -132,33 +140,84 @@ class Stage(TimestampMixin, db.Model):
     description = db.Column(db.Text)
     order = db.Column(db.Integer, nullable=False, default=0)  # порядок отображения
     is_active = db.Column(db.Boolean, nullable=False, default=True)
+    kind = db.Column(db.String(16), nullable=False, default=KIND_LLM)  # llm | search
+    depends_on = db.Column(db.Text)  # JSON: ["freshness_check"] — имена этапов-зависимостей
 
     # Relationships
     assignments = db.relationship("StageAssignment", back_populates="stage", lazy="dynamic",
                                   cascade="all, delete-orphan")
 
+    @property
+    def dependencies(self) -> list:
+        """Имена этапов, от которых зависит этап"""
+        if not self.depends_on:
+            return []
+        try:
+            return list(json.loads(self.depends_on))
+        except (json.JSONDecodeError, TypeError):
+            return []
+
+    @property
+    def is_llm(self) -> bool:
+        return self.kind == self.KIND_LLM
+
     def __repr__(self):
-        return f"<Stage id={self.id} name={self.name!r} order={self.order}>"
+        return f"<Stage id={self.id} name={self.name!r} order={self.order} kind={self.kind!r}>"
 
 
 class StageAssignment(TimestampMixin, db.Model):
     """
     Назначение модели на этап обработки
+
+    При ошибке основной модели по очереди пробуются резервные из fallback_chain;
+    fallback_model_id — первая из них. С политикой "latency" основная и резервные
+    модели перед каждым запросом упорядочиваются по наблюдаемым времени ответа
+    и доле ошибок.
     """
     __tablename__ = "stage_assignments"
 
+    ROUTING_ORDERED = "ordered"  # сначала основная, затем резервные по порядку
+    ROUTING_LATENCY = "latency"  # сначала самая быстрая из исправных
+
     id = db.Column(db.Integer, primary_key=True)
     stage_id = db.Column(db.Integer, db.ForeignKey("stages.id", ondelete="CASCADE"), nullable=False)
     model_id = db.Column(db.Integer, db.ForeignKey("ai_models.id", ondelete="CASCADE"), nullable=False)
     fallback_model_id = db.Column(db.Integer, db.ForeignKey("ai_models.id", ondelete="SET NULL"))  # резервная модель
+    fallback_chain = db.Column(db.Text)  # JSON: [model_id, ...] — резервные модели по порядку
+    routing_policy = db.Column(db.String(16), nullable=False, default=ROUTING_ORDERED)  # ordered | latency
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     priority = db.Column(db.Integer, nullable=False, default=0)  # на случай нескольких назначений
+    timeout_seconds = db.Column(db.Integer)  # лимит времени этапа (включая fallback), None — без лимита
+    # хеджирование: запускать резервную модель параллельно, если основная не ответила за hedge_after_ms
+    hedge_enabled = db.Column(db.Boolean, nullable=False, default=False)
+    hedge_after_ms = db.Column(db.Integer)  # None — по наблюдаемому p90 основной модели
+    cache_ttl_seconds = db.Column(db.Integer)  # срок хранения ответов в кэше, None — LLM_CACHE_TTL_SECONDS, 0 — без кэша
+    # этапы одной группы с одной и той же моделью выполняются одним объединённым запросом
+    fusion_group = db.Column(db.String(64))
+    max_tokens = db.Column(db.Integer)  # лимит длины ответа, None — по наблюдаемой длине ответов этапа
 
     # Relationships
     stage = db.relationship("Stage", back_populates="assignments")
     model = db.relationship("AIModel", foreign_keys=[model_id], back_populates="stage_assignments")
     fallback_model = db.relationship("AIModel", foreign_keys=[fallback_model_id], back_populates="fallback_assignments")
 
+    @property
+    def fallback_model_ids(self) -> list:
+        """ID резервных моделей по порядку"""
+        if self.fallback_chain:
+            try:
+                return [int(model_id) for model_id in json.loads(self.fallback_chain)]
+            except (json.JSONDecodeError, TypeError, ValueError):
+                pass
+        return [self.fallback_model_id] if self.fallback_model_id else []
+
+    @property
+    def fallback_models(self) -> list:
+        """Резервные модели по порядку (AIModel)"""
+        model_ids = self.fallback_model_ids
+        models = {model.id: model for model in AIModel.query.filter(AIModel.id.in_(model_ids))} if model_ids else {}
+        return [models[model_id] for model_id in model_ids if model_id in models]
+
     def __repr__(self):
         return f"<StageAssignment stage={self.stage.name if self.stage else None} model={self.model.name if self.model else None}>"
 
@@ -206,3 +265,176 @@ class UserPrompt(TimestampMixin, db.Model):
 
     def __repr__(self):
         return f"<UserPrompt id={self.id} user_id={self.user_id} stage={self.stage.name if self.stage else None} customized={self.is_customized}>"
+
+
+# ============================================================================
+# Фоновые задания обработки новостей
+# ============================================================================
+
+class ProcessingJob(TimestampMixin, db.Model):
+    """
+    Задание на обработку новости через конвейер.
+    POST /process ставит задание в очередь, пул исполнителей выполняет его,
+    а клиент опрашивает GET /jobs/<id> и получает частичные и итоговые результаты.
+    """
+    __tablename__ = "processing_jobs"
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4().hex
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default=STATUS_QUEUED, index=True)
+    news_text = db.Column(db.Text, nullable=False)
+    stage_ids = db.Column(db.Text, nullable=False)  # JSON: [1, 2, 3]
+    deadline_seconds = db.Column(db.Float)  # общий лимит времени обработки (от начала выполнения)
+    priority = db.Column(db.String(16), nullable=False, default="normal")  # interactive, normal, bulk
+    results = db.Column(db.Text)  # JSON: результаты этапов (пополняется по мере выполнения)
+    success = db.Column(db.Boolean)  # итог конвейера, None пока задание не завершено
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    # исполнитель, которому принадлежит задание (хост:PID:суффикс), и его последний сигнал жизни;
+    # задание без сигнала дольше JOB_STALE_SECONDS возвращается в очередь
+    worker_id = db.Column(db.String(128), index=True)
+    heartbeat_at = db.Column(db.DateTime)
+
+    user = db.relationship("User", backref=db.backref("processing_jobs", lazy="dynamic",
+                                                      cascade="all, delete-orphan"))
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def get_stage_ids(self) -> list:
+        return json.loads(self.stage_ids) if self.stage_ids else []
+
+    def get_results(self) -> list:
+        return json.loads(self.results) if self.results else []
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "success": self.success,
+            "results": self.get_results(),
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<ProcessingJob id={self.id} user_id={self.user_id} status={self.status}>"
+
+
+# ============================================================================
+# Версия конфигурации конвейера
+# ============================================================================
+
+class ConfigState(TimestampMixin, db.Model):
+    """
+    Версия конфигурации конвейера (единственная строка id=1).
+    Увеличивается при любом изменении провайдеров, моделей, назначений и промптов;
+    процессы перестраивают снимок конфигурации (ConfigSnapshot), увидев новую версию.
+    """
+    __tablename__ = "config_state"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<ConfigState version={self.version}>"
+
+
+# ============================================================================
+# Кэш ответов AI моделей
+# ============================================================================
+
+class LLMCacheEntry(db.Model):
+    """
+    Ответ модели, сохранённый по хешу запроса (сообщения, модель, параметры).
+    Общий для всех процессов; перед ним — LRU-кэш в памяти процесса (LLMCache).
+    """
+    __tablename__ = "llm_cache"
+
+    key = db.Column(db.String(64), primary_key=True)  # sha256 нормализованного запроса
+    stage_id = db.Column(db.Integer, index=True)  # для сброса при изменении промпта или назначения этапа
+    model_id = db.Column(db.Integer, index=True)  # для сброса при изменении модели или провайдера
+    result = db.Column(db.Text, nullable=False)  # JSON: {"content", "model", "usage"}
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<LLMCacheEntry key={self.key[:12]} stage_id={self.stage_id} model_id={self.model_id}>"
+
+
+# ============================================================================
+# Длина ответов моделей по этапам (подбор max_tokens)
+# ============================================================================
+
+class StageOutputSample(db.Model):
+    """
+    Длина ответа модели на запрос этапа (completion_tokens из usage провайдера).
+    По последним ответам этапа и модели подбирается max_tokens (OutputTokenLimits).
+    """
+    __tablename__ = "stage_output_samples"
+    __table_args__ = (db.Index("ix_stage_output_samples_stage_model", "stage_id", "model_id", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    stage_id = db.Column(db.Integer, nullable=False)
+    model_id = db.Column(db.Integer, nullable=False)
+    output_tokens = db.Column(db.Integer, nullable=False)
+    max_tokens = db.Column(db.Integer, nullable=False)  # лимит, с которым выполнялся запрос
+    truncated = db.Column(db.Boolean, nullable=False, default=False)  # ответ упёрся в max_tokens
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<StageOutputSample stage_id={self.stage_id} model_id={self.model_id} tokens={self.output_tokens}>"
+
+
+# ============================================================================
+# Отпечатки обработанных новостей (поиск почти-дубликатов)
+# ============================================================================
+
+class NewsFingerprint(db.Model):
+    """
+    MinHash-подпись обработанной новости и результаты этапов, которые можно
+    переиспользовать для её почти-дубликатов (та же новость с другой ленты).
+    Подписи дублируются в файле индекса (NearDuplicateIndex); таблица нужна,
+    чтобы достать результаты и восстановить файл, если он потерян.
+    """
+    __tablename__ = "news_fingerprints"
+
+    id = db.Column(db.Integer, primary_key=True)
+    signature = db.Column(db.LargeBinary, nullable=False)  # MinHash: uint32 × NUM_PERM
+    results = db.Column(db.Text, nullable=False)  # JSON: {stage_name: {"key", "content", "model_used"}}
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def get_results(self) -> dict:
+        return json.loads(self.results) if self.results else {}
+
+    def __repr__(self):
+        return f"<NewsFingerprint id={self.id}>"
+
+
+# ============================================================================
+# Лимиты частоты запросов к провайдерам (общие для всех процессов)
+# ============================================================================
+
+class RateLimitBucket(db.Model):
+    """
+    Корзина токенов (token bucket) лимита запросов или токенов в минуту.
+    Хранится в БД, чтобы лимит соблюдался всеми процессами (воркерами) вместе.
+    """
+    __tablename__ = "rate_limit_buckets"
+
+    key = db.Column(db.String(128), primary_key=True)  # provider:3:rpm, model:5:tpm, search:brave:rpm
+    tokens = db.Column(db.Float, nullable=False)  # остаток (может быть отрицательным после сверки токенов)
+    updated_at = db.Column(db.Float, nullable=False)  # unix-время последнего пересчёта остатка
+
+    def __repr__(self):
+        return f"<RateLimitBucket key={self.key} tokens={self.tokens:.1f}>"
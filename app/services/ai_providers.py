@@ -1,11 +1,32 @@
 """
 Сервис для работы с AI провайдерами (OpenAI, Google, Anthropic)
 """
+import hashlib
 import json
+import threading
+import time
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
 from typing import Dict, Tuple
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Callable, Sequence
+from flask import current_app
+from app.models import StageAssignment
+from app.services import provider_errors
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.deadline import Deadline
+from app.services.http_transport import HttpTransport
+from app.services.llm_cache import LLMCache
+from app.services.output_limits import OutputTokenLimits
+from app.services.priority import PriorityGate, NORMAL, normalize, parse_pairs
+from app.services.rate_limiter import RateLimiter
+from app.services.retry_policy import RetryPolicy
+from app.services.token_budget import TokenBudget
+
+# Лимит длины ответа, если он не задан ни в запросе, ни в параметрах модели
+DEFAULT_MAX_TOKENS = 1000
 
 
 class AIProviderError(Exception):
@@ -32,7 +53,7 @@ def test_openai_connection(api_key: str, base_url: str = None) -> Tuple[bool, st
     }
 
     try:
-        response = requests.get(endpoint, headers=headers, timeout=10)
+        response = HttpTransport.get(endpoint, headers=headers, timeout=10)
 
         if response.status_code == 200:
             data = response.json()
@@ -68,7 +89,7 @@ def test_google_connection(api_key: str, base_url: str = None) -> Tuple[bool, st
     endpoint = f"{url}/v1beta/models?key={api_key}"
 
     try:
-        response = requests.get(endpoint, timeout=10)
+        response = HttpTransport.get(endpoint, timeout=10)
 
         if response.status_code == 200:
             data = response.json()
@@ -121,7 +142,7 @@ def test_anthropic_connection(api_key: str, base_url: str = None) -> Tuple[bool,
     }
 
     try:
-        response = requests.post(endpoint, headers=headers, json=payload, timeout=15)
+        response = HttpTransport.post(endpoint, headers=headers, json=payload, timeout=15)
 
         if response.status_code == 200:
             return True, "✅ Подключение успешно! API ключ валиден"
@@ -188,17 +209,27 @@ class BaseAIProvider(ABC):
     Базовый абстрактный класс для всех AI провайдеров
     """
 
+    # Префикс сообщений об ошибках API ("OpenAI API Error 429: ...")
+    error_prefix = "API Error"
+
     def __init__(self, api_key: str, base_url: Optional[str] = None, additional_config: Optional[Dict] = None):
         """
         Args:
             api_key: API ключ провайдера
             base_url: Базовый URL (опционально, для кастомных endpoint'ов)
-            additional_config: Дополнительная конфигурация (dict)
+            additional_config: Дополнительная конфигурация (dict); timeout — таймаут
+                               чтения ответа, connect_timeout — установки соединения (сек),
+                               prompt_cache — кэширование системного промпта на стороне
+                               провайдера (по умолчанию включено); max_retries, retry_base_delay,
+                               retry_max_delay — повторы при временных ошибках (RetryPolicy)
         """
         self.api_key = api_key
         self.base_url = base_url or self.get_default_base_url()
         self.additional_config = additional_config or {}
         self.timeout = self.additional_config.get('timeout', 30)
+        self.connect_timeout = self.additional_config.get('connect_timeout', 5)
+        self.prompt_cache = bool(self.additional_config.get('prompt_cache', True))
+        self.retry_policy = RetryPolicy.from_config(self.additional_config)
 
     @abstractmethod
     def get_default_base_url(self) -> str:
@@ -209,6 +240,7 @@ class BaseAIProvider(ABC):
     def send_message(self,
                      model: str,
                      messages: List[Dict[str, str]],
+                     deadline: Optional[Deadline] = None,
                      **kwargs) -> Dict[str, Any]:
         """
         Отправить сообщение модели
@@ -216,6 +248,7 @@ class BaseAIProvider(ABC):
         Args:
             model: Идентификатор модели (api_identifier из БД)
             messages: Список сообщений в формате [{"role": "user", "content": "..."}]
+            deadline: Крайний срок запроса (таймауты HTTP урезаются до остатка)
             **kwargs: Дополнительные параметры (temperature, max_tokens, etc.)
 
         Returns:
@@ -224,12 +257,55 @@ class BaseAIProvider(ABC):
                 "success": bool,
                 "content": str,  # текст ответа
                 "model": str,    # использованная модель
-                "usage": dict,   # статистика использования токенов
-                "error": str     # сообщение об ошибке (если success=False)
+                "usage": dict,   # статистика использования токенов: prompt/completion/total_tokens,
+                                 # cache_read_tokens/cache_write_tokens — токены промпта,
+                                 # прочитанные из кэша провайдера / записанные в него
+                "error": str,    # сообщение об ошибке (если success=False)
+                "timed_out": bool,  # только при ошибке: истёк таймаут или deadline
+                "error_type": str,  # только при ошибке: класс ошибки (provider_errors)
+                "retries": int   # только если были повторы после временных ошибок
             }
         """
         pass
 
+    def stream_message(self,
+                       model: str,
+                       messages: List[Dict[str, str]],
+                       deadline: Optional[Deadline] = None,
+                       **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Отправить сообщение модели и получать ответ по мере генерации
+
+        По умолчанию выполняет обычный запрос и отдаёт ответ одним фрагментом;
+        провайдеры с потоковым API переопределяют метод.
+
+        Yields:
+            {"type": "delta", "text": str}  — очередной фрагмент текста
+            {"type": "done", "content": str, "model": str, "usage": dict}  — генерация завершена
+            {"type": "error", "error": str, "timed_out": bool, "error_type": str}  — ошибка
+                (последнее событие потока)
+            В done и error есть "retries", если запрос повторялся после временных ошибок
+        """
+        result = self.send_message(model, messages, deadline=deadline, **kwargs)
+        retries = {"retries": result["retries"]} if result.get("retries") else {}
+
+        if not result["success"]:
+            yield {"type": "error", "error": result["error"], "timed_out": result.get("timed_out", False),
+                   "error_type": result.get("error_type"), **retries}
+            return
+
+        if result["content"]:
+            yield {"type": "delta", "text": result["content"]}
+        yield {"type": "done", "content": result["content"], "model": result["model"], "usage": result["usage"],
+               **retries}
+
+    def close(self) -> None:
+        """
+        Освободить ресурсы клиента (вызывается ProviderRegistry, когда клиент заменён
+        и последний запрос через него завершился)
+        """
+        pass
+
     def validate_config(self) -> tuple[bool, str]:
         """
         Проверить корректность конфигурации
@@ -241,22 +317,278 @@ class BaseAIProvider(ABC):
             return False, "API ключ не указан"
         return True, "Конфигурация корректна"
 
+    # ------------------------------------------------------------------------
+    # Общие помощники для HTTP-запросов
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _error_result(model: str, error: str, timed_out: bool = False,
+                      error_type: Optional[str] = None) -> Dict[str, Any]:
+        """Результат send_message для ошибки (error_type по умолчанию — timeout или unknown)"""
+        result = {
+            "success": False,
+            "content": None,
+            "model": model,
+            "usage": {},
+            "error": error,
+            "error_type": error_type or (provider_errors.TIMEOUT if timed_out else provider_errors.UNKNOWN)
+        }
+        if timed_out:
+            result["timed_out"] = True
+        return result
+
+    def _format_http_error(self, response) -> str:
+        """Сообщение об ошибке по HTTP-ответу провайдера"""
+        try:
+            error_data = response.json() if response.text else {}
+        except ValueError:
+            error_data = {}
+        if isinstance(error_data, list) and error_data:
+            error_data = error_data[0]
+        error = error_data.get("error", {}) if isinstance(error_data, dict) else {}
+        error_message = error.get("message", response.text[:200]) if isinstance(error, dict) else response.text[:200]
+        return f"{self.error_prefix} {response.status_code}: {error_message}"
+
+    def _post(self, model: str, request: Dict[str, Any], parse_response,
+              deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Выполнить запрос и привести ответ к унифицированному формату send_message
+
+        Временные ошибки (429, 5xx, обрыв соединения) повторяются по retry_policy;
+        число повторов — в поле "retries" результата.
+
+        Args:
+            model: Идентификатор модели
+            request: {"endpoint", "headers", "payload", "params"}
+            parse_response: Функция (data) -> Dict, разбирающая успешный JSON-ответ
+            deadline: Крайний срок запроса
+        """
+        retries = 0
+        while True:
+            result, delay = self._post_once(model, request, parse_response, deadline, retries)
+            if retries:
+                result["retries"] = retries
+            if delay is None or not self.retry_policy.sleep(delay, deadline):
+                return result
+            retries += 1
+
+    def _post_once(self, model: str, request: Dict[str, Any], parse_response,
+                   deadline: Optional[Deadline], retries: int) -> Tuple[Dict[str, Any], Optional[float]]:
+        """
+        Одна попытка запроса
+
+        Returns:
+            Tuple (результат, пауза перед повтором или None — не повторять)
+        """
+        if deadline and deadline.expired:
+            return self._error_result(model, "Превышено время ожидания ответа", timed_out=True), None
+
+        try:
+            response = HttpTransport.post(
+                request["endpoint"],
+                params=request.get("params"),
+                headers=request["headers"],
+                json=request["payload"],
+                timeout=Deadline.http_timeout(deadline, self.connect_timeout, self.timeout)
+            )
+
+            if response.status_code == 200:
+                return parse_response(response.json()), None
+
+            delay = None
+            if self.retry_policy.is_retryable(response.status_code):
+                delay = self.retry_policy.next_delay(retries, response, deadline)
+            return self._error_result(model, self._format_http_error(response),
+                                      error_type=provider_errors.classify_status(response.status_code)), delay
+
+        except requests.exceptions.Timeout:
+            return self._error_result(model, "Превышено время ожидания ответа", timed_out=True), None
+        except requests.exceptions.ConnectionError:
+            return (self._error_result(model, f"Ошибка подключения к {self.base_url}",
+                                       error_type=provider_errors.NETWORK),
+                    self.retry_policy.next_delay(retries, None, deadline))
+        except Exception as e:
+            return self._error_result(model, f"Неизвестная ошибка: {str(e)}"), None
+
+    def _stream(self, model: str, request: Dict[str, Any], handle_event,
+                deadline: Optional[Deadline] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Выполнить потоковый запрос (Server-Sent Events) и отдавать нормализованные события
+
+        Args:
+            model: Идентификатор модели
+            request: {"endpoint", "headers", "payload", "params"}
+            handle_event: Функция (event, data, state) -> Iterable[Dict], превращающая
+                          SSE-событие провайдера в события stream_message. state —
+                          dict с ключами "model" и "usage", которые функция обновляет
+            deadline: Крайний срок запроса; проверяется и между фрагментами ответа,
+                      поэтому медленная генерация не может его превысить
+
+        Временные ошибки повторяются по retry_policy, только пока не получено
+        ни одного фрагмента ответа.
+        """
+        state = {"model": model, "usage": {}}
+        parts = []
+        retries = {}
+        timed_out = {"type": "error", "error": "Превышено время ожидания ответа", "timed_out": True,
+                     "error_type": provider_errors.TIMEOUT}
+
+        try:
+            while True:
+                if deadline and deadline.expired:
+                    yield {**timed_out, **retries}
+                    return
+
+                try:
+                    response = HttpTransport.post(
+                        request["endpoint"],
+                        params=request.get("params"),
+                        headers=request["headers"],
+                        json=request["payload"],
+                        timeout=Deadline.http_timeout(deadline, self.connect_timeout, self.timeout),
+                        stream=True
+                    )
+                except requests.exceptions.Timeout:
+                    raise
+                except requests.exceptions.ConnectionError:
+                    error = f"Ошибка подключения к {self.base_url}"
+                    error_type = provider_errors.NETWORK
+                    delay = self.retry_policy.next_delay(retries.get("retries", 0), None, deadline)
+                else:
+                    if response.status_code == 200:
+                        break
+                    with response:
+                        error = self._format_http_error(response)
+                        error_type = provider_errors.classify_status(response.status_code)
+                        delay = None
+                        if self.retry_policy.is_retryable(response.status_code):
+                            delay = self.retry_policy.next_delay(retries.get("retries", 0), response, deadline)
+
+                if delay is None:
+                    yield {"type": "error", "error": error, "error_type": error_type, **retries}
+                    return
+                if not self.retry_policy.sleep(delay, deadline):
+                    yield {**timed_out, **retries}
+                    return
+                retries["retries"] = retries.get("retries", 0) + 1
+
+            with response:
+                response.encoding = "utf-8"
+                for event, data in self._iter_sse(response):
+                    if deadline and deadline.expired:
+                        yield {**timed_out, **retries}
+                        return
+                    for item in handle_event(event, data, state):
+                        if item["type"] == "error":
+                            yield {"error_type": provider_errors.SERVER, **item, **retries}
+                            return
+                        parts.append(item["text"])
+                        yield item
+
+        except requests.exceptions.Timeout:
+            yield {**timed_out, **retries}
+            return
+        except requests.exceptions.ConnectionError:
+            yield {"type": "error", "error": f"Ошибка подключения к {self.base_url}",
+                   "error_type": provider_errors.NETWORK, **retries}
+            return
+        except Exception as e:
+            yield {"type": "error", "error": f"Неизвестная ошибка: {str(e)}",
+                   "error_type": provider_errors.UNKNOWN, **retries}
+            return
+
+        yield {"type": "done", "content": "".join(parts), "model": state["model"], "usage": state["usage"],
+               **retries}
+
+    @staticmethod
+    def _iter_sse(response) -> Iterator[Tuple[Optional[str], str]]:
+        """Разбор потока Server-Sent Events на пары (event, data)"""
+        event = None
+        data_lines = []
+
+        for line in response.iter_lines(decode_unicode=True):
+            if line == "":
+                if data_lines:
+                    yield event, "\n".join(data_lines)
+                event = None
+                data_lines = []
+                continue
+            if line.startswith(":"):
+                continue
+
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            if field == "event":
+                event = value
+            elif field == "data":
+                data_lines.append(value)
+
+        if data_lines:
+            yield event, "\n".join(data_lines)
+
 
 class OpenAIProvider(BaseAIProvider):
     """
     Провайдер для OpenAI API (GPT-4, GPT-3.5, etc.)
     """
 
+    error_prefix = "OpenAI API Error"
+
     def get_default_base_url(self) -> str:
         return "https://api.openai.com/v1"
 
     def send_message(self,
                      model: str,
                      messages: List[Dict[str, str]],
+                     deadline: Optional[Deadline] = None,
                      **kwargs) -> Dict[str, Any]:
         """
         Отправить сообщение в OpenAI API
         """
+        def parse_response(data: Dict) -> Dict[str, Any]:
+            return {
+                "success": True,
+                "content": data["choices"][0]["message"]["content"],
+                "model": data["model"],
+                "usage": self._convert_usage(data.get("usage")),
+                "error": None
+            }
+
+        return self._post(model, self._build_request(model, messages, **kwargs), parse_response, deadline)
+
+    def stream_message(self,
+                       model: str,
+                       messages: List[Dict[str, str]],
+                       deadline: Optional[Deadline] = None,
+                       **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковый ответ OpenAI API (stream=true, usage в последнем чанке)
+        """
+        request = self._build_request(model, messages, **kwargs)
+        request["payload"]["stream"] = True
+        request["payload"]["stream_options"] = {"include_usage": True}
+
+        def handle_event(event, data, state):
+            if data == "[DONE]":
+                return
+            chunk = json.loads(data)
+            if "error" in chunk:
+                yield {"type": "error", "error": f"{self.error_prefix}: {chunk['error'].get('message', '')}",
+                       "error_type": provider_errors.classify_name(chunk["error"].get("type"))}
+                return
+            state["model"] = chunk.get("model", state["model"])
+            if chunk.get("usage"):
+                state["usage"] = self._convert_usage(chunk["usage"])
+            for choice in chunk.get("choices", []):
+                text = choice.get("delta", {}).get("content")
+                if text:
+                    yield {"type": "delta", "text": text}
+
+        return self._stream(model, request, handle_event, deadline)
+
+    def _build_request(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """Сформировать запрос к Chat Completions API"""
         endpoint = f"{self.base_url}/chat/completions"
 
         headers = {
@@ -269,7 +601,7 @@ class OpenAIProvider(BaseAIProvider):
             "model": model,
             "messages": messages,
             "temperature": kwargs.get("temperature", 0.7),
-            "max_tokens": kwargs.get("max_tokens", 1000),
+            "max_tokens": kwargs.get("max_tokens", DEFAULT_MAX_TOKENS),
         }
 
         # Дополнительные параметры если есть
@@ -280,80 +612,120 @@ class OpenAIProvider(BaseAIProvider):
         if "presence_penalty" in kwargs:
             payload["presence_penalty"] = kwargs["presence_penalty"]
 
-        try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload,
-                timeout=self.timeout
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    "success": True,
-                    "content": data["choices"][0]["message"]["content"],
-                    "model": data["model"],
-                    "usage": data.get("usage", {}),
-                    "error": None
-                }
-            else:
-                error_data = response.json() if response.text else {}
-                error_message = error_data.get("error", {}).get("message", response.text[:200])
+        # OpenAI кэширует общий префикс запросов автоматически; ключ по системному
+        # промпту направляет запросы с одним промптом на одни и те же серверы.
+        # OpenAI-совместимые API (свой base_url) параметр могут не знать
+        system_prompt = "".join(msg["content"] for msg in messages if msg["role"] == "system")
+        if self.prompt_cache and system_prompt and self.base_url == self.get_default_base_url():
+            payload["prompt_cache_key"] = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:32]
 
-                return {
-                    "success": False,
-                    "content": None,
-                    "model": model,
-                    "usage": {},
-                    "error": f"OpenAI API Error {response.status_code}: {error_message}"
-                }
+        return {"endpoint": endpoint, "headers": headers, "payload": payload}
 
-        except requests.exceptions.Timeout:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": "Превышено время ожидания ответа"
-            }
-        except requests.exceptions.ConnectionError:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Ошибка подключения к {self.base_url}"
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Неизвестная ошибка: {str(e)}"
-            }
+    @staticmethod
+    def _convert_usage(usage: Optional[Dict]) -> Dict[str, int]:
+        """usage OpenAI + cache_read_tokens (закэшированная часть промпта)"""
+        if not usage:
+            return {}
+        result = dict(usage)
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached_tokens is not None:
+            result["cache_read_tokens"] = cached_tokens
+        return result
 
 
 class GoogleProvider(BaseAIProvider):
     """
     Провайдер для Google AI (Gemini)
+
+    Системный промпт передаётся в systemInstruction. Длинные промпты (не короче
+    context_cache_min_chars символов) кладутся в контекстный кэш Gemini
+    (cachedContents, срок — context_cache_ttl сек), и запросы ссылаются на него.
     """
 
+    error_prefix = "Google AI API Error"
+
+    # (base_url, ключ, модель, хеш промпта) -> (имя cachedContent или None, когда пересоздать)
+    _context_caches: Dict[Tuple[str, str, str, str], Tuple[Optional[str], float]] = {}
+    _context_cache_lock = threading.Lock()
+
     def get_default_base_url(self) -> str:
         return "https://generativelanguage.googleapis.com"
 
     def send_message(self,
                      model: str,
                      messages: List[Dict[str, str]],
+                     deadline: Optional[Deadline] = None,
                      **kwargs) -> Dict[str, Any]:
         """
         Отправить сообщение в Google AI API
 
         Note: Google Gemini использует другой формат сообщений
         """
-        endpoint = f"{self.base_url}/v1beta/models/{model}:generateContent"
+        def parse_response(data: Dict) -> Dict[str, Any]:
+            return {
+                "success": True,
+                "content": self._extract_text(data),
+                "model": model,
+                "usage": self._extract_usage(data),
+                "error": None
+            }
 
+        request = self._build_request(model, messages, deadline=deadline, **kwargs)
+        request["endpoint"] = f"{self.base_url}/v1beta/models/{model}:generateContent"
+        result = self._post(model, request, parse_response, deadline)
+
+        if "cachedContent" in request["payload"] and self._is_context_cache_error(result):
+            # Кэш удалён или истёк раньше срока — повторяем без него (прочие ошибки не повторяем:
+            # при 429 и 5xx повтор только добавил бы нагрузки)
+            self._forget_context_cache(request["payload"]["cachedContent"])
+            request = self._build_request(model, messages, use_context_cache=False, **kwargs)
+            request["endpoint"] = f"{self.base_url}/v1beta/models/{model}:generateContent"
+            result = self._post(model, request, parse_response, deadline)
+
+        return result
+
+    def stream_message(self,
+                       model: str,
+                       messages: List[Dict[str, str]],
+                       deadline: Optional[Deadline] = None,
+                       **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковый ответ Google AI API (streamGenerateContent?alt=sse)
+        """
+        request = self._build_request(model, messages, deadline=deadline, **kwargs)
+        request["endpoint"] = f"{self.base_url}/v1beta/models/{model}:streamGenerateContent"
+        request["params"]["alt"] = "sse"
+        cached_content = request["payload"].get("cachedContent")
+
+        def handle_event(event, data, state):
+            chunk = json.loads(data)
+            if "error" in chunk:
+                yield {"type": "error", "error": f"{self.error_prefix}: {chunk['error'].get('message', '')}",
+                       "error_type": provider_errors.classify_name(chunk["error"].get("status"))}
+                return
+            if "usageMetadata" in chunk:
+                state["usage"] = self._extract_usage(chunk)
+            text = self._extract_text(chunk)
+            if text:
+                yield {"type": "delta", "text": text}
+
+        for event in self._stream(model, request, handle_event, deadline):
+            if event["type"] == "error" and cached_content and self._is_context_cache_error(event):
+                # Следующий запрос создаст контекстный кэш заново
+                self._forget_context_cache(cached_content)
+            yield event
+
+    @staticmethod
+    def _is_context_cache_error(result: Dict[str, Any]) -> bool:
+        """Отклонён ли запрос из-за контекстного кэша (400/404 с упоминанием cachedContent)"""
+        error = (result.get("error") or "").lower().replace(" ", "")
+        return result.get("error_type") in (provider_errors.BAD_REQUEST, provider_errors.NOT_FOUND) \
+            and "cachedcontent" in error
+
+    def _build_request(self, model: str, messages: List[Dict[str, str]],
+                       deadline: Optional[Deadline] = None,
+                       use_context_cache: bool = True, **kwargs) -> Dict[str, Any]:
+        """Сформировать запрос к Gemini API (endpoint задаёт вызывающий метод)"""
         # Google использует API key в query параметрах
         params = {"key": self.api_key}
 
@@ -361,13 +733,14 @@ class GoogleProvider(BaseAIProvider):
             "Content-Type": "application/json"
         }
 
-        # Конвертируем OpenAI-формат сообщений в Google-формат
-        contents = self._convert_messages_to_google_format(messages)
+        # Системный промпт — отдельно, остальное конвертируем в Google-формат
+        system_prompt = "\n\n".join(msg["content"] for msg in messages if msg["role"] == "system")
+        contents = self._convert_messages_to_google_format([msg for msg in messages if msg["role"] != "system"])
 
         # Параметры генерации
         generation_config = {
             "temperature": kwargs.get("temperature", 0.7),
-            "maxOutputTokens": kwargs.get("max_tokens", 1000),
+            "maxOutputTokens": kwargs.get("max_tokens", DEFAULT_MAX_TOKENS),
         }
 
         if "top_p" in kwargs:
@@ -380,77 +753,96 @@ class GoogleProvider(BaseAIProvider):
             "generationConfig": generation_config
         }
 
+        if system_prompt:
+            cached_content = None
+            if use_context_cache and self.prompt_cache:
+                cached_content = self._context_cache_for(model, system_prompt, deadline)
+            if cached_content:
+                payload["cachedContent"] = cached_content
+            else:
+                payload["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+
+        return {"endpoint": None, "params": params, "headers": headers, "payload": payload}
+
+    def _context_cache_for(self, model: str, system_prompt: str,
+                           deadline: Optional[Deadline] = None) -> Optional[str]:
+        """
+        Имя контекстного кэша Gemini с системным промптом (создаётся при первом запросе)
+
+        Неудачная попытка (например, промпт короче минимума модели) тоже
+        запоминается на несколько минут, чтобы не повторять её на каждом запросе.
+
+        Returns:
+            Имя cachedContents/... или None, если кэш не используется
+        """
+        if len(system_prompt) < int(self.additional_config.get("context_cache_min_chars", 12000)):
+            return None
+
+        ttl = int(self.additional_config.get("context_cache_ttl", 3600))
+        key = (self.base_url, hashlib.sha256(self.api_key.encode("utf-8")).hexdigest(), model,
+               hashlib.sha256(system_prompt.encode("utf-8")).hexdigest())
+
+        now = time.monotonic()
+        with self._context_cache_lock:
+            entry = self._context_caches.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+        if deadline and deadline.expired:
+            return None
+
+        name = None
         try:
-            response = requests.post(
-                endpoint,
-                params=params,
-                headers=headers,
-                json=payload,
-                timeout=self.timeout
+            response = HttpTransport.post(
+                f"{self.base_url}/v1beta/cachedContents",
+                params={"key": self.api_key},
+                headers={"Content-Type": "application/json"},
+                json={
+                    "model": f"models/{model}",
+                    "systemInstruction": {"parts": [{"text": system_prompt}]},
+                    "ttl": f"{ttl}s"
+                },
+                timeout=Deadline.http_timeout(deadline, self.connect_timeout, self.timeout)
             )
-
             if response.status_code == 200:
-                data = response.json()
-
-                # Извлекаем текст ответа
-                content = ""
-                if "candidates" in data and len(data["candidates"]) > 0:
-                    candidate = data["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        content = candidate["content"]["parts"][0].get("text", "")
-
-                # Извлекаем usage если есть
-                usage = {}
-                if "usageMetadata" in data:
-                    usage = {
-                        "prompt_tokens": data["usageMetadata"].get("promptTokenCount", 0),
-                        "completion_tokens": data["usageMetadata"].get("candidatesTokenCount", 0),
-                        "total_tokens": data["usageMetadata"].get("totalTokenCount", 0)
-                    }
-
-                return {
-                    "success": True,
-                    "content": content,
-                    "model": model,
-                    "usage": usage,
-                    "error": None
-                }
-            else:
-                error_data = response.json() if response.text else {}
-                error_message = error_data.get("error", {}).get("message", response.text[:200])
+                name = response.json().get("name")
+        except (requests.exceptions.RequestException, ValueError):
+            pass
 
-                return {
-                    "success": False,
-                    "content": None,
-                    "model": model,
-                    "usage": {},
-                    "error": f"Google AI API Error {response.status_code}: {error_message}"
-                }
+        # Созданный кэш пересоздаём за минуту до истечения
+        refresh_after = max(ttl - 60, 1) if name else min(ttl, 300)
+        with self._context_cache_lock:
+            self._context_caches[key] = (name, now + refresh_after)
+        return name
 
-        except requests.exceptions.Timeout:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": "Превышено время ожидания ответа"
-            }
-        except requests.exceptions.ConnectionError:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Ошибка подключения к {self.base_url}"
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Неизвестная ошибка: {str(e)}"
+    @classmethod
+    def _forget_context_cache(cls, name: str) -> None:
+        """Забыть контекстный кэш (после ошибки запроса, который на него ссылался)"""
+        with cls._context_cache_lock:
+            for key in [key for key, entry in cls._context_caches.items() if entry[0] == name]:
+                del cls._context_caches[key]
+
+    @staticmethod
+    def _extract_text(data: Dict) -> str:
+        """Извлечь текст ответа из ответа (или чанка) Gemini"""
+        content = ""
+        if "candidates" in data and len(data["candidates"]) > 0:
+            candidate = data["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                content = "".join(part.get("text", "") for part in candidate["content"]["parts"])
+        return content
+
+    @staticmethod
+    def _extract_usage(data: Dict) -> Dict[str, int]:
+        """Извлечь usage из ответа Gemini"""
+        usage = {}
+        if "usageMetadata" in data:
+            usage = {
+                "prompt_tokens": data["usageMetadata"].get("promptTokenCount", 0),
+                "completion_tokens": data["usageMetadata"].get("candidatesTokenCount", 0),
+                "total_tokens": data["usageMetadata"].get("totalTokenCount", 0),
+                "cache_read_tokens": data["usageMetadata"].get("cachedContentTokenCount", 0)
             }
+        return usage
 
     def _convert_messages_to_google_format(self, messages: List[Dict[str, str]]) -> List[Dict]:
         """
@@ -480,16 +872,72 @@ class AnthropicProvider(BaseAIProvider):
     Провайдер для Anthropic API (Claude)
     """
 
+    error_prefix = "Anthropic API Error"
+
     def get_default_base_url(self) -> str:
         return "https://api.anthropic.com"
 
     def send_message(self,
                      model: str,
                      messages: List[Dict[str, str]],
+                     deadline: Optional[Deadline] = None,
                      **kwargs) -> Dict[str, Any]:
         """
         Отправить сообщение в Anthropic API
         """
+        def parse_response(data: Dict) -> Dict[str, Any]:
+            # Извлекаем текст ответа
+            content = ""
+            if "content" in data and len(data["content"]) > 0:
+                content = data["content"][0].get("text", "")
+
+            return {
+                "success": True,
+                "content": content,
+                "model": data.get("model", model),
+                "usage": self._convert_usage(data.get("usage")),
+                "error": None
+            }
+
+        return self._post(model, self._build_request(model, messages, **kwargs), parse_response, deadline)
+
+    def stream_message(self,
+                       model: str,
+                       messages: List[Dict[str, str]],
+                       deadline: Optional[Deadline] = None,
+                       **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковый ответ Anthropic Messages API (stream=true)
+        """
+        request = self._build_request(model, messages, **kwargs)
+        request["payload"]["stream"] = True
+        raw_usage = {}
+
+        def handle_event(event, data, state):
+            chunk = json.loads(data)
+            chunk_type = chunk.get("type", event)
+
+            if chunk_type == "error":
+                error = chunk.get("error", {})
+                yield {"type": "error", "error": f"{self.error_prefix}: {error.get('message', '')}",
+                       "error_type": provider_errors.classify_name(error.get("type"))}
+            elif chunk_type == "message_start":
+                message = chunk.get("message", {})
+                state["model"] = message.get("model", state["model"])
+                raw_usage.update(message.get("usage", {}))
+                state["usage"] = self._convert_usage(raw_usage)
+            elif chunk_type == "content_block_delta":
+                text = chunk.get("delta", {}).get("text")
+                if text:
+                    yield {"type": "delta", "text": text}
+            elif chunk_type == "message_delta":
+                raw_usage.update(chunk.get("usage", {}))
+                state["usage"] = self._convert_usage(raw_usage)
+
+        return self._stream(model, request, handle_event, deadline)
+
+    def _build_request(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """Сформировать запрос к Messages API"""
         endpoint = f"{self.base_url}/v1/messages"
 
         headers = {
@@ -512,10 +960,14 @@ class AnthropicProvider(BaseAIProvider):
         payload = {
             "model": model,
             "messages": user_messages,
-            "max_tokens": kwargs.get("max_tokens", 1000),
+            "max_tokens": kwargs.get("max_tokens", DEFAULT_MAX_TOKENS),
         }
 
-        if system_prompt:
+        if system_prompt and self.prompt_cache:
+            # Точка кэширования после системного промпта: повторные запросы с тем же
+            # промптом читают его из кэша (промпты короче минимума модели не кэшируются)
+            payload["system"] = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        elif system_prompt:
             payload["system"] = system_prompt
 
         # Дополнительные параметры
@@ -526,74 +978,27 @@ class AnthropicProvider(BaseAIProvider):
         if "top_k" in kwargs:
             payload["top_k"] = kwargs["top_k"]
 
-        try:
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload,
-                timeout=self.timeout
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-
-                # Извлекаем текст ответа
-                content = ""
-                if "content" in data and len(data["content"]) > 0:
-                    content = data["content"][0].get("text", "")
-
-                # Извлекаем usage
-                usage = {}
-                if "usage" in data:
-                    usage = {
-                        "prompt_tokens": data["usage"].get("input_tokens", 0),
-                        "completion_tokens": data["usage"].get("output_tokens", 0),
-                        "total_tokens": data["usage"].get("input_tokens", 0) + data["usage"].get("output_tokens", 0)
-                    }
-
-                return {
-                    "success": True,
-                    "content": content,
-                    "model": data.get("model", model),
-                    "usage": usage,
-                    "error": None
-                }
-            else:
-                error_data = response.json() if response.text else {}
-                error_message = error_data.get("error", {}).get("message", response.text[:200])
+        return {"endpoint": endpoint, "headers": headers, "payload": payload}
 
-                return {
-                    "success": False,
-                    "content": None,
-                    "model": model,
-                    "usage": {},
-                    "error": f"Anthropic API Error {response.status_code}: {error_message}"
-                }
-
-        except requests.exceptions.Timeout:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": "Превышено время ожидания ответа"
-            }
-        except requests.exceptions.ConnectionError:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Ошибка подключения к {self.base_url}"
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "content": None,
-                "model": model,
-                "usage": {},
-                "error": f"Неизвестная ошибка: {str(e)}"
-            }
+    @staticmethod
+    def _convert_usage(usage: Optional[Dict]) -> Dict[str, int]:
+        """
+        Привести usage Anthropic к формату prompt/completion/total_tokens
+        (input_tokens у Anthropic не включает токены, прочитанные из кэша и записанные в него)
+        """
+        if not usage:
+            return {}
+        cache_read = usage.get("cache_read_input_tokens") or 0
+        cache_write = usage.get("cache_creation_input_tokens") or 0
+        input_tokens = usage.get("input_tokens", 0) + cache_read + cache_write
+        output_tokens = usage.get("output_tokens", 0)
+        return {
+            "prompt_tokens": input_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "cache_read_tokens": cache_read,
+            "cache_write_tokens": cache_write
+        }
 
 
 class AIProviderFactory:
@@ -665,15 +1070,374 @@ class AIProviderFactory:
             additional_config=additional_config
         )
 
+    @classmethod
+    def create_from_config(cls, provider_config) -> BaseAIProvider:
+        """
+        Создать провайдер из снимка конфигурации (ProviderConfig),
+        где additional_config уже разобран
+
+        Args:
+            provider_config: ProviderConfig из ConfigSnapshot
+
+        Returns:
+            Экземпляр провайдера
+        """
+        return cls.create_provider(
+            provider_name=provider_config.name,
+            api_key=provider_config.api_key,
+            base_url=provider_config.base_url,
+            additional_config=dict(provider_config.additional_config) or None
+        )
+
     @classmethod
     def get_available_providers(cls) -> List[str]:
         """Получить список доступных провайдеров"""
         return list(cls._providers.keys())
 
 
+class ProviderRegistry:
+    """
+    Долгоживущие клиенты провайдеров (в пределах процесса)
+
+    Клиент создаётся один раз на пару (ID провайдера, хеш конфигурации) и
+    используется всеми потоками: провайдеры не меняют своё состояние при
+    запросах, а соединения берут из общих пулов HttpTransport. Когда
+    администратор меняет провайдера, снимок конфигурации получает новую
+    версию и следующий запрос атомарно (под _lock) заменяет клиент. Старый
+    клиент закрывается (close), когда завершится последний запрос, который
+    его занял.
+    """
+
+    _clients: Dict[int, Tuple[str, BaseAIProvider]] = {}
+    _leases: Dict[BaseAIProvider, int] = {}
+    _retired: set = set()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def config_hash(provider_config) -> str:
+        """Хеш настроек провайдера (ProviderConfig), от которых зависит клиент"""
+        source = json.dumps([provider_config.name, provider_config.api_key, provider_config.base_url,
+                             dict(provider_config.additional_config)], sort_keys=True, default=str)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def acquire(cls, provider_config) -> BaseAIProvider:
+        """
+        Занять клиент провайдера на время запроса (обязательно вернуть через release)
+
+        Args:
+            provider_config: ProviderConfig из ConfigSnapshot
+
+        Raises:
+            AIProviderError: Если провайдер неизвестен
+        """
+        config_hash = cls.config_hash(provider_config)
+        idle = None
+        with cls._lock:
+            entry = cls._clients.get(provider_config.id)
+            if entry is not None and entry[0] == config_hash:
+                client = entry[1]
+            else:
+                client = AIProviderFactory.create_from_config(provider_config)
+                cls._clients[provider_config.id] = (config_hash, client)
+                if entry is not None:
+                    idle = cls._retire(entry[1])
+            cls._leases[client] = cls._leases.get(client, 0) + 1
+
+        if idle is not None:
+            cls._close(idle)
+        return client
+
+    @classmethod
+    def release(cls, client: BaseAIProvider) -> None:
+        """Вернуть клиент; заменённый клиент закрывается после последнего запроса"""
+        with cls._lock:
+            leases = cls._leases.get(client, 0) - 1
+            if leases > 0:
+                cls._leases[client] = leases
+                return
+            cls._leases.pop(client, None)
+            if client not in cls._retired:
+                return
+            cls._retired.discard(client)
+        cls._close(client)
+
+    @classmethod
+    def invalidate(cls, provider_id: int) -> None:
+        """Убрать клиент провайдера (после изменения настроек): следующий запрос создаст новый"""
+        with cls._lock:
+            entry = cls._clients.pop(provider_id, None)
+            idle = cls._retire(entry[1]) if entry is not None else None
+        if idle is not None:
+            cls._close(idle)
+
+    @classmethod
+    def stats(cls) -> Dict[int, Dict[str, Any]]:
+        """Клиенты по ID провайдера: класс, хеш конфигурации и число выполняющихся запросов"""
+        with cls._lock:
+            return {
+                provider_id: {"client": type(client).__name__, "config_hash": config_hash[:12],
+                              "active_requests": cls._leases.get(client, 0)}
+                for provider_id, (config_hash, client) in sorted(cls._clients.items())
+            }
+
+    @classmethod
+    def _retire(cls, client: BaseAIProvider) -> Optional[BaseAIProvider]:
+        """
+        Клиент заменён (под _lock): занятый закроется после последнего запроса
+
+        Returns:
+            Клиент, если он свободен и его нужно закрыть сразу (уже вне _lock)
+        """
+        if cls._leases.get(client):
+            cls._retired.add(client)
+            return None
+        return client
+
+    @staticmethod
+    def _close(client: BaseAIProvider) -> None:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+class ProviderConcurrency:
+    """
+    Ограничение числа одновременных запросов к одному провайдеру (в пределах процесса)
+
+    Лимит задаётся в Provider.additional_config ключом "max_concurrency",
+    иначе берётся PROVIDER_MAX_CONCURRENCY; 0 — без ограничения. Ожидающие
+    слота запросы обслуживаются по классам приоритета (PriorityGate).
+    """
+
+    _gates: Dict[Tuple[int, int], PriorityGate] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_limit(cls, provider_config) -> int:
+        """Лимит одновременных запросов для провайдера (ProviderConfig)"""
+        limit = provider_config.additional_config.get(
+            "max_concurrency", current_app.config.get("PROVIDER_MAX_CONCURRENCY", 0)
+        )
+        try:
+            return max(0, int(limit))
+        except (TypeError, ValueError):
+            return 0
+
+    @classmethod
+    @contextmanager
+    def slot(cls, provider_config, deadline: Optional[Deadline] = None, priority: str = NORMAL):
+        """
+        Контекстный менеджер: занять слот провайдера на время запроса
+
+        Очередь создаётся на пару (ID провайдера, лимит), поэтому изменение
+        лимита в настройках провайдера применяется к новым запросам.
+        Ожидание слота ограничено deadline.
+
+        Args:
+            provider_config: ProviderConfig
+            deadline: Крайний срок ожидания
+            priority: Класс приоритета запроса (interactive, normal, bulk)
+
+        Yields:
+            True, если слот получен; False, если deadline истёк раньше
+        """
+        limit = cls.get_limit(provider_config)
+        if not limit:
+            yield True
+            return
+
+        key = (provider_config.id, limit)
+        gate = cls._gates.get(key)
+        if gate is None:
+            with cls._lock:
+                gate = cls._gates.get(key)
+                if gate is None:
+                    config = current_app.config
+                    gate = cls._gates[key] = PriorityGate(
+                        limit,
+                        weights={name: float(weight) for name, weight
+                                 in parse_pairs(config.get("PRIORITY_WEIGHTS", "")).items()},
+                        aging_seconds=config.get("PRIORITY_AGING_SECONDS", 30),
+                        reserved_slots=config.get("PRIORITY_RESERVED_SLOTS", 1)
+                    )
+
+        priority = normalize(priority)
+        timeout = deadline.remaining() if deadline else None
+        acquired = gate.acquire(priority, timeout=None if timeout == float("inf") else timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                gate.release(priority)
+
+    @classmethod
+    def stats(cls) -> Dict[int, Dict[str, Any]]:
+        """
+        Очереди провайдеров по классам приоритета (в пределах процесса)
+
+        Returns:
+            {ID провайдера: {"limit", "classes": {класс: {"active", "waiting", "granted",
+            "timed_out", "avg_wait_ms", "max_wait_ms"}}}}
+        """
+        with cls._lock:
+            gates = dict(cls._gates)
+        return {provider_id: gate.stats() for (provider_id, _), gate in sorted(gates.items())}
+
+
+class ModelLatency:
+    """
+    Наблюдаемое время ответа и доля ошибок моделей (в пределах процесса)
+
+    Хранит последние window успешных ответов и последние window исходов
+    (успех или сбой провайдера) каждой модели; используется для порога
+    хеджирования (p90 основной модели) и выбора модели этапа (route_models).
+    """
+
+    window = 200
+    _samples: Dict[int, deque] = {}
+    _outcomes: Dict[int, deque] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, model_id: int, seconds: float) -> None:
+        """Записать время успешного ответа модели"""
+        with cls._lock:
+            samples = cls._samples.get(model_id)
+            if samples is None:
+                samples = cls._samples[model_id] = deque(maxlen=cls.window)
+            samples.append(seconds)
+            cls._outcome(model_id).append(0)
+
+    @classmethod
+    def record_failure(cls, model_id: int) -> None:
+        """Записать сбой провайдера при запросе к модели (provider_errors.is_provider_failure)"""
+        with cls._lock:
+            cls._outcome(model_id).append(1)
+
+    @classmethod
+    def error_rate(cls, model_id: int, min_samples: int = 1) -> Optional[float]:
+        """
+        Доля сбоев среди последних запросов к модели
+
+        Returns:
+            Значение от 0 до 1 или None, если запросов меньше min_samples
+        """
+        with cls._lock:
+            outcomes = list(cls._outcomes.get(model_id, ()))
+        if not outcomes or len(outcomes) < min_samples:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    @classmethod
+    def _outcome(cls, model_id: int) -> deque:
+        """Исходы запросов модели (под _lock)"""
+        outcomes = cls._outcomes.get(model_id)
+        if outcomes is None:
+            outcomes = cls._outcomes[model_id] = deque(maxlen=cls.window)
+        return outcomes
+
+    @classmethod
+    def percentile(cls, model_id: int, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Перцентиль времени ответа модели, сек
+
+        Returns:
+            Значение или None, если замеров меньше min_samples
+        """
+        with cls._lock:
+            samples = sorted(cls._samples.get(model_id, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def route_models(model_ids: Sequence[int], policy: str = StageAssignment.ROUTING_ORDERED) -> List[int]:
+    """
+    Порядок, в котором пробовать модели этапа (основная, затем резервные)
+
+    ordered — как задано в назначении. latency — первой идёт самая быстрая
+    (по медиане времени ответа) из исправных моделей: модели с разомкнутым
+    автоматом отключения и с долей сбоев выше ROUTING_MAX_ERROR_RATE
+    уходят в конец. Модель, по которой замеров меньше ROUTING_MIN_SAMPLES,
+    считается быстрой — так она получает запросы и набирает статистику;
+    при равенстве сохраняется заданный порядок.
+
+    Args:
+        model_ids: ID основной и резервных моделей по порядку из назначения
+        policy: StageAssignment.ROUTING_ORDERED или ROUTING_LATENCY
+
+    Returns:
+        ID моделей в порядке попыток
+    """
+    from app.services.config_snapshot import ConfigSnapshot
+
+    model_ids = list(model_ids)
+    if policy != StageAssignment.ROUTING_LATENCY or len(model_ids) < 2:
+        return model_ids
+
+    config = current_app.config
+    min_samples = config.get("ROUTING_MIN_SAMPLES", 10)
+    max_error_rate = config.get("ROUTING_MAX_ERROR_RATE", 0.2)
+    models = ConfigSnapshot.get().models
+
+    def sort_key(model_id: int):
+        model = models.get(model_id)
+        blocked = model is None or CircuitBreaker.blocked(CircuitBreaker.keys(model.provider.id, model_id))
+        error_rate = ModelLatency.error_rate(model_id, min_samples)
+        latency = ModelLatency.percentile(model_id, 0.5, min_samples)
+        return blocked, error_rate is not None and error_rate > max_error_rate, latency or 0.0
+
+    return sorted(model_ids, key=sort_key)
+
+
+def _collect_stream(provider: BaseAIProvider,
+                    model: str,
+                    messages: List[Dict[str, str]],
+                    on_delta: Callable[[Dict[str, Any]], None],
+                    deadline: Optional[Deadline] = None,
+                    **params) -> Dict[str, Any]:
+    """
+    Выполнить потоковый запрос, передавая фрагменты в on_delta,
+    и собрать итог в формате send_message
+    """
+    for event in provider.stream_message(model, messages, deadline=deadline, **params):
+        if event["type"] == "delta":
+            on_delta({"type": "delta", "text": event["text"]})
+            continue
+
+        if event["type"] == "done":
+            result = {
+                "success": True,
+                "content": event["content"],
+                "model": event["model"],
+                "usage": event["usage"],
+                "error": None
+            }
+        elif event["type"] == "error":
+            result = BaseAIProvider._error_result(model, event["error"], event.get("timed_out", False),
+                                                  event.get("error_type"))
+        else:
+            continue
+
+        if event.get("retries"):
+            result["retries"] = event["retries"]
+        return result
+
+    return BaseAIProvider._error_result(model, "Поток ответа прерван")
+
+
 def send_ai_request(model_id: int,
                     messages: List[Dict[str, str]],
                     use_fallback: bool = True,
+                    on_delta: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    deadline: Optional[Deadline] = None,
+                    stage_id: Optional[int] = None,
+                    cache_ttl: int = 0,
+                    priority: str = NORMAL,
+                    fallback_chain: Sequence[int] = (),
+                    output_learning: bool = True,
                     **kwargs) -> Dict[str, Any]:
     """
     Отправить запрос к AI модели с поддержкой fallback
@@ -681,16 +1445,36 @@ def send_ai_request(model_id: int,
     Args:
         model_id: ID модели из БД (AIModel.id)
         messages: Список сообщений в формате [{"role": "user", "content": "..."}]
-        use_fallback: Использовать fallback-модель при ошибке
+        use_fallback: Использовать резервные модели при ошибке
+        fallback_chain: ID резервных моделей этапа по порядку (AssignmentConfig.fallback_chain):
+                        при ошибке каждая следующая пробуется на остаток времени
+        on_delta: Callback для потоковой генерации. Получает {"type": "delta", "text": str}
+                  по мере генерации и {"type": "reset"} перед повтором на fallback-модели
+        deadline: Крайний срок запроса. Все HTTP-вызовы, включая fallback, укладываются
+                  в оставшееся время; по его истечении результат помечается timed_out
+        stage_id: ID этапа, для которого выполняется запрос (для сброса кэша по этапу;
+                  если max_tokens не задан ни в kwargs, ни в параметрах модели, лимит ответа
+                  подбирается по прошлым ответам этапа, см. OutputTokenLimits)
+        cache_ttl: Срок хранения ответа в кэше, сек (0 — без кэша). Ответ из кэша
+                   помечается cached=True и при потоковой генерации отдаётся одним фрагментом
+        priority: Класс приоритета (interactive, normal, bulk): порядок получения
+                  слота провайдера, когда его лимит одновременных запросов исчерпан
+        output_learning: Применять и пополнять выученный лимит ответа этапа; False — для
+                         запросов, чей ответ короче обычного ответа этапа (по фрагменту текста)
         **kwargs: Дополнительные параметры (temperature, max_tokens, etc.)
 
     Returns:
-        Dict с результатом запроса
+        Dict с результатом запроса (retries — сколько раз запросы повторялись
+        после временных ошибок, включая запросы к fallback-модели; error_type —
+        класс ошибки, unavailable — провайдер или модель отключены CircuitBreaker,
+        too_large — вход не помещается в лимит модели; input_tokens — оценка
+        входных токенов, input_limit — лимит входа, если запрос не отправлялся)
     """
-    from app.models import AIModel, Provider
+    from app.services.config_snapshot import ConfigSnapshot
 
-    # Загружаем модель из БД
-    model = AIModel.query.get(model_id)
+    # Модель и провайдер — из снимка конфигурации (без запросов к БД)
+    snapshot = ConfigSnapshot.get()
+    model = snapshot.models.get(model_id)
     if not model:
         return {
             "success": False,
@@ -710,18 +1494,46 @@ def send_ai_request(model_id: int,
             "error": "Модель или провайдер неактивны"
         }
 
-    # Мержим default_params модели с переданными kwargs
-    params = {}
-    if model.default_params:
-        try:
-            params = json.loads(model.default_params)
-        except json.JSONDecodeError:
-            pass
+    # Мержим default_params модели с переданными kwargs (rpm/tpm и лимиты входа — не параметры API)
+    params = {key: value for key, value in model.default_params.items()
+              if key not in RateLimiter.LIMIT_KEYS and key not in TokenBudget.MODEL_KEYS}
     params.update(kwargs)
 
-    # Создаём провайдер
+    # Лимит длины ответа этапа: заданный явно (назначение этапа или параметры модели) или выученный
+    # по прошлым ответам модели — он заменяет только встроенный DEFAULT_MAX_TOKENS
+    if stage_id is not None and output_learning and "max_tokens" not in params:
+        learned_max_tokens = OutputTokenLimits.limit(stage_id, model_id)
+        if learned_max_tokens:
+            params["max_tokens"] = learned_max_tokens
+
+    # Вход, который не поместится в окно контекста или бюджет модели, не отправляем:
+    # провайдер отклонил бы его после полного запроса (резервная модель может быть больше)
+    input_tokens = TokenBudget.estimate_messages(messages, model.provider.name)
+    input_limit = TokenBudget.input_limit(model, params.get("max_tokens") or DEFAULT_MAX_TOKENS)
+    if input_tokens > input_limit:
+        result = BaseAIProvider._error_result(
+            model.api_identifier,
+            f"Слишком длинный запрос для модели {model.display_name}: около {input_tokens} входных токенов "
+            f"при лимите {max(input_limit, 0)}",
+            error_type=provider_errors.TOO_LARGE
+        )
+        result.update(input_tokens=input_tokens, input_limit=max(input_limit, 0))
+        return _try_fallback(result, messages, use_fallback, on_delta, deadline, stage_id, cache_ttl, priority,
+                             fallback_chain, output_learning, **kwargs)
+
+    # Ответ из кэша (тот же запрос к той же модели с теми же параметрами)
+    cache_key = None
+    if cache_ttl and cache_ttl > 0:
+        cache_key = LLMCache.make_key(model.api_identifier, messages, params)
+        cached = LLMCache.get(cache_key, snapshot.version)
+        if cached:
+            if on_delta and cached["content"]:
+                on_delta({"type": "delta", "text": cached["content"]})
+            return {**cached, "success": True, "error": None, "cached": True, "input_tokens": input_tokens}
+
+    # Клиент провайдера из реестра (занят до конца запроса, чтобы замена не закрыла его раньше)
     try:
-        provider = AIProviderFactory.create_from_db_provider(model.provider)
+        provider = ProviderRegistry.acquire(model.provider)
     except AIProviderError as e:
         return {
             "success": False,
@@ -731,30 +1543,282 @@ def send_ai_request(model_id: int,
             "error": str(e)
         }
 
-    # Отправляем запрос
-    result = provider.send_message(model.api_identifier, messages, **params)
-
-    # Если ошибка и есть fallback - пробуем fallback
-    if not result["success"] and use_fallback:
-        # Ищем fallback в stage_assignments
-        from app.models import StageAssignment
-
-        assignment = StageAssignment.query.filter_by(
-            model_id=model_id,
-            is_active=True
-        ).first()
-
-        if assignment and assignment.fallback_model_id:
-            fallback_result = send_ai_request(
-                model_id=assignment.fallback_model_id,
-                messages=messages,
-                use_fallback=False,  # Не используем вложенный fallback
-                **kwargs
+    # Лимиты запросов и токенов в минуту (общие для всех процессов): лучше подождать,
+    # чем получить 429. Токены — оценка входа плюс max_tokens ответа
+    estimated_tokens = input_tokens + float(params.get("max_tokens") or 0)
+    rate_limits = RateLimiter.limits(f"provider:{model.provider.id}", model.provider.additional_config,
+                                     estimated_tokens) + \
+        RateLimiter.limits(f"model:{model_id}", model.default_params, estimated_tokens)
+
+    # Провайдер или модель отключены автоматом после серии временных ошибок —
+    # сразу переходим к резервной модели, не дожидаясь таймаута
+    breaker_keys = CircuitBreaker.keys(model.provider.id, model_id)
+    circuit_wait = CircuitBreaker.allow(breaker_keys)
+    # Сверка с фактическим расходом (settle) — только если стоимость действительно списана
+    rate_limited, rate_limit_wait = RateLimiter.acquire(rate_limits, deadline) if circuit_wait is None \
+        else (False, None)
+
+    try:
+        if circuit_wait is not None:
+            result = BaseAIProvider._error_result(
+                model.api_identifier,
+                f"{model.provider.display_name}: временно отключён после серии ошибок "
+                f"(повторная проверка через {circuit_wait:.0f} с)",
+                error_type=provider_errors.UNAVAILABLE
+            )
+        elif rate_limit_wait is not None:
+            result = BaseAIProvider._error_result(
+                model.api_identifier, f"Превышен лимит запросов к провайдеру (до освобождения {rate_limit_wait:.0f} с)",
+                timed_out=bool(deadline and deadline.expired)
             )
+        else:
+            # Отправляем запрос (с учётом лимита одновременных запросов к провайдеру)
+            with ProviderConcurrency.slot(model.provider, deadline, priority) as acquired:
+                started = time.monotonic()
+                if not acquired:
+                    result = BaseAIProvider._error_result(model.api_identifier, "Превышено время ожидания ответа",
+                                                          timed_out=True)
+                elif on_delta:
+                    result = _collect_stream(provider, model.api_identifier, messages, on_delta, deadline, **params)
+                else:
+                    result = provider.send_message(model.api_identifier, messages, deadline=deadline, **params)
+
+                if acquired:
+                    CircuitBreaker.record(breaker_keys, result, deadline)
+                    if provider_errors.is_provider_failure(result, deadline):
+                        ModelLatency.record_failure(model_id)
+
+            if rate_limited:
+                usage = result.get("usage") or {}
+                RateLimiter.settle(rate_limits, usage.get("total_tokens") if result["success"] else 0)
+    finally:
+        ProviderRegistry.release(provider)
+
+    if result["success"]:
+        ModelLatency.record(model_id, time.monotonic() - started)
+        if stage_id is not None and output_learning:
+            OutputTokenLimits.record(stage_id, model_id, result.get("usage"),
+                                     params.get("max_tokens") or DEFAULT_MAX_TOKENS)
+        if cache_key:
+            LLMCache.set(cache_key, result, cache_ttl, stage_id=stage_id, model_id=model_id)
+
+    result["input_tokens"] = input_tokens
+    return _try_fallback(result, messages, use_fallback, on_delta, deadline, stage_id, cache_ttl, priority,
+                         fallback_chain, output_learning, **kwargs)
+
+
+def _try_fallback(result: Dict[str, Any], messages: List[Dict[str, str]], use_fallback: bool,
+                  on_delta: Optional[Callable[[Dict[str, Any]], None]], deadline: Optional[Deadline],
+                  stage_id: Optional[int], cache_ttl: int, priority: str, fallback_chain: Sequence[int],
+                  output_learning: bool = True, **kwargs) -> Dict[str, Any]:
+    """Результат запроса или, если он неуспешен, ответ следующей модели цепочки (см. send_ai_request)"""
+    # Если ошибка и есть резервные модели (и осталось время) - пробуем следующую по цепочке.
+    # Некорректный запрос резервная модель получила бы в том же виде
+    if not result["success"] and use_fallback and fallback_chain and not (deadline and deadline.expired) \
+            and result.get("error_type") != provider_errors.BAD_REQUEST:
+        if on_delta:
+            on_delta({"type": "reset"})
+
+        fallback_result = send_ai_request(
+            model_id=fallback_chain[0],
+            messages=messages,
+            use_fallback=True,
+            on_delta=on_delta,
+            deadline=deadline,  # fallback получает только остаток времени
+            stage_id=stage_id,
+            cache_ttl=cache_ttl,
+            priority=priority,
+            fallback_chain=fallback_chain[1:],
+            output_learning=output_learning,
+            **kwargs
+        )
+
+        if fallback_result["success"]:
+            fallback_result["fallback_used"] = True
+            fallback_result["original_error"] = result["error"]
+            return _merge_failed_attempts(fallback_result, result)
+
+    return result
+
+
+def _merge_failed_attempts(result: Dict[str, Any], *failed: Dict[str, Any]) -> Dict[str, Any]:
+    """Добавить к результату повторы и расход токенов неуспешных попыток перед ним (для статистики и UI)"""
+    retries = result.get("retries", 0) + sum(attempt.get("retries", 0) for attempt in failed)
+    if retries:
+        result["retries"] = retries
 
+    # Новый dict: usage результата может быть общим с записью LLMCache
+    usage = dict(result.get("usage") or {})
+    for attempt in failed:
+        for key, value in (attempt.get("usage") or {}).items():
+            if isinstance(value, (int, float)) and isinstance(usage.get(key, 0), (int, float)):
+                usage[key] = usage.get(key, 0) + value
+    result["usage"] = usage
+    return result
+
+
+def send_hedged_request(model_id: int,
+                        fallback_model_id: int,
+                        messages: List[Dict[str, str]],
+                        hedge_after: Optional[float] = None,
+                        on_delta: Optional[Callable[[Dict[str, Any]], None]] = None,
+                        deadline: Optional[Deadline] = None,
+                        stage_id: Optional[int] = None,
+                        cache_ttl: int = 0,
+                        priority: str = NORMAL,
+                        fallback_chain: Sequence[int] = (),
+                        **kwargs) -> Dict[str, Any]:
+    """
+    Запрос с хеджированием: если основная модель не ответила за hedge_after секунд,
+    параллельно запускается резервная, и используется ответ, пришедший первым
+
+    Проигравший запрос отменяется: его deadline отменяется, и он прекращается при
+    ближайшей проверке (между фрагментами потока или перед HTTP-вызовом). Уже
+    отправленный непотоковый HTTP-запрос прервать нельзя — его поток просто
+    завершится сам, а результат будет отброшен.
+
+    При потоковой генерации «первым ответом» считается первый фрагмент текста:
+    в on_delta попадают фрагменты только от этой модели. Если она затем завершится
+    ошибкой, а другая модель успела ответить, поток сбрасывается ({"type": "reset"})
+    и ответ другой модели передаётся одним фрагментом.
+
+    Args:
+        model_id: ID основной модели
+        fallback_model_id: ID резервной модели
+        messages: Сообщения
+        hedge_after: Порог запуска резервной модели, сек (по умолчанию — p90 основной
+                     модели, а пока замеров мало — HEDGE_DEFAULT_AFTER_MS)
+        on_delta: Callback для потоковой генерации (см. send_ai_request)
+        deadline: Крайний срок запроса (общий для обеих моделей)
+        stage_id, cache_ttl: Кэширование ответов (см. send_ai_request)
+        priority: Класс приоритета обоих запросов (см. send_ai_request)
+        fallback_chain: Следующие резервные модели этапа: пробуются по очереди,
+                        если ни основная, ни резервная модель не ответили
+        **kwargs: Дополнительные параметры модели
+
+    Returns:
+        Dict с результатом в формате send_ai_request; hedged=True, если резервная
+        модель запускалась, fallback_used=True, если победила она
+    """
+    config = current_app.config
+    if hedge_after is None:
+        hedge_after = ModelLatency.percentile(model_id, 0.9, config.get("HEDGE_MIN_SAMPLES", 20))
+    if hedge_after is None:
+        hedge_after = config.get("HEDGE_DEFAULT_AFTER_MS", 5000) / 1000
+
+    app = current_app._get_current_object()
+    attempts = [Deadline.child(deadline), Deadline.child(deadline)]
+    stream_owner = {"index": None}
+    lock = threading.Lock()
+
+    def delta_for(index: int):
+        if not on_delta:
+            return None
+
+        def forward(event: Dict[str, Any]):
+            with lock:
+                if stream_owner["index"] is None:
+                    # Первый фрагмент — эта модель выигрывает, вторую отменяем
+                    stream_owner["index"] = index
+                    attempts[1 - index].cancel()
+                if stream_owner["index"] != index:
+                    return
+            on_delta(event)
+
+        return forward
+
+    def attempt(index: int, attempt_model_id: int) -> Dict[str, Any]:
+        with app.app_context():
+            return send_ai_request(attempt_model_id, messages, use_fallback=False,
+                                   on_delta=delta_for(index), deadline=attempts[index],
+                                   stage_id=stage_id, cache_ttl=cache_ttl, priority=priority,
+                                   **kwargs)
+
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        primary = executor.submit(attempt, 0, model_id)
+        wait_for = hedge_after if deadline is None else min(hedge_after, deadline.remaining())
+        done, _ = wait([primary], timeout=wait_for)
+
+        if done:
+            result = primary.result()
+            if result["success"] or (deadline and deadline.expired) \
+                    or result.get("error_type") == provider_errors.BAD_REQUEST:
+                return result
+
+            # Основная модель быстро вернула ошибку — обычный fallback по цепочке на остаток времени
+            if on_delta:
+                on_delta({"type": "reset"})
+            fallback_result = send_ai_request(fallback_model_id, messages, use_fallback=True,
+                                              on_delta=on_delta, deadline=deadline,
+                                              stage_id=stage_id, cache_ttl=cache_ttl, priority=priority,
+                                              fallback_chain=fallback_chain, **kwargs)
             if fallback_result["success"]:
                 fallback_result["fallback_used"] = True
                 fallback_result["original_error"] = result["error"]
-                return fallback_result
-
-    return result
+                return _merge_failed_attempts(fallback_result, result)
+            return result
+
+        # Основная модель медлит — запускаем резервную параллельно
+        futures = {primary: 0, executor.submit(attempt, 1, fallback_model_id): 1}
+        results: Dict[int, Dict[str, Any]] = {}
+
+        while futures:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline.remaining() + 1.0
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+
+            for future in done:
+                index = futures.pop(future)
+                result = future.result()
+                results[index] = result
+                if result["success"] and stream_owner["index"] in (None, index):
+                    attempts[1 - index].cancel()
+                    result["hedged"] = True
+                    if index == 1:
+                        result["fallback_used"] = True
+                        result["original_error"] = "Основная модель не ответила вовремя"
+                    return result
+
+        # Модель, чей поток шёл в on_delta, завершилась ошибкой, а другая успела ответить
+        succeeded = [index for index, result in results.items() if result["success"]]
+        if succeeded:
+            index = succeeded[0]
+            result = results[index]
+            if on_delta:
+                on_delta({"type": "reset"})
+                if result["content"]:
+                    on_delta({"type": "delta", "text": result["content"]})
+            result["hedged"] = True
+            if index == 1:
+                result["fallback_used"] = True
+                result["original_error"] = results[0]["error"] if 0 in results \
+                    else "Основная модель не ответила вовремя"
+            return _merge_failed_attempts(result, *(results[other] for other in results if other != index))
+
+        result = results.get(0) or BaseAIProvider._error_result(None, "Превышено время ожидания ответа",
+                                                                 timed_out=True)
+        result["hedged"] = True
+
+        # Обе модели не ответили — следующие резервные модели на остаток времени
+        if fallback_chain and not (deadline and deadline.expired) \
+                and result.get("error_type") != provider_errors.BAD_REQUEST:
+            if on_delta:
+                on_delta({"type": "reset"})
+            fallback_result = send_ai_request(fallback_chain[0], messages, use_fallback=True,
+                                              on_delta=on_delta, deadline=deadline,
+                                              stage_id=stage_id, cache_ttl=cache_ttl, priority=priority,
+                                              fallback_chain=fallback_chain[1:], **kwargs)
+            if fallback_result["success"]:
+                fallback_result["hedged"] = True
+                fallback_result["fallback_used"] = True
+                fallback_result["original_error"] = result["error"]
+                return _merge_failed_attempts(fallback_result, *results.values())
+        return result
+    finally:
+        for attempt_deadline in attempts:
+            attempt_deadline.cancel()
+        executor.shutdown(wait=False)
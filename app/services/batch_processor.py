@@ -0,0 +1,280 @@
+"""
+Пакетная обработка: много новостей через одни и те же этапы
+"""
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple, Set
+from flask import current_app
+from app.services.pipeline_processor import PipelineProcessor
+from app.services.deadline import Deadline
+from app.services.stage_graph import StageGraph
+from app.services.token_budget import TokenBudget
+
+
+class BatchProcessor:
+    """
+    Обработка пакета новостей по одному плану
+
+    План (этапы, назначенные модели, промпты) строится один раз на весь пакет,
+    новости обрабатываются в пуле потоков. Этапы одной новости выполняются
+    последовательно — параллелизм даёт сам пакет, а число одновременных
+    запросов к провайдеру ограничивает ProviderConcurrency.
+    """
+
+    @staticmethod
+    def normalize_items(raw_items: Any) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Проверить и привести элементы пакета к виду {"id", "index", "news_text"}
+
+        Args:
+            raw_items: Список строк или объектов {"id": ..., "news_text": str}
+
+        Returns:
+            Tuple (элементы, сообщение об ошибке или None)
+        """
+        if not isinstance(raw_items, list) or not raw_items:
+            return [], "Не переданы новости для обработки"
+
+        max_items = current_app.config.get("BATCH_MAX_ITEMS", 100)
+        if len(raw_items) > max_items:
+            return [], f"Слишком много новостей в пакете (максимум {max_items})"
+
+        items = []
+        for index, raw_item in enumerate(raw_items):
+            if isinstance(raw_item, str):
+                items.append({"id": index, "index": index, "news_text": raw_item})
+            elif isinstance(raw_item, dict):
+                items.append({
+                    "id": raw_item.get("id", index),
+                    "index": index,
+                    "news_text": raw_item.get("news_text") or ""
+                })
+            else:
+                return [], f"Некорректный элемент пакета №{index + 1}"
+
+        return items, None
+
+    @staticmethod
+    def iter_results(plan: StageGraph, items: Iterable[Dict[str, Any]],
+                     concurrency: Optional[int] = None,
+                     deadline_seconds: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Обработать новости пакета и отдавать результаты по мере готовности
+
+        Элементы читаются из items постепенно: в работе одновременно не больше
+        2 × concurrency новостей, поэтому подходит и для длинных потоков входных данных.
+
+        Args:
+            plan: План обработки (PipelineProcessor.build_plan)
+            items: Элементы {"id", "index", "news_text"}
+            concurrency: Сколько новостей обрабатывать одновременно
+                         (не больше BATCH_MAX_WORKERS)
+            deadline_seconds: Лимит времени на одну новость, отсчитывается от начала
+                              её обработки (по умолчанию PIPELINE_DEADLINE_SECONDS)
+
+        Yields:
+            Dict {"id", "index", "success", "results": [...], "error"} в порядке завершения
+        """
+        app = current_app._get_current_object()
+        max_workers = app.config.get("BATCH_MAX_WORKERS", 4)
+        if concurrency:
+            max_workers = min(max_workers, concurrency)
+        max_workers = max(1, max_workers)
+
+        items = iter(items)
+        running: Dict[Future, Dict[str, Any]] = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as executor:
+
+            def fill():
+                while len(running) < max_workers * 2:
+                    item = next(items, None)
+                    if item is None:
+                        return
+                    future = executor.submit(BatchProcessor._process_item_in_context, app, plan, item,
+                                             deadline_seconds)
+                    running[future] = item
+
+            try:
+                fill()
+                while running:
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = running.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = {"success": False, "results": [], "error": f"Ошибка обработки: {str(e)}"}
+                        yield BatchProcessor._item_result(item, result)
+                    fill()
+            finally:
+                # Потребитель прекратил чтение (например, клиент отключился) —
+                # не запускаем новости, которые ещё не начали обрабатываться
+                for future in running:
+                    future.cancel()
+
+    @staticmethod
+    def read_items(path: str, file_format: Optional[str] = None,
+                   text_field: str = "news_text", id_field: str = "id") -> Iterator[Dict[str, Any]]:
+        """
+        Читать новости из файла JSONL или CSV построчно (файл целиком в память не загружается)
+
+        Args:
+            path: Путь к файлу
+            file_format: "jsonl" или "csv" (по умолчанию — по расширению файла)
+            text_field: Поле с текстом новости
+            id_field: Поле с идентификатором новости (если нет — используется номер записи)
+
+        Yields:
+            Dict {"id", "index", "news_text"}; для нечитаемых записей — с ключом "error".
+            index — номер записи в файле (пустые строки JSONL не считаются)
+        """
+        if not file_format:
+            file_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+        with open(path, encoding="utf-8", newline="") as f:
+            if file_format == "csv":
+                csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+                for index, row in enumerate(csv.DictReader(f)):
+                    yield {
+                        "id": row.get(id_field) or index,
+                        "index": index,
+                        "news_text": row.get(text_field) or ""
+                    }
+                return
+
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("ожидается JSON-объект")
+                    yield {
+                        "id": record.get(id_field, index),
+                        "index": index,
+                        "news_text": record.get(text_field) or ""
+                    }
+                except ValueError as e:
+                    yield {"id": index, "index": index, "news_text": "",
+                           "error": f"Некорректная запись JSONL: {str(e)}"}
+                index += 1
+
+    @staticmethod
+    def _process_item_in_context(app, plan: StageGraph, item: Dict[str, Any],
+                                 deadline_seconds: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Обработать одну новость пакета в собственном app context
+
+        Слишком длинный текст обрезается или не обрабатывается (TokenBudget.guard)
+        """
+        if item.get("error"):
+            return {"success": False, "results": [], "error": item["error"]}
+
+        with app.app_context():
+            news_text, _, error = TokenBudget.guard(item["news_text"])
+            if error:
+                return {"success": False, "results": [], "error": error}
+            return PipelineProcessor.execute_plan(plan, news_text, concurrent=False,
+                                                  deadline=Deadline.after(deadline_seconds))
+
+    @staticmethod
+    def _item_result(item: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """Результат обработки элемента пакета"""
+        return {
+            "id": item["id"],
+            "index": item["index"],
+            "success": result["success"],
+            "results": result["results"],
+            "error": result["error"]
+        }
+
+
+class BatchCheckpoint:
+    """
+    Контрольная точка обработки файла для продолжения после сбоя
+
+    Хранит номер записи, до которого обработано всё (done_below), номера
+    обработанных записей после него (результаты приходят не по порядку, но их
+    не больше окна одновременно обрабатываемых новостей) и размер выходного
+    файла на момент сохранения. При продолжении выходной файл обрезается до
+    этого размера, а обработанные записи пропускаются — каждая новость
+    попадает в результат ровно один раз.
+    """
+
+    def __init__(self, path: str, source: str):
+        """
+        Args:
+            path: Путь к файлу контрольной точки
+            source: Входной файл (для проверки при продолжении)
+        """
+        self.path = path
+        self.source = source
+        self.done_below = 0
+        self.done: Set[int] = set()
+        self.output_offset = 0
+        self.processed = 0
+
+    @classmethod
+    def load(cls, path: str, source: str) -> Optional["BatchCheckpoint"]:
+        """
+        Загрузить контрольную точку
+
+        Returns:
+            BatchCheckpoint или None, если файла нет
+
+        Raises:
+            ValueError: Контрольная точка относится к другому входному файлу
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("source") != os.path.abspath(source):
+            raise ValueError(f"Контрольная точка {path} относится к файлу {data.get('source')}")
+
+        checkpoint = cls(path, source)
+        checkpoint.done_below = data.get("done_below", 0)
+        checkpoint.done = set(data.get("done", []))
+        checkpoint.output_offset = data.get("output_offset", 0)
+        checkpoint.processed = data.get("processed", 0)
+        return checkpoint
+
+    def is_done(self, index: int) -> bool:
+        """Обработана ли запись с номером index"""
+        return index < self.done_below or index in self.done
+
+    def mark_done(self, index: int, output_offset: int) -> None:
+        """Отметить запись обработанной (её результат уже записан до output_offset)"""
+        self.done.add(index)
+        while self.done_below in self.done:
+            self.done.discard(self.done_below)
+            self.done_below += 1
+        self.output_offset = output_offset
+        self.processed += 1
+
+    def save(self) -> None:
+        """Атомарно сохранить контрольную точку"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "source": os.path.abspath(self.source),
+                "done_below": self.done_below,
+                "done": sorted(self.done),
+                "output_offset": self.output_offset,
+                "processed": self.processed
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        """Удалить контрольную точку (обработка завершена)"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
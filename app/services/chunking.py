@@ -0,0 +1,107 @@
+"""
+Разбиение длинного текста на фрагменты для обработки по частям (map-reduce)
+
+Текст делится по абзацам; абзац, который сам длиннее фрагмента, — по
+предложениям, а слишком длинное предложение — по словам. Куски собираются во
+фрагменты не длиннее chunk_tokens (по оценке TokenBudget). Каждый следующий
+фрагмент начинается с последних кусков предыдущего общим размером до
+overlap_tokens, чтобы мысль на границе фрагментов не потерялась.
+"""
+import re
+from typing import List, Optional
+from app.services.token_budget import TokenBudget
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def split_text(text: str, chunk_tokens: int, overlap_tokens: int = 0,
+               family: Optional[str] = None) -> List[str]:
+    """
+    Разбить текст на фрагменты с перекрытием
+
+    Args:
+        text: Текст
+        chunk_tokens: Максимальный размер фрагмента, токенов
+        overlap_tokens: Сколько токенов конца предыдущего фрагмента повторить в начале следующего
+        family: Семейство провайдера для оценки токенов (None — самая осторожная оценка)
+
+    Returns:
+        Фрагменты по порядку; короткий текст — один фрагмент
+    """
+    if TokenBudget.estimate(text, family) <= chunk_tokens:
+        return [text]
+
+    units = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if paragraph:
+            units.extend(_split_unit(paragraph, chunk_tokens, family))
+
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in units:
+        unit_tokens = TokenBudget.estimate(unit, family)
+        if current and current_tokens + unit_tokens > chunk_tokens:
+            chunks.append(_join(current))
+            current, current_tokens = _overlap(current, overlap_tokens, chunk_tokens - unit_tokens, family)
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append(_join(current))
+    return chunks
+
+
+def _split_unit(paragraph: str, chunk_tokens: int, family: Optional[str]) -> List[str]:
+    """Абзац длиннее фрагмента — на предложения, слишком длинное предложение — на слова"""
+    if TokenBudget.estimate(paragraph, family) <= chunk_tokens:
+        return [paragraph + "\n\n"]
+
+    units = []
+    for sentence in _SENTENCE_RE.split(paragraph):
+        if TokenBudget.estimate(sentence, family) <= chunk_tokens:
+            units.append(sentence + " ")
+            continue
+        words: List[str] = []
+        words_tokens = 0
+        for word in sentence.split():
+            word_tokens = TokenBudget.estimate(word, family)
+            if words and words_tokens + word_tokens > chunk_tokens:
+                units.append(" ".join(words) + " ")
+                words, words_tokens = [], 0
+            words.append(word)
+            words_tokens += word_tokens
+        if words:
+            units.append(" ".join(words) + " ")
+    if units:
+        units[-1] = units[-1].rstrip() + "\n\n"
+    return units
+
+
+def _overlap(units: List[str], overlap_tokens: int, room: int, family: Optional[str]):
+    """Последние куски фрагмента общим размером до overlap_tokens (и не больше room)"""
+    limit = min(overlap_tokens, room)
+    kept: List[str] = []
+    tokens = 0
+    for unit in reversed(units):
+        unit_tokens = TokenBudget.estimate(unit, family)
+        if tokens + unit_tokens > limit:
+            # Кусок целиком не помещается — берём его последние предложения
+            tail: List[str] = []
+            for sentence in reversed(_SENTENCE_RE.split(unit.strip())):
+                sentence_tokens = TokenBudget.estimate(sentence, family)
+                if tokens + sentence_tokens > limit:
+                    break
+                tail.insert(0, sentence)
+                tokens += sentence_tokens
+            if tail:
+                kept.insert(0, " ".join(tail) + ("\n\n" if unit.endswith("\n\n") else " "))
+            break
+        kept.insert(0, unit)
+        tokens += unit_tokens
+    return kept, tokens
+
+
+def _join(units: List[str]) -> str:
+    return "".join(units).strip()
@@ -0,0 +1,190 @@
+"""
+Автомат отключения (circuit breaker) провайдеров и моделей
+
+Когда провайдер лежит, каждый запрос к нему ждал бы полный таймаут, прежде
+чем send_ai_request перейдёт на резервную модель. Автомат считает подряд
+идущие временные ошибки (provider_errors.TRANSIENT) отдельно для провайдера и
+для модели; после CIRCUIT_FAILURE_THRESHOLD ошибок он «размыкается», и на
+CIRCUIT_OPEN_SECONDS запросы сразу уходят на резервную модель. Затем автомат
+полуоткрыт: пропускает один пробный запрос — успех замыкает его, ошибка
+размыкает снова.
+
+Любой ответ провайдера, кроме временной ошибки (в том числе 400 и 401),
+означает, что он доступен, и сбрасывает счётчик. Таймаут, вызванный
+истечением deadline самого запроса, не засчитывается.
+
+Состояние хранится в памяти процесса (как очереди ProviderConcurrency).
+"""
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from app.services import provider_errors
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# ("provider" | "model", ID)
+CircuitKey = Tuple[str, int]
+
+
+class _Circuit:
+    """Состояние автомата одного провайдера или модели"""
+
+    __slots__ = ("failures", "opened_at", "probe_started", "last_error", "last_error_type")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_error_type: Optional[str] = None
+
+
+class CircuitBreaker:
+    """
+    Автоматы отключения провайдеров и моделей (в пределах процесса)
+    """
+
+    _circuits: Dict[CircuitKey, _Circuit] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def keys(provider_id: int, model_id: int) -> List[CircuitKey]:
+        """Автоматы, через которые проходит запрос к модели"""
+        return [("provider", provider_id), ("model", model_id)]
+
+    @classmethod
+    def allow(cls, keys: List[CircuitKey]) -> Optional[float]:
+        """
+        Можно ли отправить запрос
+
+        Если какой-то из автоматов полуоткрыт и пробный запрос ещё не идёт,
+        этот запрос становится пробным.
+
+        Returns:
+            None, если запрос можно отправлять; иначе через сколько секунд
+            автомат пропустит следующий (пробный) запрос
+        """
+        if cls._threshold() <= 0:
+            return None
+
+        open_seconds = cls._open_seconds()
+        now = time.monotonic()
+        with cls._lock:
+            wait = 0.0
+            probes = []
+            for key in keys:
+                circuit = cls._circuits.get(key)
+                if circuit is None or circuit.opened_at is None:
+                    continue
+                if now < circuit.opened_at + open_seconds:
+                    wait = max(wait, circuit.opened_at + open_seconds - now)
+                elif circuit.probe_started is not None and now < circuit.probe_started + open_seconds:
+                    # Пробный запрос уже идёт (зависший пробный запрос через open_seconds заменяется новым)
+                    wait = max(wait, circuit.probe_started + open_seconds - now)
+                else:
+                    probes.append(circuit)
+
+            if wait > 0:
+                return wait
+            for circuit in probes:
+                circuit.probe_started = now
+            return None
+
+    @classmethod
+    def record(cls, keys: List[CircuitKey], result: Dict[str, Any], deadline=None) -> None:
+        """
+        Учесть результат отправленного запроса
+
+        Args:
+            keys: Автоматы запроса (keys)
+            result: Результат send_message
+            deadline: Крайний срок запроса (таймаут по его истечении не засчитывается)
+        """
+        failed = not result["success"] and result.get("error_type") in provider_errors.TRANSIENT
+        neutral = failed and not provider_errors.is_provider_failure(result, deadline)
+        threshold = cls._threshold()
+        if threshold <= 0:
+            return
+
+        now = time.monotonic()
+        with cls._lock:
+            for key in keys:
+                circuit = cls._circuits.get(key)
+                if not failed:
+                    cls._circuits.pop(key, None)
+                elif neutral:
+                    if circuit is not None:
+                        circuit.probe_started = None
+                else:
+                    if circuit is None:
+                        circuit = cls._circuits[key] = _Circuit()
+                    circuit.failures += 1
+                    circuit.last_error = result.get("error")
+                    circuit.last_error_type = result.get("error_type")
+                    if circuit.opened_at is not None or circuit.failures >= threshold:
+                        if circuit.opened_at is None:
+                            current_app.logger.warning("Circuit breaker opened for %s %s after %d failures: %s",
+                                                       key[0], key[1], circuit.failures, circuit.last_error)
+                        circuit.opened_at = now
+                        circuit.probe_started = None
+
+    @classmethod
+    def blocked(cls, keys: List[CircuitKey]) -> bool:
+        """Разомкнут ли какой-то из автоматов (без занятия пробного запроса)"""
+        if cls._threshold() <= 0:
+            return False
+        open_seconds = cls._open_seconds()
+        now = time.monotonic()
+        with cls._lock:
+            return any(circuit.opened_at is not None and now < circuit.opened_at + open_seconds
+                       for circuit in (cls._circuits.get(key) for key in keys) if circuit is not None)
+
+    @classmethod
+    def states(cls) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        """
+        Состояние автоматов, у которых есть ошибки
+
+        Returns:
+            {"provider": {ID: состояние}, "model": {ID: состояние}}; состояние —
+            {"state" (closed, open, half_open), "failures", "retry_in" (сек до
+            пробного запроса), "last_error", "last_error_type"}
+        """
+        open_seconds = cls._open_seconds()
+        now = time.monotonic()
+        states: Dict[str, Dict[int, Dict[str, Any]]] = {"provider": {}, "model": {}}
+        with cls._lock:
+            for (kind, object_id), circuit in cls._circuits.items():
+                state, retry_in = CLOSED, 0
+                if circuit.opened_at is not None:
+                    retry_in = max(0, int(circuit.opened_at + open_seconds - now))
+                    state = OPEN if retry_in > 0 else HALF_OPEN
+                states[kind][object_id] = {
+                    "state": state,
+                    "failures": circuit.failures,
+                    "retry_in": retry_in,
+                    "last_error": circuit.last_error,
+                    "last_error_type": circuit.last_error_type
+                }
+        return states
+
+    @classmethod
+    def reset(cls, kind: str, object_id: int) -> bool:
+        """
+        Замкнуть автомат вручную (например, после замены ключа провайдера)
+
+        Returns:
+            True, если автомат был в состоянии с ошибками
+        """
+        with cls._lock:
+            return cls._circuits.pop((kind, object_id), None) is not None
+
+    @staticmethod
+    def _threshold() -> int:
+        return current_app.config.get("CIRCUIT_FAILURE_THRESHOLD", 5)
+
+    @staticmethod
+    def _open_seconds() -> float:
+        return current_app.config.get("CIRCUIT_OPEN_SECONDS", 30)
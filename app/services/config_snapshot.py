@@ -0,0 +1,303 @@
+"""
+Снимок конфигурации конвейера: этапы, назначения, системные промпты, модели и провайдеры
+
+Снимок собирается из БД один раз и дальше используется всеми потоками только
+для чтения, поэтому при обработке новостей запросов за настройками нет.
+Версия конфигурации хранится в таблице config_state: административные
+разделы увеличивают её при изменениях, а процессы перестраивают снимок,
+увидев новую версию (проверка не чаще раза в CONFIG_CHECK_INTERVAL секунд).
+
+Промпты пользователей в снимок не входят: их правка не меняет версию, а
+UserPromptCache загружает промпты каждого пользователя отдельно.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple, Mapping
+from flask import current_app
+from app.extensions import db
+from app.models import ConfigState, Provider, AIModel, Stage, StageAssignment, SystemPrompt, UserPrompt
+
+
+def _parse_json_object(raw: Optional[str]) -> Mapping[str, Any]:
+    """Разобрать JSON-объект из текстовой колонки (пустой при ошибке)"""
+    if not raw:
+        return MappingProxyType({})
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError:
+        return MappingProxyType({})
+    return MappingProxyType(data if isinstance(data, dict) else {})
+
+
+class _Frozen:
+    """Базовый класс объектов снимка: атрибуты задаются только в конструкторе"""
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} только для чтения")
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+
+class ProviderConfig(_Frozen):
+    """Провайдер AI; additional_config уже разобран из JSON"""
+
+    __slots__ = ("id", "name", "display_name", "is_active", "api_key", "base_url", "additional_config")
+
+    def __init__(self, provider: Provider):
+        additional_config = _parse_json_object(provider.additional_config)
+        self._set(
+            id=provider.id,
+            name=provider.name,
+            display_name=provider.display_name,
+            is_active=provider.is_active,
+            api_key=provider.api_key,
+            base_url=additional_config.get("base_url"),
+            additional_config=additional_config
+        )
+
+
+class ModelConfig(_Frozen):
+    """Модель AI; default_params уже разобраны из JSON"""
+
+    __slots__ = ("id", "name", "display_name", "api_identifier", "is_active", "default_params", "provider")
+
+    def __init__(self, model: AIModel, provider: ProviderConfig):
+        self._set(
+            id=model.id,
+            name=model.name,
+            display_name=model.display_name,
+            api_identifier=model.api_identifier,
+            is_active=model.is_active,
+            default_params=_parse_json_object(model.default_params),
+            provider=provider
+        )
+
+
+class AssignmentConfig(_Frozen):
+    """
+    Активное назначение модели на этап; fallback_chain — ID резервных моделей
+    по порядку (без основной, повторов и удалённых моделей)
+    """
+
+    __slots__ = ("id", "stage_id", "model_id", "fallback_model_id", "fallback_chain", "routing_policy",
+                 "priority", "timeout_seconds", "hedge_enabled", "hedge_after_ms", "cache_ttl_seconds",
+                 "fusion_group", "max_tokens")
+
+    def __init__(self, assignment: StageAssignment, model_ids):
+        fallback_chain = []
+        for model_id in assignment.fallback_model_ids:
+            if model_id in model_ids and model_id != assignment.model_id and model_id not in fallback_chain:
+                fallback_chain.append(model_id)
+        self._set(
+            id=assignment.id,
+            stage_id=assignment.stage_id,
+            model_id=assignment.model_id,
+            fallback_model_id=fallback_chain[0] if fallback_chain else None,
+            fallback_chain=tuple(fallback_chain),
+            routing_policy=assignment.routing_policy or StageAssignment.ROUTING_ORDERED,
+            priority=assignment.priority,
+            timeout_seconds=assignment.timeout_seconds,
+            hedge_enabled=bool(assignment.hedge_enabled),
+            hedge_after_ms=assignment.hedge_after_ms,
+            cache_ttl_seconds=assignment.cache_ttl_seconds,
+            fusion_group=assignment.fusion_group or None,
+            max_tokens=assignment.max_tokens or None
+        )
+
+
+class StageConfig(_Frozen):
+    """Этап конвейера с назначением (с наибольшим приоритетом) и системным промптом"""
+
+    __slots__ = ("id", "name", "display_name", "description", "order", "is_active", "kind",
+                 "dependencies", "assignment", "system_prompt")
+
+    def __init__(self, stage: Stage, assignment: Optional[AssignmentConfig], system_prompt: Optional[str]):
+        self._set(
+            id=stage.id,
+            name=stage.name,
+            display_name=stage.display_name,
+            description=stage.description,
+            order=stage.order,
+            is_active=stage.is_active,
+            kind=stage.kind,
+            dependencies=tuple(stage.dependencies),
+            assignment=assignment,
+            system_prompt=system_prompt
+        )
+
+    @property
+    def is_llm(self) -> bool:
+        return self.kind != Stage.KIND_SEARCH
+
+
+class ConfigSnapshot(_Frozen):
+    """
+    Неизменяемый снимок конфигурации конвейера определённой версии
+    """
+
+    __slots__ = ("version", "providers", "models", "stages")
+
+    _current: Optional["ConfigSnapshot"] = None
+    _checked_at = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self, version: int, providers: Dict[int, ProviderConfig], models: Dict[int, ModelConfig],
+                 stages: Dict[int, StageConfig]):
+        self._set(
+            version=version,
+            providers=MappingProxyType(providers),
+            models=MappingProxyType(models),
+            stages=MappingProxyType(stages)
+        )
+
+    def active_stages(self) -> List[StageConfig]:
+        """Активные этапы в порядке Stage.order"""
+        return sorted((stage for stage in self.stages.values() if stage.is_active),
+                      key=lambda stage: (stage.order, stage.id))
+
+    def prompt_for(self, user_id: int, stage_id: int) -> Optional[str]:
+        """Промпт пользователя для этапа (если у пользователя его ещё нет — системный)"""
+        prompt = UserPromptCache.get(user_id).get(stage_id)
+        if prompt is None:
+            stage = self.stages.get(stage_id)
+            prompt = stage.system_prompt if stage else None
+        return prompt
+
+    @classmethod
+    def get(cls) -> "ConfigSnapshot":
+        """
+        Текущий снимок конфигурации
+
+        Версия в БД проверяется не чаще раза в CONFIG_CHECK_INTERVAL секунд;
+        снимок перестраивается, только если версия изменилась.
+        """
+        snapshot = cls._current
+        interval = current_app.config.get("CONFIG_CHECK_INTERVAL", 2.0)
+        if snapshot is not None and time.monotonic() - cls._checked_at < interval:
+            return snapshot
+
+        with cls._lock:
+            snapshot = cls._current
+            if snapshot is not None and time.monotonic() - cls._checked_at < interval:
+                return snapshot
+
+            version = cls._read_version()
+            if snapshot is None or snapshot.version != version:
+                snapshot = cls._build(version)
+                cls._current = snapshot
+            cls._checked_at = time.monotonic()
+            return snapshot
+
+    @classmethod
+    def bump_version(cls) -> int:
+        """
+        Увеличить версию конфигурации (вызывается после сохранения изменений
+        провайдеров, моделей, этапов, назначений или системных промптов)
+
+        Returns:
+            Новая версия
+        """
+        updated = ConfigState.query.filter_by(id=1).update(
+            {"version": ConfigState.version + 1}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(ConfigState(id=1, version=1))
+        db.session.commit()
+
+        # В этом процессе новая версия видна сразу
+        cls._checked_at = 0.0
+        return cls._read_version()
+
+    @classmethod
+    def _read_version(cls) -> int:
+        version = db.session.query(ConfigState.version).filter_by(id=1).scalar()
+        return version or 0
+
+    @classmethod
+    def _build(cls, version: int) -> "ConfigSnapshot":
+        """Собрать снимок из БД"""
+        providers = {provider.id: ProviderConfig(provider) for provider in Provider.query.all()}
+        models = {model.id: ModelConfig(model, providers[model.provider_id])
+                  for model in AIModel.query.all() if model.provider_id in providers}
+
+        active_assignments = StageAssignment.query.filter_by(is_active=True).order_by(StageAssignment.id).all()
+
+        # Для этапа — назначение с наибольшим приоритетом (с ним и цепочка резервных моделей)
+        assignments: Dict[int, AssignmentConfig] = {}
+        for assignment in sorted(active_assignments, key=lambda a: -a.priority):
+            if assignment.stage_id not in assignments:
+                assignments[assignment.stage_id] = AssignmentConfig(assignment, models)
+
+        system_prompts = {prompt.stage_id: prompt.prompt_text for prompt in SystemPrompt.query.all()}
+        stages = {stage.id: StageConfig(stage, assignments.get(stage.id), system_prompts.get(stage.id))
+                  for stage in Stage.query.all()}
+
+        return cls(version, providers, models, stages)
+
+
+class UserPromptCache:
+    """
+    Промпты пользователей по этапам в памяти процесса
+
+    Промпты пользователя загружаются при первом обращении и дальше проверяются
+    не чаще раза в CONFIG_CHECK_INTERVAL секунд одним запросом: число его
+    промптов и наибольший updated_at. Изменилась отметка — промпты этого
+    пользователя загружаются заново; промпты остальных и снимок конфигурации
+    не затрагиваются.
+    """
+
+    # Сколько пользователей держать в памяти процесса
+    MAX_USERS = 1024
+
+    # user_id -> (время проверки по monotonic-часам, отметка, {stage_id: текст промпта})
+    _entries: "OrderedDict[int, Tuple[float, Tuple[int, Any], Mapping[int, str]]]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, user_id: int) -> Mapping[int, str]:
+        """Промпты пользователя: {stage_id: текст}"""
+        interval = current_app.config.get("CONFIG_CHECK_INTERVAL", 2.0)
+        with cls._lock:
+            entry = cls._entries.get(user_id)
+            if entry is not None:
+                cls._entries.move_to_end(user_id)
+                if time.monotonic() - entry[0] < interval:
+                    return entry[2]
+
+        checked_at = time.monotonic()
+        if entry is not None and cls._stamp(user_id) == entry[1]:
+            stamp, prompts = entry[1], entry[2]
+        else:
+            rows = UserPrompt.query.filter_by(user_id=user_id).with_entities(
+                UserPrompt.stage_id, UserPrompt.prompt_text, UserPrompt.updated_at
+            ).all()
+            stamp = (len(rows), max((row.updated_at for row in rows), default=None))
+            prompts = MappingProxyType({row.stage_id: row.prompt_text for row in rows})
+
+        with cls._lock:
+            cls._entries[user_id] = (checked_at, stamp, prompts)
+            cls._entries.move_to_end(user_id)
+            while len(cls._entries) > cls.MAX_USERS:
+                cls._entries.popitem(last=False)
+        return prompts
+
+    @classmethod
+    def invalidate(cls, user_id: int) -> None:
+        """Забыть промпты пользователя (в этом процессе правка видна сразу)"""
+        with cls._lock:
+            cls._entries.pop(user_id, None)
+
+    @staticmethod
+    def _stamp(user_id: int) -> Tuple[int, Any]:
+        """Отметка промптов пользователя: (число, наибольший updated_at)"""
+        count, updated_at = db.session.query(
+            db.func.count(UserPrompt.id), db.func.max(UserPrompt.updated_at)
+        ).filter(UserPrompt.user_id == user_id).one()
+        return count, updated_at
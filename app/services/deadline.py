@@ -0,0 +1,95 @@
+"""
+Крайний срок (deadline) обработки запроса
+
+Deadline создаётся один раз на запрос (или этап) и передаётся во все HTTP-вызовы:
+каждый вызов получает таймауты не больше оставшегося времени, а повторные
+попытки и fallback — только остаток бюджета, а не новый полный таймаут.
+Deadline можно отменить досрочно (cancel) — так останавливается проигравший
+запрос при хеджировании. Производный deadline (child, earliest) помнит
+родителя: отмена родителя отменяет и его, а срок не позже родительского.
+"""
+import time
+from typing import Optional, Tuple
+
+
+class Deadline:
+    """
+    Момент времени (по monotonic-часам), к которому запрос должен завершиться
+    (None — без ограничения по времени, только отмена)
+    """
+
+    __slots__ = ("expires_at", "parent", "_cancelled")
+
+    def __init__(self, expires_at: Optional[float], parent: Optional["Deadline"] = None):
+        if parent is not None and parent.expires_at is not None:
+            expires_at = parent.expires_at if expires_at is None else min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self.parent = parent
+        self._cancelled = False
+
+    @classmethod
+    def after(cls, seconds: Optional[float]) -> Optional["Deadline"]:
+        """Deadline через seconds секунд (None, если ограничения нет)"""
+        if not seconds or seconds <= 0:
+            return None
+        return cls(time.monotonic() + seconds)
+
+    @staticmethod
+    def earliest(deadline: Optional["Deadline"], seconds: Optional[float]) -> Optional["Deadline"]:
+        """
+        Более ранний из двух сроков: уже заданного deadline и «через seconds секунд»
+        (например, общий срок запроса и лимит времени этапа); отмена deadline
+        отменяет и результат
+        """
+        if deadline is None:
+            return Deadline.after(seconds)
+        if not seconds or seconds <= 0:
+            return deadline
+        return Deadline(time.monotonic() + seconds, parent=deadline)
+
+    @staticmethod
+    def child(deadline: Optional["Deadline"]) -> "Deadline":
+        """
+        Отдельно отменяемый deadline с тем же сроком (для одной из параллельных попыток):
+        его отмена не затрагивает родителя, а отмена родителя отменяет его
+        """
+        return Deadline(None, parent=deadline)
+
+    def cancel(self) -> None:
+        """Отменить: запросы с этим deadline прекращаются при ближайшей проверке"""
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        """Отменён сам deadline или один из родительских"""
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+
+    def remaining(self) -> float:
+        """Оставшееся время, сек (не меньше 0; inf, если срок не задан)"""
+        if self.cancelled:
+            return 0.0
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    @staticmethod
+    def http_timeout(deadline: Optional["Deadline"], connect: float, read: float) -> Tuple[float, float]:
+        """
+        Таймауты (connect, read) для requests, урезанные до остатка deadline
+
+        Args:
+            deadline: Deadline или None
+            connect: Таймаут установки соединения, сек
+            read: Таймаут чтения ответа, сек
+        """
+        if deadline is None:
+            return connect, read
+        remaining = max(deadline.remaining(), 0.001)
+        return min(connect, remaining), min(read, remaining)
+
+    def __repr__(self):
+        return f"<Deadline remaining={self.remaining():.2f}s>"
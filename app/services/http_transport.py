@@ -0,0 +1,269 @@
+"""
+HTTP-транспорт для запросов к внешним API (AI провайдеры, поиск, почта)
+
+На каждый адрес (схема + хост + порт) заводится одна сессия с пулом
+keep-alive соединений: HTTP_POOL_MAXSIZE соединений на адрес, общих для всех
+потоков процесса и всех классов провайдеров, поэтому запрос этапа обычно идёт
+по уже открытому соединению, без нового рукопожатия TCP+TLS. Cookies сессии
+не сохраняют: к одному адресу обращаются разные провайдеры с разными ключами.
+
+HTTP_HTTP2=1 включает HTTP/2 (несколько запросов мультиплексируются в одном
+соединении) через необязательную библиотеку httpx[http2]; если она не
+установлена, используется requests с keep-alive. Ответы HTTP/2 приводятся к
+интерфейсу requests.Response, а ошибки — к requests.exceptions, поэтому
+вызывающему коду разница не видна.
+
+Число новых соединений (рукопожатий) и запросов по адресам — stats().
+"""
+import json
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from flask import current_app, has_app_context
+
+try:
+    import httpx
+except ImportError:  # HTTP/2 необязателен
+    httpx = None
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _reject_cookies() -> DefaultCookiePolicy:
+    """Политика cookies, которая не принимает и не отправляет ни одного cookie"""
+    return DefaultCookiePolicy(allowed_domains=[])
+
+
+def _origin(url: str) -> str:
+    """https://api.openai.com/v1/chat -> https://api.openai.com:443"""
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "https").lower()
+    return f"{scheme}://{(parts.hostname or '').lower()}:{parts.port or _DEFAULT_PORTS.get(scheme, 443)}"
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        HttpTransport._count_connection(f"http://{self.host.lower()}:{self.port or 80}")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        HttpTransport._count_connection(f"https://{self.host.lower()}:{self.port or 443}")
+        return super()._new_conn()
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter, считающий новые соединения своих пулов"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool
+        }
+
+
+class _Http2Response:
+    """Ответ httpx с интерфейсом requests.Response (то, что используют провайдеры)"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    @property
+    def encoding(self) -> Optional[str]:
+        return self._response.encoding
+
+    @encoding.setter
+    def encoding(self, value: str) -> None:
+        self._response.encoding = value
+
+    @property
+    def text(self) -> str:
+        with _translate_errors():
+            self._response.read()
+        return self._response.text
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def iter_lines(self, decode_unicode: bool = True):
+        with _translate_errors():
+            yield from self._response.iter_lines()
+
+    def close(self) -> None:
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _translate_errors:
+    """Контекст: исключения httpx -> requests.exceptions (их ловят провайдеры)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc is None or httpx is None:
+            return False
+        if isinstance(exc, httpx.TimeoutException):
+            raise requests.exceptions.Timeout(str(exc)) from exc
+        if isinstance(exc, httpx.TransportError):
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+        return False
+
+
+class HttpTransport:
+    """
+    Общие для процесса пулы соединений к внешним API
+    """
+
+    _clients: Dict[str, Any] = {}
+    _stats: Dict[str, Dict[str, int]] = {}
+    _lock = threading.Lock()
+    _http2_warned = False
+
+    @classmethod
+    def request(cls, method: str, url: str, **kwargs):
+        """
+        Выполнить запрос через пул соединений адреса url
+
+        Аргументы — как у requests.request (params, headers, json, timeout, stream).
+
+        Returns:
+            requests.Response (или совместимый ответ HTTP/2)
+        """
+        origin = _origin(url)
+        client = cls._client(origin)
+        cls._count(origin, "requests")
+
+        if isinstance(client, requests.Session):
+            return client.request(method, url, **kwargs)
+        return cls._http2_request(client, origin, method, url, **kwargs)
+
+    @classmethod
+    def get(cls, url: str, **kwargs):
+        return cls.request("GET", url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs):
+        return cls.request("POST", url, **kwargs)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Dict[str, Any]]:
+        """
+        Соединения по адресам (в пределах процесса)
+
+        Returns:
+            {адрес: {"requests", "connections" (новые соединения — рукопожатия TCP+TLS),
+            "reuse_ratio" (доля запросов по уже открытому соединению), "http2"}}
+        """
+        with cls._lock:
+            stats = {origin: dict(counters) for origin, counters in cls._stats.items()}
+            http2 = {origin: not isinstance(client, requests.Session) for origin, client in cls._clients.items()}
+
+        for origin, counters in stats.items():
+            requests_count = counters.get("requests", 0)
+            connections = counters.get("connections", 0)
+            counters["requests"] = requests_count
+            counters["connections"] = connections
+            counters["reuse_ratio"] = round(max(0.0, 1 - connections / requests_count), 3) if requests_count else 0.0
+            counters["http2"] = http2.get(origin, False)
+        return dict(sorted(stats.items()))
+
+    @classmethod
+    def close_all(cls) -> None:
+        """Закрыть все пулы (соединения откроются заново при следующих запросах)"""
+        with cls._lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+        for client in clients:
+            client.close()
+
+    @classmethod
+    def _client(cls, origin: str):
+        """Сессия requests или клиент httpx для адреса (создаётся один раз)"""
+        client = cls._clients.get(origin)
+        if client is not None:
+            return client
+
+        with cls._lock:
+            client = cls._clients.get(origin)
+            if client is None:
+                client = cls._clients[origin] = cls._create_client()
+            return client
+
+    @classmethod
+    def _create_client(cls):
+        """Новый пул с настройками HTTP_* (под _lock)"""
+        config = current_app.config if has_app_context() else {}
+        maxsize = config.get("HTTP_POOL_MAXSIZE", 20)
+
+        if config.get("HTTP_HTTP2", False):
+            if httpx is not None:
+                try:
+                    client = httpx.Client(
+                        http2=True,
+                        limits=httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize,
+                                            keepalive_expiry=config.get("HTTP_KEEPALIVE_SECONDS", 60))
+                    )
+                    client.cookies.jar.set_policy(_reject_cookies())
+                    return client
+                except ImportError:
+                    pass  # httpx без пакета h2
+            if not cls._http2_warned and has_app_context():
+                current_app.logger.warning("HTTP_HTTP2 включён, но httpx[http2] не установлен — используется HTTP/1.1")
+                cls._http2_warned = True
+
+        session = requests.Session()
+        session.cookies.set_policy(_reject_cookies())
+        adapter = _PooledAdapter(pool_connections=1, pool_maxsize=maxsize,
+                                 pool_block=config.get("HTTP_POOL_BLOCK", False), max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @classmethod
+    def _http2_request(cls, client, origin: str, method: str, url: str,
+                       params=None, headers=None, json=None, timeout=None, stream: bool = False):
+        """Запрос через httpx с аргументами и ответом в стиле requests"""
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.complete":
+                cls._count_connection(origin)
+
+        with _translate_errors():
+            request = client.build_request(method, url, params=params, headers=headers, json=json,
+                                           timeout=timeout, extensions={"trace": trace})
+            response = client.send(request, stream=True)
+            if not stream:
+                try:
+                    response.read()
+                finally:
+                    response.close()
+        return _Http2Response(response)
+
+    @classmethod
+    def _count_connection(cls, origin: str) -> None:
+        cls._count(origin, "connections")
+
+    @classmethod
+    def _count(cls, origin: str, counter: str) -> None:
+        with cls._lock:
+            counters = cls._stats.setdefault(origin, {})
+            counters[counter] = counters.get(counter, 0) + 1
+
@@ -0,0 +1,476 @@
+"""
+Очередь фоновых заданий обработки новостей
+
+Задания хранятся в таблице processing_jobs, поэтому переживают перезапуск
+процесса. Выполняет их пул потоков — в веб-процессе (JOB_EXECUTOR=thread)
+или в отдельном процессе `flask jobs-worker` (JOB_EXECUTOR=external).
+
+Задание принадлежит исполнителю (worker_id — хост, PID и случайный суффикс),
+который его поставил или взял из очереди. Пока исполнитель жив, он раз в
+JOB_HEARTBEAT_SECONDS обновляет heartbeat_at своих заданий — и во время
+долгого запроса к модели тоже. Задание, чей исполнитель молчит дольше
+JOB_STALE_SECONDS, возвращается в очередь без владельца, и его забирает
+любой живой исполнитель: `flask jobs-worker` или надзор веб-процесса
+(при JOB_EXECUTOR=thread он же подбирает задания, оставшиеся в очереди
+после перезапуска).
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set
+from flask import current_app
+from sqlalchemy import case, and_, or_
+from app.extensions import db
+from app.models import ProcessingJob
+from app.services.pipeline_processor import PipelineProcessor
+from app.services.deadline import Deadline
+from app.services import priority as priorities
+from app.services.speculative import SpeculativeRuns
+
+
+class JobEvents:
+    """
+    Журнал событий выполняемых заданий в памяти процесса
+
+    Исполнитель публикует события (готов этап, задание завершено), а SSE-поток
+    читает их с нужной позиции и просыпается сразу при появлении нового события.
+    Журнал хранится ещё ttl_seconds секунд после завершения задания, чтобы
+    клиент, подключившийся с опозданием, получил все события.
+    """
+
+    _events: Dict[str, List[Dict[str, Any]]] = {}
+    _closed_at: Dict[str, float] = {}
+    _condition = threading.Condition()
+    ttl_seconds = 300
+
+    @classmethod
+    def open(cls, job_id: str) -> None:
+        """Начать журнал задания, если его ещё нет (и удалить устаревшие журналы)"""
+        with cls._condition:
+            now = time.monotonic()
+            for stale_id in [jid for jid, closed in cls._closed_at.items() if now - closed > cls.ttl_seconds]:
+                cls._events.pop(stale_id, None)
+                cls._closed_at.pop(stale_id, None)
+            cls._events.setdefault(job_id, [])
+
+    @classmethod
+    def publish(cls, job_id: str, event_type: str, data: Dict[str, Any]) -> None:
+        """Добавить событие и разбудить читателей"""
+        with cls._condition:
+            events = cls._events.get(job_id)
+            if events is None:
+                return
+            events.append({"event": event_type, "data": data})
+            cls._condition.notify_all()
+
+    @classmethod
+    def discard(cls, job_id: str) -> None:
+        """Удалить журнал задания, которое выполняет другой процесс (читатели перейдут на опрос БД)"""
+        with cls._condition:
+            cls._events.pop(job_id, None)
+            cls._closed_at.pop(job_id, None)
+            cls._condition.notify_all()
+
+    @classmethod
+    def close(cls, job_id: str) -> None:
+        """Отметить журнал завершённым"""
+        with cls._condition:
+            cls._closed_at[job_id] = time.monotonic()
+            cls._condition.notify_all()
+
+    @classmethod
+    def read(cls, job_id: str, cursor: int, timeout: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Получить события начиная с позиции cursor, ожидая до timeout секунд
+
+        Returns:
+            Список событий (может быть пустым по таймауту) или None, если
+            задание выполняется не в этом процессе
+        """
+        with cls._condition:
+            if job_id not in cls._events:
+                return None
+            cls._condition.wait_for(
+                lambda: len(cls._events.get(job_id, ())) > cursor or job_id in cls._closed_at,
+                timeout=timeout
+            )
+            return list(cls._events.get(job_id, [])[cursor:])
+
+
+class JobQueue:
+    """
+    Постановка заданий в очередь и их выполнение пулом исполнителей
+    """
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _executor_lock = threading.Lock()
+
+    # Задания этого процесса (поставленные в его пул или выполняемые им)
+    _owned: Set[str] = set()
+    _owned_lock = threading.Lock()
+
+    _worker_id: Optional[str] = None
+    _worker_pid: Optional[int] = None
+    _supervisor_pid: Optional[int] = None
+
+    @classmethod
+    def enqueue(cls, user_id: int, news_text: str, stage_ids: List[int],
+                deadline_seconds: Optional[float] = None,
+                priority: str = priorities.NORMAL) -> ProcessingJob:
+        """
+        Создать задание и передать его пулу исполнителей
+
+        Args:
+            user_id: ID пользователя
+            news_text: Текст новости
+            stage_ids: Список ID этапов для обработки
+            deadline_seconds: Лимит времени обработки, отсчитывается от начала выполнения
+                              (по умолчанию PIPELINE_DEADLINE_SECONDS)
+            priority: Класс приоритета (interactive, normal, bulk): порядок выборки из
+                      очереди и получения слотов провайдеров
+
+        Returns:
+            ProcessingJob (status=queued)
+        """
+        app = current_app._get_current_object()
+        thread_mode = app.config.get("JOB_EXECUTOR", "thread") == "thread"
+
+        job = ProcessingJob(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            status=ProcessingJob.STATUS_QUEUED,
+            news_text=news_text,
+            stage_ids=json.dumps(stage_ids),
+            deadline_seconds=deadline_seconds,
+            priority=priorities.normalize(priority),
+            # В пуле веб-процесса задание сразу принадлежит ему; без владельца его заберёт jobs-worker
+            worker_id=cls.worker_id() if thread_mode else None,
+            heartbeat_at=datetime.utcnow() if thread_mode else None
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        if thread_mode:
+            JobEvents.open(job.id)
+            cls._submit(app, job.id)
+
+        return job
+
+    @classmethod
+    def get_job(cls, job_id: str) -> Optional[ProcessingJob]:
+        """Получить задание по ID"""
+        return db.session.get(ProcessingJob, job_id)
+
+    @classmethod
+    def run_job(cls, app, job_id: str) -> None:
+        """
+        Выполнить задание: атомарно захватить его (queued → running),
+        прогнать конвейер и сохранять результаты этапов по мере готовности
+
+        Args:
+            app: Объект Flask-приложения
+            job_id: ID задания
+        """
+        with app.app_context():
+            try:
+                if not cls._claim(job_id):
+                    # Задание уже взял другой исполнитель — читатели этого процесса перейдут на опрос БД
+                    JobEvents.discard(job_id)
+                    return
+                with cls._owned_lock:
+                    cls._owned.add(job_id)
+                cls._run_claimed(app, job_id)
+            finally:
+                with cls._owned_lock:
+                    cls._owned.discard(job_id)
+
+    @classmethod
+    def _run_claimed(cls, app, job_id: str) -> None:
+        """Выполнить захваченное задание (в контексте приложения)"""
+        JobEvents.open(job_id)
+        job = db.session.get(ProcessingJob, job_id)
+        partial_results: List[Dict[str, Any]] = []
+
+        def save_stage_result(stage_result: Dict[str, Any]):
+            partial_results.append(stage_result)
+            JobEvents.publish(job_id, "stage", stage_result)
+            job.results = json.dumps(partial_results, ensure_ascii=False)
+            db.session.commit()
+
+        try:
+            deadline = Deadline.after(job.deadline_seconds or app.config.get("PIPELINE_DEADLINE_SECONDS", 0))
+
+            # Этапы, выполненные заранее, пока редактор вводил текст
+            ready_results = None
+            if app.config.get("SPECULATIVE_ENABLED", False):
+                ready_results = SpeculativeRuns.claim(job.user_id, job.news_text, deadline)
+
+            result = PipelineProcessor.process_news(
+                user_id=job.user_id,
+                news_text=job.news_text,
+                stage_ids=job.get_stage_ids(),
+                on_stage_result=save_stage_result,
+                on_stage_delta=lambda event: JobEvents.publish(job_id, "delta", event),
+                deadline=deadline,
+                ready_results=ready_results,
+                priority=job.priority
+            )
+            job.results = json.dumps(result["results"], ensure_ascii=False)
+            job.success = result["success"]
+            job.error = result["error"]
+            job.status = ProcessingJob.STATUS_DONE
+
+        except Exception as e:
+            db.session.rollback()
+            job.success = False
+            job.error = f"Ошибка обработки: {str(e)}"
+            job.status = ProcessingJob.STATUS_FAILED
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+        JobEvents.publish(job_id, "done", {"status": job.status, "success": job.success, "error": job.error})
+        JobEvents.close(job_id)
+
+    @classmethod
+    def stream_events(cls, job_id: str, poll_interval: float = 0.5, keepalive: float = 15.0):
+        """
+        Генератор событий задания для SSE
+
+        Если задание выполняется в этом процессе, события приходят из JobEvents
+        сразу по мере готовности этапов; иначе (исполнитель в другом процессе,
+        журнал уже удалён) — опросом таблицы processing_jobs.
+
+        Yields:
+            Dict {"event": "delta" | "stage" | "done", "data": dict} или None (keep-alive).
+            Фрагменты ответа (delta) доступны только для заданий этого процесса
+        """
+        cursor = 0
+        sent_results = 0
+
+        while True:
+            events = JobEvents.read(job_id, cursor, timeout=keepalive)
+
+            if events is not None:
+                if not events:
+                    yield None
+                for event in events:
+                    cursor += 1
+                    yield event
+                    if event["event"] == "done":
+                        return
+                continue
+
+            # Задание выполняется в другом процессе — читаем состояние из БД
+            db.session.expire_all()
+            job = db.session.get(ProcessingJob, job_id)
+            if job is None:
+                return
+
+            results = job.get_results()
+            for stage_result in results[sent_results:]:
+                yield {"event": "stage", "data": stage_result}
+            sent_results = max(sent_results, len(results))
+
+            if job.is_finished:
+                yield {"event": "done", "data": {"status": job.status, "success": job.success, "error": job.error}}
+                return
+
+            time.sleep(poll_interval)
+
+    @classmethod
+    def worker_id(cls) -> str:
+        """ID исполнителя этого процесса: хост, PID и случайный суффикс (новый после fork)"""
+        pid = os.getpid()
+        if cls._worker_pid != pid:
+            cls._worker_id = f"{socket.gethostname()[:80]}:{pid}:{uuid.uuid4().hex[:8]}"
+            cls._worker_pid = pid
+        return cls._worker_id
+
+    @classmethod
+    def heartbeat(cls) -> int:
+        """
+        Отметить, что задания этого процесса ещё выполняются (или ждут в его пуле)
+
+        Returns:
+            Количество отмеченных заданий
+        """
+        with cls._owned_lock:
+            job_ids = list(cls._owned)
+        if not job_ids:
+            return 0
+
+        count = ProcessingJob.query.filter(
+            ProcessingJob.id.in_(job_ids),
+            ProcessingJob.worker_id == cls.worker_id(),
+            ProcessingJob.status.in_((ProcessingJob.STATUS_QUEUED, ProcessingJob.STATUS_RUNNING))
+        ).update({"heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def requeue_stale(cls, stale_seconds: int) -> int:
+        """
+        Вернуть в очередь без владельца задания, чей исполнитель не подавал
+        сигнал жизни дольше stale_seconds (упал или процесс перезапущен)
+
+        Задания, выполняемые живым исполнителем, не трогаются, сколько бы ни
+        шёл запрос к модели: heartbeat обновляется независимо от этапов.
+
+        Returns:
+            Количество возвращённых в очередь заданий
+        """
+        threshold = datetime.utcnow() - timedelta(seconds=stale_seconds)
+        # Задания, созданные до появления heartbeat_at, оцениваются по updated_at
+        last_seen = db.func.coalesce(ProcessingJob.heartbeat_at, ProcessingJob.updated_at)
+        count = ProcessingJob.query.filter(
+            or_(ProcessingJob.status == ProcessingJob.STATUS_RUNNING,
+                and_(ProcessingJob.status == ProcessingJob.STATUS_QUEUED, ProcessingJob.worker_id.isnot(None))),
+            last_seen < threshold
+        ).update({"status": ProcessingJob.STATUS_QUEUED, "started_at": None,
+                  "worker_id": None, "heartbeat_at": None}, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def start_supervisor(cls, app) -> None:
+        """
+        Запустить надзор за заданиями веб-процесса (JOB_EXECUTOR=thread), один раз на процесс
+
+        Надзор раз в JOB_HEARTBEAT_SECONDS отмечает задания процесса, возвращает
+        в очередь задания упавших исполнителей и забирает в пул задания без
+        владельца — в том числе оставшиеся в очереди после перезапуска.
+        """
+        if app.config.get("JOB_EXECUTOR", "thread") != "thread":
+            return
+        pid = os.getpid()
+        if cls._supervisor_pid == pid:
+            return
+        with cls._executor_lock:
+            if cls._supervisor_pid == pid:
+                return
+            cls._supervisor_pid = pid
+        threading.Thread(target=cls._supervise, args=(app,), name="jobs-supervisor", daemon=True).start()
+
+    @classmethod
+    def run_worker(cls, app, workers: Optional[int] = None, poll_interval: float = 1.0) -> None:
+        """
+        Цикл отдельного процесса-исполнителя: забирает задания из очереди в БД
+        и выполняет их в пуле из workers потоков
+
+        Args:
+            app: Объект Flask-приложения
+            workers: Размер пула (по умолчанию JOB_WORKERS)
+            poll_interval: Пауза между опросами очереди, сек
+        """
+        workers = workers or app.config.get("JOB_WORKERS", 4)
+        stale_seconds = app.config.get("JOB_STALE_SECONDS", 120)
+        heartbeat_seconds = app.config.get("JOB_HEARTBEAT_SECONDS", 30)
+        in_flight = set()
+        last_heartbeat = 0.0
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs") as executor:
+            while True:
+                in_flight = {future for future in in_flight if not future.done()}
+                free_slots = workers - len(in_flight)
+
+                if time.monotonic() - last_heartbeat >= heartbeat_seconds:
+                    with app.app_context():
+                        cls.heartbeat()
+                        cls.requeue_stale(stale_seconds)
+                    last_heartbeat = time.monotonic()
+
+                if free_slots > 0:
+                    with app.app_context():
+                        job_ids = cls._unowned_job_ids(free_slots)
+
+                    for job_id in job_ids:
+                        in_flight.add(executor.submit(cls.run_job, app, job_id))
+
+                time.sleep(poll_interval)
+
+    @classmethod
+    def _supervise(cls, app) -> None:
+        """Цикл надзора веб-процесса (start_supervisor); первый проход — сразу после запуска"""
+        while True:
+            try:
+                with app.app_context():
+                    cls.heartbeat()
+                    cls.requeue_stale(app.config.get("JOB_STALE_SECONDS", 120))
+                    cls._adopt_unowned(app)
+            except Exception as e:
+                # БД временно недоступна — повторим на следующем проходе
+                app.logger.warning("Job supervisor: %s", e)
+            time.sleep(app.config.get("JOB_HEARTBEAT_SECONDS", 30))
+
+    @classmethod
+    def _adopt_unowned(cls, app) -> None:
+        """Забрать в пул веб-процесса задания без владельца (не больше свободных мест пула)"""
+        with cls._owned_lock:
+            free_slots = app.config.get("JOB_WORKERS", 4) - len(cls._owned)
+        if free_slots <= 0:
+            return
+
+        for job_id in cls._unowned_job_ids(free_slots):
+            adopted = ProcessingJob.query.filter(
+                ProcessingJob.id == job_id,
+                ProcessingJob.status == ProcessingJob.STATUS_QUEUED,
+                ProcessingJob.worker_id.is_(None)
+            ).update({"worker_id": cls.worker_id(), "heartbeat_at": datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+            if adopted == 1:
+                cls._submit(app, job_id)
+
+    @classmethod
+    def _unowned_job_ids(cls, limit: int) -> List[str]:
+        """ID заданий в очереди без владельца: сначала по приоритету, затем по времени постановки"""
+        return [row.id for row in ProcessingJob.query
+                .filter(ProcessingJob.status == ProcessingJob.STATUS_QUEUED, ProcessingJob.worker_id.is_(None))
+                .order_by(cls._priority_rank(), ProcessingJob.created_at)
+                .limit(limit)
+                .with_entities(ProcessingJob.id)]
+
+    @classmethod
+    def _submit(cls, app, job_id: str) -> None:
+        """Передать задание этого процесса в его пул"""
+        with cls._owned_lock:
+            cls._owned.add(job_id)
+        cls._get_executor(app).submit(cls.run_job, app, job_id)
+
+    @staticmethod
+    def _priority_rank():
+        """Выражение для сортировки очереди: сначала interactive, затем normal, затем bulk"""
+        return case({name: rank for rank, name in enumerate(priorities.CLASSES)},
+                    value=ProcessingJob.priority, else_=len(priorities.CLASSES))
+
+    @classmethod
+    def _claim(cls, job_id: str) -> bool:
+        """Атомарно перевести задание из queued в running (если оно без владельца или наше)"""
+        worker_id = cls.worker_id()
+        now = datetime.utcnow()
+        claimed = ProcessingJob.query.filter(
+            ProcessingJob.id == job_id,
+            ProcessingJob.status == ProcessingJob.STATUS_QUEUED,
+            or_(ProcessingJob.worker_id.is_(None), ProcessingJob.worker_id == worker_id)
+        ).update({"status": ProcessingJob.STATUS_RUNNING, "started_at": now,
+                  "worker_id": worker_id, "heartbeat_at": now},
+                 synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
+
+    @classmethod
+    def _get_executor(cls, app) -> ThreadPoolExecutor:
+        """Пул исполнителей веб-процесса (создаётся лениво, один на процесс)"""
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=app.config.get("JOB_WORKERS", 4),
+                        thread_name_prefix="jobs"
+                    )
+        return cls._executor
@@ -0,0 +1,222 @@
+"""
+Кэш ответов AI моделей
+
+Ключ — sha256 от нормализованных сообщений, api_identifier модели и итоговых
+параметров запроса, поэтому изменённый промпт или другая модель дают новый
+ключ. Два уровня: LRU в памяти процесса (ограничен по размеру в байтах) и
+таблица llm_cache, общая для всех процессов. Срок хранения задаётся в
+назначении этапа (StageAssignment.cache_ttl_seconds) или LLM_CACHE_TTL_SECONDS.
+
+Записи этапа или модели удаляются при изменении промпта, назначения, модели
+или провайдера (invalidate); память других процессов очищается, когда они
+видят новую версию конфигурации.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from app.extensions import db
+from app.models import LLMCacheEntry
+
+
+class LLMCache:
+    """
+    Кэш успешных ответов моделей (в памяти процесса + в БД)
+    """
+
+    # Раз в сколько сохранений удалять из БД просроченные записи
+    PURGE_EVERY = 200
+
+    # key -> (expires_at по monotonic-часам, размер в байтах, stage_id, model_id, результат)
+    _memory: "OrderedDict[str, Tuple[float, int, Optional[int], Optional[int], Dict[str, Any]]]" = OrderedDict()
+    _memory_bytes = 0
+    _version: Optional[int] = None
+    _stores = 0
+    _counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def make_key(api_identifier: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        """
+        Ключ кэша: sha256 от нормализованного запроса
+
+        Нормализация: единые переводы строк, без пробелов по краям сообщений,
+        параметры в отсортированном порядке.
+        """
+        normalized = [
+            {"role": message["role"], "content": (message.get("content") or "").replace("\r\n", "\n").strip()}
+            for message in messages
+        ]
+        payload = json.dumps({"model": api_identifier, "messages": normalized, "params": params},
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, key: str, version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Найти ответ в кэше: сначала в памяти процесса, затем в БД
+
+        Args:
+            key: Ключ (make_key)
+            version: Текущая версия конфигурации; если она изменилась,
+                     память процесса очищается
+
+        Returns:
+            {"content", "model", "usage"} или None
+        """
+        now = time.monotonic()
+        with cls._lock:
+            cls._sync_version(version)
+            entry = cls._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    cls._memory.move_to_end(key)
+                    cls._counters["memory_hits"] += 1
+                    return dict(entry[4])
+                cls._evict(key)
+
+        try:
+            row = db.session.query(
+                LLMCacheEntry.result, LLMCacheEntry.expires_at, LLMCacheEntry.stage_id, LLMCacheEntry.model_id
+            ).filter(LLMCacheEntry.key == key, LLMCacheEntry.expires_at > datetime.utcnow()).first()
+        except SQLAlchemyError as e:
+            cls._count_error(e)
+            row = None
+
+        if row is None:
+            with cls._lock:
+                cls._counters["misses"] += 1
+            return None
+
+        result = json.loads(row.result)
+        ttl = (row.expires_at - datetime.utcnow()).total_seconds()
+        with cls._lock:
+            cls._counters["db_hits"] += 1
+            cls._remember(key, result, ttl, row.stage_id, row.model_id)
+        return dict(result)
+
+    @classmethod
+    def set(cls, key: str, result: Dict[str, Any], ttl_seconds: int,
+            stage_id: Optional[int] = None, model_id: Optional[int] = None) -> None:
+        """
+        Сохранить успешный ответ модели в оба уровня кэша
+
+        Args:
+            key: Ключ (make_key)
+            result: Результат send_message (сохраняются content, model, usage)
+            ttl_seconds: Срок хранения, сек
+            stage_id, model_id: Для сброса записей при изменении этапа или модели
+        """
+        if not ttl_seconds or ttl_seconds <= 0:
+            return
+
+        value = {"content": result["content"], "model": result["model"], "usage": result.get("usage") or {}}
+        with cls._lock:
+            cls._remember(key, value, ttl_seconds, stage_id, model_id)
+            cls._counters["stores"] += 1
+            cls._stores += 1
+            purge = cls._stores % cls.PURGE_EVERY == 0
+
+        now = datetime.utcnow()
+        table = LLMCacheEntry.__table__
+        try:
+            # Отдельное соединение: не затрагиваем сессию вызывающего потока
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.key == key))
+                connection.execute(table.insert().values(
+                    key=key,
+                    stage_id=stage_id,
+                    model_id=model_id,
+                    result=json.dumps(value, ensure_ascii=False),
+                    expires_at=now + timedelta(seconds=ttl_seconds),
+                    created_at=now
+                ))
+                if purge:
+                    connection.execute(table.delete().where(table.c.expires_at <= now))
+        except SQLAlchemyError as e:
+            cls._count_error(e)
+
+    @classmethod
+    def invalidate(cls, stage_id: Optional[int] = None, model_ids: Optional[List[int]] = None) -> None:
+        """
+        Удалить записи этапа и/или моделей (после изменения промпта, назначения,
+        модели или провайдера). Без аргументов — очистить кэш целиком.
+        """
+        model_ids = list(model_ids or [])
+        clear_all = stage_id is None and not model_ids
+
+        def matches(entry) -> bool:
+            return clear_all or (stage_id is not None and entry[2] == stage_id) or entry[3] in model_ids
+
+        with cls._lock:
+            for key in [key for key, entry in cls._memory.items() if matches(entry)]:
+                cls._evict(key)
+
+        table = LLMCacheEntry.__table__
+        condition = None
+        if stage_id is not None:
+            condition = table.c.stage_id == stage_id
+        if model_ids:
+            by_model = table.c.model_id.in_(model_ids)
+            condition = by_model if condition is None else condition | by_model
+
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.delete() if clear_all else table.delete().where(condition))
+        except SQLAlchemyError as e:
+            cls._count_error(e)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Счётчики попаданий и промахов (в пределах процесса) и заполненность памяти"""
+        with cls._lock:
+            stats = dict(cls._counters)
+            stats["memory_entries"] = len(cls._memory)
+            stats["memory_bytes"] = cls._memory_bytes
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 4) if lookups else None
+        return stats
+
+    @classmethod
+    def _remember(cls, key: str, value: Dict[str, Any], ttl_seconds: float,
+                  stage_id: Optional[int], model_id: Optional[int]) -> None:
+        """Положить запись в LRU памяти процесса (под _lock), вытесняя старые"""
+        limit = current_app.config.get("LLM_CACHE_MEMORY_BYTES", 0)
+        size = len(key) + len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if ttl_seconds <= 0 or size > limit:
+            return
+
+        cls._evict(key)
+        cls._memory[key] = (time.monotonic() + ttl_seconds, size, stage_id, model_id, value)
+        cls._memory_bytes += size
+        while cls._memory_bytes > limit and cls._memory:
+            cls._evict(next(iter(cls._memory)))
+
+    @classmethod
+    def _evict(cls, key: str) -> None:
+        """Удалить запись из памяти процесса (под _lock)"""
+        entry = cls._memory.pop(key, None)
+        if entry is not None:
+            cls._memory_bytes -= entry[1]
+
+    @classmethod
+    def _sync_version(cls, version: Optional[int]) -> None:
+        """Очистить память процесса, если версия конфигурации изменилась (под _lock)"""
+        if version is None or version == cls._version:
+            return
+        if cls._version is not None:
+            cls._memory.clear()
+            cls._memory_bytes = 0
+        cls._version = version
+
+    @classmethod
+    def _count_error(cls, error: Exception) -> None:
+        """Ошибка БД кэша не должна ломать запрос к модели — только учитываем её"""
+        with cls._lock:
+            cls._counters["errors"] += 1
+        current_app.logger.warning("LLM cache: %s", error)
@@ -0,0 +1,340 @@
+"""
+Поиск почти-дубликатов обработанных новостей (MinHash + LSH)
+
+Одна и та же новость приходит с разных лент с немного разными формулировками —
+точный ключ кэша их не совпадает. Для каждой обработанной новости считается
+MinHash-подпись по словесным шинглам; индекс LSH (BANDS полос по ROWS значений)
+за доли миллисекунды находит кандидатов, а сходство проверяется по подписям.
+
+Подписи хранятся в файле индекса (записи фиксированного размера, только
+дописываются) и читаются через mmap, поэтому после перезапуска подписи не
+пересчитываются; новые записи других процессов подхватываются по росту файла.
+Результаты этапов — в таблице news_fingerprints (по ней же файл
+восстанавливается, если он потерян).
+
+Раз в NEAR_DUPLICATE_COMPACT_SECONDS процесс удаляет из таблицы отпечатки
+старше NEAR_DUPLICATE_MAX_AGE_HOURS и переписывает файл из оставшихся.
+Дописывание, перезапись и восстановление файла идут под межпроцессной
+блокировкой (<файл индекса>.lock); процессы замечают перезаписанный файл по
+смене inode и строят индекс в памяти заново.
+"""
+import hashlib
+import json
+import mmap
+import os
+import random
+import re
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from app.extensions import db
+from app.models import NewsFingerprint
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки (один процесс)
+    fcntl = None
+
+_PRIME = (1 << 61) - 1
+_MASK = 0xFFFFFFFF
+_WORD_RE = re.compile(r"\w+")
+
+
+def _make_permutations(count: int) -> List[Tuple[int, int]]:
+    """Параметры (a, b) хеш-функций MinHash; seed фиксирован — подписи сопоставимы между процессами"""
+    rng = random.Random(20261016)
+    return [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(count)]
+
+
+class NearDuplicateIndex:
+    """
+    Индекс MinHash-подписей обработанных новостей (общий для потоков процесса)
+    """
+
+    NUM_PERM = 128
+    BANDS = 16
+    ROWS = NUM_PERM // BANDS
+    SHINGLE_WORDS = 3
+
+    # Запись файла: ID отпечатка + подпись, uint32
+    RECORD_ITEMS = 1 + NUM_PERM
+    RECORD_SIZE = RECORD_ITEMS * array("I").itemsize
+
+    # Параметры хеш-функций (a * x + b) mod p
+    _permutations = _make_permutations(NUM_PERM)
+
+    _path: Optional[str] = None
+    _file = None
+    _mmap: Optional[mmap.mmap] = None
+    _view: Optional[memoryview] = None
+    _records = 0
+    _buckets: Dict[Tuple[int, int], List[int]] = {}
+    _compacted_at = 0.0
+    _lock = threading.RLock()
+
+    @classmethod
+    def signature(cls, text: str) -> Optional[array]:
+        """
+        MinHash-подпись текста по шинглам из SHINGLE_WORDS слов
+
+        Returns:
+            array('I') длины NUM_PERM или None, если в тексте нет слов
+        """
+        words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+        if not words:
+            return None
+
+        size = min(cls.SHINGLE_WORDS, len(words))
+        shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+                  for shingle in shingles]
+
+        return array("I", (min(((a * h + b) % _PRIME) & _MASK for h in hashes)
+                           for a, b in cls._permutations))
+
+    @classmethod
+    def find(cls, signature: array, threshold: float) -> List[Tuple[int, float]]:
+        """
+        Найти отпечатки, похожие на подпись не меньше чем на threshold
+        (оценка коэффициента Жаккара по совпадающим позициям подписи)
+
+        Returns:
+            [(ID отпечатка, сходство)] по убыванию сходства
+        """
+        matches = {}
+        with cls._lock:
+            cls._sync()
+            candidates = set()
+            for bucket in cls._band_keys(signature):
+                candidates.update(cls._buckets.get(bucket, ()))
+
+            for record in candidates:
+                offset = record * cls.RECORD_ITEMS
+                stored = cls._view[offset + 1:offset + cls.RECORD_ITEMS].tolist()
+                similarity = sum(1 for x, y in zip(signature, stored) if x == y) / cls.NUM_PERM
+                if similarity >= threshold:
+                    fingerprint_id = cls._view[offset]
+                    matches[fingerprint_id] = max(similarity, matches.get(fingerprint_id, 0.0))
+
+        return sorted(matches.items(), key=lambda item: -item[1])
+
+    @classmethod
+    def lookup(cls, signature: array, threshold: float,
+               max_age_hours: float = 0) -> Optional[Tuple[NewsFingerprint, float]]:
+        """
+        Самый похожий отпечаток, сохранённый не раньше чем max_age_hours назад
+
+        Returns:
+            (NewsFingerprint, сходство) или None
+        """
+        try:
+            matches = cls.find(signature, threshold)
+            if not matches:
+                return None
+
+            query = NewsFingerprint.query.filter(NewsFingerprint.id.in_([fid for fid, _ in matches]))
+            if max_age_hours and max_age_hours > 0:
+                query = query.filter(NewsFingerprint.created_at >= datetime.utcnow() - timedelta(hours=max_age_hours))
+            fingerprints = {fingerprint.id: fingerprint for fingerprint in query}
+        except (OSError, SQLAlchemyError) as e:
+            current_app.logger.warning("Near-duplicate index: %s", e)
+            return None
+
+        for fingerprint_id, similarity in matches:
+            if fingerprint_id in fingerprints:
+                return fingerprints[fingerprint_id], similarity
+        return None
+
+    @classmethod
+    def remember(cls, signature: array, results: Dict[str, Dict[str, Any]]) -> Optional[int]:
+        """
+        Сохранить отпечаток новости с результатами этапов и добавить его в индекс
+
+        Args:
+            signature: Подпись (signature)
+            results: {stage_name: {"key", "content", "model_used"}}
+
+        Returns:
+            ID отпечатка или None при ошибке
+        """
+        table = NewsFingerprint.__table__
+        try:
+            # Отдельное соединение: не затрагиваем сессию вызывающего потока
+            with db.engine.begin() as connection:
+                fingerprint_id = connection.execute(table.insert().values(
+                    signature=signature.tobytes(),
+                    results=json.dumps(results, ensure_ascii=False),
+                    created_at=datetime.utcnow()
+                )).inserted_primary_key[0]
+
+            record = array("I", [fingerprint_id])
+            record.extend(signature)
+            with cls._lock:
+                cls._sync()
+                with cls._file_lock(cls._path):
+                    cls._append(record.tobytes())
+                cls._sync()
+                cls._maybe_compact()
+            return fingerprint_id
+        except (OSError, SQLAlchemyError) as e:
+            current_app.logger.warning("Near-duplicate index: %s", e)
+            return None
+
+    @classmethod
+    def compact(cls) -> int:
+        """
+        Удалить отпечатки старше NEAR_DUPLICATE_MAX_AGE_HOURS и переписать файл
+        индекса из оставшихся (при MAX_AGE_HOURS=0 отпечатки хранятся бессрочно)
+
+        Returns:
+            Количество удалённых отпечатков
+        """
+        cutoff = cls._cutoff()
+        if cutoff is None:
+            return 0
+
+        table = NewsFingerprint.__table__
+        with cls._lock:
+            cls._sync()
+            with cls._file_lock(cls._path):
+                # Сначала файл: если процесс упадёт до удаления строк, следующее сжатие повторит всё
+                cls._rewrite(cls._path)
+                with db.engine.begin() as connection:
+                    deleted = connection.execute(table.delete().where(table.c.created_at < cutoff)).rowcount
+            cls._sync()
+        return deleted
+
+    @classmethod
+    def _band_keys(cls, signature) -> List[Tuple[int, int]]:
+        """Ключи корзин LSH: (номер полосы, хеш её значений)"""
+        return [(band, hash(tuple(signature[band * cls.ROWS:(band + 1) * cls.ROWS])))
+                for band in range(cls.BANDS)]
+
+    @classmethod
+    def _index_path(cls) -> str:
+        return current_app.config.get("NEAR_DUPLICATE_INDEX_PATH") or \
+            os.path.join(current_app.instance_path, "near_duplicates.idx")
+
+    @classmethod
+    def _sync(cls) -> None:
+        """
+        Отобразить в память записи, появившиеся в файле с прошлого раза
+        (в том числе дописанные другими процессами), и добавить их в корзины (под _lock)
+        """
+        path = cls._index_path()
+        if path != cls._path:
+            cls._close()
+            cls._path = path
+
+        if not os.path.exists(path):
+            # Файл потерян — восстанавливаем из таблицы (если его не восстановил другой процесс)
+            with cls._file_lock(path):
+                if not os.path.exists(path):
+                    cls._rewrite(path)
+
+        if cls._file is not None and os.fstat(cls._file.fileno()).st_ino != os.stat(path).st_ino:
+            # Файл перезаписан при сжатии — индекс в памяти строится заново
+            cls._close()
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        records = size // cls.RECORD_SIZE  # недописанная запись в конце не учитывается
+        if records <= cls._records:
+            return
+
+        indexed = cls._records
+        cls._release_map()
+        cls._file = cls._file or open(path, "rb")
+        cls._mmap = mmap.mmap(cls._file.fileno(), records * cls.RECORD_SIZE, access=mmap.ACCESS_READ)
+        cls._view = memoryview(cls._mmap).cast("I")
+
+        for record in range(indexed, records):
+            offset = record * cls.RECORD_ITEMS
+            for bucket in cls._band_keys(cls._view[offset + 1:offset + cls.RECORD_ITEMS].tolist()):
+                cls._buckets.setdefault(bucket, []).append(record)
+        cls._records = records
+
+    @classmethod
+    def _append(cls, data: bytes) -> None:
+        """Дописать запись в файл одним вызовом write (под _file_lock: не теряется при перезаписи файла)"""
+        fd = os.open(cls._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def _maybe_compact(cls) -> None:
+        """Сжать индекс, если с прошлой проверки прошло NEAR_DUPLICATE_COMPACT_SECONDS и есть устаревшие отпечатки"""
+        interval = current_app.config.get("NEAR_DUPLICATE_COMPACT_SECONDS", 3600)
+        cutoff = cls._cutoff()
+        if cutoff is None or interval <= 0 or time.monotonic() - cls._compacted_at < interval:
+            return
+        cls._compacted_at = time.monotonic()
+
+        stale = db.session.query(NewsFingerprint.id).filter(NewsFingerprint.created_at < cutoff).first()
+        if stale is not None:
+            cls.compact()
+
+    @staticmethod
+    def _cutoff() -> Optional[datetime]:
+        """Граница устаревания отпечатков (None — хранятся бессрочно)"""
+        max_age_hours = current_app.config.get("NEAR_DUPLICATE_MAX_AGE_HOURS", 24)
+        if not max_age_hours or max_age_hours <= 0:
+            return None
+        return datetime.utcnow() - timedelta(hours=max_age_hours)
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(path: str):
+        """Межпроцессная блокировка файла индекса (дописывание, перезапись, восстановление)"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @classmethod
+    def _rewrite(cls, path: str) -> None:
+        """Записать файл индекса заново из таблицы news_fingerprints (только свежие отпечатки; под _file_lock)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        rows = db.session.query(NewsFingerprint.id, NewsFingerprint.signature).order_by(NewsFingerprint.id)
+        cutoff = cls._cutoff()
+        if cutoff is not None:
+            rows = rows.filter(NewsFingerprint.created_at >= cutoff)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for fingerprint_id, signature in rows:
+                record = array("I", [fingerprint_id])
+                record.frombytes(signature)
+                if len(record) == cls.RECORD_ITEMS:
+                    f.write(record.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def _release_map(cls) -> None:
+        if cls._view is not None:
+            cls._view.release()
+            cls._view = None
+        if cls._mmap is not None:
+            cls._mmap.close()
+            cls._mmap = None
+
+    @classmethod
+    def _close(cls) -> None:
+        cls._release_map()
+        if cls._file is not None:
+            cls._file.close()
+            cls._file = None
+        cls._records = 0
+        cls._buckets = {}
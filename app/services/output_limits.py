@@ -0,0 +1,166 @@
+"""
+Лимит длины ответа (max_tokens) по наблюдаемой длине ответов этапа
+
+Без явного max_tokens все провайдеры запрашивают до 1000 токенов: короткой
+классификации это лишний запас (провайдер резервирует под него ресурсы, и
+худшее время ответа растёт), а развёрнутый анализ обрезается. Поэтому длина
+каждого успешного ответа этапа записывается в таблицу stage_output_samples,
+а max_tokens для пары (этап, модель) берётся как перцентиль
+OUTPUT_TOKENS_PERCENTILE последних ответов плюс запас OUTPUT_TOKENS_HEADROOM.
+Если заметная доля ответов упёрлась в лимит, он удваивается.
+
+Выученный лимит заменяет только встроенный DEFAULT_MAX_TOKENS: max_tokens,
+заданный в назначении этапа или в параметрах модели, важнее выученного. Пока
+ответов меньше OUTPUT_TOKENS_MIN_SAMPLES, действует DEFAULT_MAX_TOKENS.
+Выученные значения кэшируются в памяти процесса на OUTPUT_TOKENS_REFRESH_SECONDS
+и округляются вверх до STEP токенов, чтобы не менять ключ кэша ответов
+(LLMCache) на каждом новом замере.
+"""
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app.extensions import db
+from app.models import StageOutputSample
+
+
+class OutputTokenLimits:
+    """
+    Выученные лимиты длины ответа по этапам и моделям
+    """
+
+    # Сколько последних ответов пары (этап, модель) учитывается и хранится в БД
+    WINDOW = 500
+
+    # Раз в сколько записей удалять из БД ответы пары старше окна
+    PURGE_EVERY = 100
+
+    # Шаг округления лимита, токенов
+    STEP = 64
+
+    # (stage_id, model_id) -> (время расчёта по monotonic-часам, лимит или None)
+    _limits: Dict[Tuple[int, int], Tuple[float, Optional[int]]] = {}
+    _records = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def record(cls, stage_id: int, model_id: int, usage: Optional[Dict[str, Any]], max_tokens: int) -> None:
+        """
+        Записать длину успешного ответа модели на запрос этапа
+
+        Args:
+            stage_id: ID этапа
+            model_id: ID модели, которая ответила
+            usage: usage результата (нужен completion_tokens; без него ответ не учитывается)
+            max_tokens: Лимит, с которым выполнялся запрос
+        """
+        output_tokens = (usage or {}).get("completion_tokens")
+        if not output_tokens:
+            return
+
+        with cls._lock:
+            cls._records += 1
+            purge = cls._records % cls.PURGE_EVERY == 0
+
+        table = StageOutputSample.__table__
+        try:
+            # Отдельное соединение: не затрагиваем сессию вызывающего потока
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(
+                    stage_id=stage_id,
+                    model_id=model_id,
+                    output_tokens=int(output_tokens),
+                    max_tokens=int(max_tokens),
+                    truncated=output_tokens >= max_tokens,
+                    created_at=datetime.utcnow()
+                ))
+                if purge:
+                    oldest_kept = connection.execute(
+                        select(table.c.id)
+                        .where(table.c.stage_id == stage_id, table.c.model_id == model_id)
+                        .order_by(table.c.id.desc()).offset(cls.WINDOW - 1).limit(1)
+                    ).scalar()
+                    if oldest_kept is not None:
+                        connection.execute(table.delete().where(
+                            table.c.stage_id == stage_id, table.c.model_id == model_id, table.c.id < oldest_kept
+                        ))
+        except SQLAlchemyError as e:
+            current_app.logger.warning("Output token limits: %s", e)
+
+    @classmethod
+    def limit(cls, stage_id: int, model_id: int) -> Optional[int]:
+        """
+        Выученный max_tokens для запроса этапа к модели
+
+        Returns:
+            Лимит или None, если подбор выключен (OUTPUT_TOKENS_LEARNING=0) или
+            ответов пока мало — тогда действует DEFAULT_MAX_TOKENS
+        """
+        config = current_app.config
+        if not config.get("OUTPUT_TOKENS_LEARNING", True):
+            return None
+
+        key = (stage_id, model_id)
+        now = time.monotonic()
+        cached = cls._limits.get(key)
+        if cached is not None and now - cached[0] < config.get("OUTPUT_TOKENS_REFRESH_SECONDS", 60):
+            return cached[1]
+
+        limit = cls.learned(stage_id, [model_id])[model_id]["max_tokens"]
+        with cls._lock:
+            cls._limits[key] = (now, limit)
+        return limit
+
+    @classmethod
+    def learned(cls, stage_id: int, model_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Статистика ответов этапа по моделям
+
+        Returns:
+            {model_id: {"samples", "percentile" (длина ответа, токенов), "truncated"
+            (ответов, упёршихся в лимит), "max_tokens" (выученный лимит или None)}}
+        """
+        return {model_id: cls._compute(cls._samples(stage_id, model_id)) for model_id in model_ids}
+
+    @classmethod
+    def _samples(cls, stage_id: int, model_id: int) -> List[Tuple[int, int, bool]]:
+        """Последние ответы пары: (output_tokens, max_tokens, truncated)"""
+        table = StageOutputSample.__table__
+        try:
+            with db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(table.c.output_tokens, table.c.max_tokens, table.c.truncated)
+                    .where(table.c.stage_id == stage_id, table.c.model_id == model_id)
+                    .order_by(table.c.id.desc()).limit(cls.WINDOW)
+                ).fetchall()
+        except SQLAlchemyError as e:
+            current_app.logger.warning("Output token limits: %s", e)
+            return []
+        return [(row.output_tokens, row.max_tokens, bool(row.truncated)) for row in rows]
+
+    @classmethod
+    def _compute(cls, samples: List[Tuple[int, int, bool]]) -> Dict[str, Any]:
+        """Перцентиль длины ответов и лимит с запасом"""
+        config = current_app.config
+        q = config.get("OUTPUT_TOKENS_PERCENTILE", 0.99)
+        lengths = sorted(output_tokens for output_tokens, _, _ in samples)
+        truncated = [max_tokens for _, max_tokens, was_truncated in samples if was_truncated]
+        stats = {"samples": len(samples), "percentile": None, "truncated": len(truncated), "max_tokens": None}
+        if not lengths or len(lengths) < config.get("OUTPUT_TOKENS_MIN_SAMPLES", 20):
+            return stats
+
+        percentile = lengths[min(len(lengths) - 1, int(q * len(lengths)))]
+        limit = percentile * (1 + config.get("OUTPUT_TOKENS_HEADROOM", 0.2))
+        if len(truncated) > (1 - q) * len(samples):
+            # Обрезается больше ответов, чем допускает перцентиль — настоящая длина неизвестна
+            limit = max(limit, 2 * max(truncated))
+
+        limit = math.ceil(limit / cls.STEP) * cls.STEP
+        stats["percentile"] = percentile
+        stats["max_tokens"] = int(min(max(limit, config.get("OUTPUT_TOKENS_MIN", 64)),
+                                      config.get("OUTPUT_TOKENS_MAX", 8192)))
+        return stats
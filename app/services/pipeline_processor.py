@@ -1,26 +1,112 @@
 """
 Сервис для конвейерной обработки новостей через выбранные этапы
 """
-from typing import List, Dict, Any
-from app.models import Stage, StageAssignment, User
-from app.services.ai_providers import send_ai_request
-from app.services.prompt_manager import PromptManager
+import hashlib
+import json
+import math
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from flask import current_app
+from app.models import Stage, StageAssignment
+from app.services.ai_providers import send_ai_request, send_hedged_request, route_models, DEFAULT_MAX_TOKENS
+from app.services.chunking import split_text
+from app.services.config_snapshot import ConfigSnapshot, StageConfig
+from app.services.deadline import Deadline
+from app.services.near_duplicates import NearDuplicateIndex
+from app.services.output_limits import OutputTokenLimits
+from app.services import priority as priorities
+from app.services.search_providers import search_news
+from app.services.stage_graph import StageGraph, StageGraphError
+from app.services.token_budget import TokenBudget
+
+
+class PlannedStage:
+    """
+    Этап, подготовленный к выполнению
+
+    Содержит всё, что нужно для запуска этапа (назначенная модель, текст промпта,
+    зависимости), поэтому при выполнении этапа обращений к БД за настройками нет.
+    План строится один раз и может использоваться для многих новостей и из
+    нескольких потоков одновременно — объект после построения не изменяется.
+    """
+
+    __slots__ = ("id", "name", "display_name", "order", "kind", "dependencies",
+                 "model_id", "fallback_chain", "routing_policy", "hedge_after_ms", "prompt_text",
+                 "timeout_seconds", "cache_ttl_seconds", "max_tokens", "fused_with", "priority", "error")
+
+    def __init__(self, stage: StageConfig):
+        self.id = stage.id
+        self.name = stage.name
+        self.display_name = stage.display_name
+        self.order = stage.order
+        self.kind = stage.kind
+        self.dependencies = stage.dependencies
+        self.model_id: Optional[int] = None
+        self.fallback_chain: Tuple[int, ...] = ()  # резервные модели по порядку
+        self.routing_policy = StageAssignment.ROUTING_ORDERED
+        self.hedge_after_ms: Optional[int] = None  # задан, только если включено хеджирование (0 — p90)
+        self.prompt_text: Optional[str] = None
+        self.timeout_seconds: Optional[int] = None
+        self.cache_ttl_seconds = 0  # 0 — ответы этапа не кэшируются
+        self.max_tokens: Optional[int] = None  # лимит ответа из назначения, None — выученный (OutputTokenLimits)
+        self.fused_with: Tuple[int, ...] = ()  # этапы, выполняемые вместе с этим одним запросом (включая его)
+        self.priority = priorities.NORMAL  # класс приоритета запросов к провайдеру
+        self.error: Optional[str] = None
+
+    def result_key(self) -> str:
+        """
+        Ключ совместимости результата: результат этапа для похожей новости можно
+        переиспользовать, только если этап выполнялся той же моделью с тем же промптом
+        """
+        source = self.kind if self.kind == Stage.KIND_SEARCH else f"{self.model_id}:{self.prompt_text}"
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
 
 
 class PipelineProcessor:
     """
-    Процессор для последовательной обработки новости через выбранные этапы
+    Процессор для обработки новости через выбранные этапы
+    (последовательно или параллельно в пуле потоков)
     """
 
+    # Сколько ещё ждать потоки этапов после истечения deadline, сек
+    DEADLINE_GRACE_SECONDS = 1.0
+
+    # Заголовок раздела в ответе на объединённый запрос: "=== classification ==="
+    FUSED_SECTION_RE = re.compile(r"^[ \t]*===[ \t]*([\w\-]+)[ \t]*===[ \t]*$", re.MULTILINE)
+
     @staticmethod
-    def process_news(user_id: int, news_text: str, stage_ids: List[int]) -> Dict[str, Any]:
+    def process_news(user_id: int, news_text: str, stage_ids: List[int],
+                     concurrent: Optional[bool] = None,
+                     on_stage_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     on_stage_delta: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     deadline: Optional[Deadline] = None,
+                     ready_results: Optional[Dict[int, Dict[str, Any]]] = None,
+                     priority: str = priorities.NORMAL) -> Dict[str, Any]:
         """
         Обработать новость через выбранные этапы
 
         Args:
             user_id: ID пользователя
             news_text: Текст новости
-            stage_ids: Список ID этапов для обработки
+            stage_ids: Список ID этапов для обработки. Этапы, от которых они
+                       зависят (Stage.depends_on), добавляются автоматически
+            concurrent: Запускать этапы параллельно (по умолчанию PIPELINE_CONCURRENT).
+                        Результаты в любом случае возвращаются в порядке Stage.order
+            on_stage_result: Callback, вызываемый с результатом каждого этапа сразу
+                             по его завершении (в вызывающем потоке)
+            on_stage_delta: Callback для потоковой генерации (PIPELINE_STREAMING): получает
+                            {"stage_id", "stage_name", "stage_display_name", "type": "delta" | "reset",
+                            "text"} из рабочих потоков по мере генерации ответа модели
+            deadline: Общий крайний срок обработки (по умолчанию — через PIPELINE_DEADLINE_SECONDS).
+                      Этапы, не уложившиеся в него или в лимит времени своего назначения
+                      (StageAssignment.timeout_seconds), возвращаются с timed_out=True
+            ready_results: Уже готовые результаты этапов для этого текста (упреждающий
+                           прогон, SpeculativeRuns.claim): {stage_id: {"key", "result"}}.
+                           Берутся, только если совпадает PlannedStage.result_key
+            priority: Класс приоритета запросов к провайдерам (interactive, normal, bulk)
 
         Returns:
             Dict с результатами обработки:
@@ -34,48 +120,204 @@ class PipelineProcessor:
                         "success": bool,
                         "content": str,
                         "model_used": str,
-                        "error": str (если есть)
+                        "error": str (если есть),
+                        "error_type": str (класс ошибки провайдера: auth, bad_request,
+                                      rate_limit, overloaded, timeout, network, unavailable,
+                                      too_large...),
+                        "auto_included": bool (этап добавлен как зависимость),
+                        "timed_out": bool (этап не уложился в отведённое время),
+                        "cached": bool (ответ модели взят из кэша),
+                        "fused": bool (этап выполнен одним запросом вместе с другими),
+                        "retries": int (сколько раз запрос повторялся после временных ошибок),
+                        "chunks": int (длинный текст обработан по стольким фрагментам, PIPELINE_CHUNKING),
+                        "input_tokens": int (оценка входных токенов запроса к модели),
+                        "input_limit": int (лимит входа модели, если запрос не отправлен: too_large),
+                        "speculative": bool (этап выполнен заранее, пока вводился текст),
+                        "reused_from": {"fingerprint_id", "similarity"} (результат взят
+                                       у похожей, уже обработанной новости),
+                        "started_at": str (ISO), "duration_ms": int
                     }
                 ],
+                "near_duplicate": {"fingerprint_id", "similarity"} (если переиспользованы
+                                  результаты похожей новости),
                 "error": str (общая ошибка, если есть)
             }
         """
+        # Проверяем что этапы выбраны
+        if not stage_ids:
+            return {"success": False, "results": [], "error": "Не выбраны этапы обработки"}
+
+        # Проверяем что текст новости не пустой
+        if not news_text or not news_text.strip():
+            return {"success": False, "results": [], "error": "Текст новости не может быть пустым"}
+
+        plan, error = PipelineProcessor.build_plan(user_id, stage_ids, priority)
+        if error:
+            return {"success": False, "results": [], "error": error}
+
+        return PipelineProcessor.execute_plan(plan, news_text, concurrent, on_stage_result, on_stage_delta,
+                                              deadline, ready_results)
+
+    @staticmethod
+    def build_plan(user_id: int, stage_ids: List[int],
+                   priority: str = priorities.NORMAL) -> Tuple[Optional[StageGraph], Optional[str]]:
+        """
+        Подготовить план обработки: граф выбранных этапов и их зависимостей,
+        назначенные модели и промпты пользователя
+
+        Настройки берутся из снимка конфигурации (ConfigSnapshot) без запросов к БД;
+        один план можно выполнить для любого числа новостей (см. BatchProcessor).
+
+        Args:
+            user_id: ID пользователя
+            stage_ids: Список ID этапов для обработки
+            priority: Класс приоритета запросов этапов к провайдерам (interactive, normal, bulk)
+
+        Returns:
+            Tuple (StageGraph с узлами PlannedStage, None) или (None, сообщение об ошибке)
+        """
+        if not stage_ids:
+            return None, "Не выбраны этапы обработки"
+
+        snapshot = ConfigSnapshot.get()
+
+        # Активные этапы: выбранные + всё, от чего они зависят
+        available_stages = [PlannedStage(stage) for stage in snapshot.active_stages()]
+
+        try:
+            graph = StageGraph.build(stage_ids, available_stages)
+        except StageGraphError as e:
+            return None, str(e)
+
+        if not graph.selected_ids:
+            return None, "Выбранные этапы не найдены или неактивны"
+
+        # Назначенные модели и промпты пользователя
+        for stage in graph.nodes.values():
+            if stage.kind == Stage.KIND_SEARCH:
+                continue
+
+            assignment = snapshot.stages[stage.id].assignment
+            prompt_text = snapshot.prompt_for(user_id, stage.id)
+            if not assignment:
+                stage.error = f"Для этапа '{stage.display_name}' не назначена модель"
+            elif prompt_text is None:
+                stage.error = f"Системный промпт для этапа {stage.id} не найден"
+            else:
+                stage.model_id = assignment.model_id
+                stage.prompt_text = prompt_text
+                stage.priority = priorities.normalize(priority)
+                stage.timeout_seconds = assignment.timeout_seconds
+                stage.cache_ttl_seconds = (assignment.cache_ttl_seconds
+                                           if assignment.cache_ttl_seconds is not None
+                                           else current_app.config.get("LLM_CACHE_TTL_SECONDS", 0))
+                stage.fallback_chain = assignment.fallback_chain
+                stage.routing_policy = assignment.routing_policy
+                stage.max_tokens = assignment.max_tokens
+                if assignment.hedge_enabled and assignment.fallback_chain:
+                    stage.hedge_after_ms = assignment.hedge_after_ms or 0
+
+        if current_app.config.get("PIPELINE_FUSION", True):
+            PipelineProcessor._plan_fusion(graph, snapshot)
+
+        return graph, None
+
+    @staticmethod
+    def _plan_fusion(graph: StageGraph, snapshot: ConfigSnapshot) -> None:
+        """
+        Объединить этапы с одной группой объединения (StageAssignment.fusion_group)
+        и одной моделью: они выполнятся одним запросом
+
+        Группа не объединяется, если один её этап зависит от другого. Этапы
+        с хеджированием выполняются отдельно.
+        """
+        groups: Dict[Tuple, List[PlannedStage]] = {}
+        for stage in graph.nodes.values():
+            if stage.kind == Stage.KIND_SEARCH or stage.error or stage.hedge_after_ms is not None:
+                continue
+            fusion_group = snapshot.stages[stage.id].assignment.fusion_group
+            if fusion_group:
+                key = (fusion_group, stage.model_id, stage.fallback_chain, stage.routing_policy)
+                groups.setdefault(key, []).append(stage)
+
+        for members in groups.values():
+            member_ids = {stage.id for stage in members}
+            if len(members) < 2 or any(graph.ancestors(stage.id) & member_ids for stage in members):
+                continue
+            fused_with = tuple(stage.id for stage in sorted(members, key=lambda s: (s.order, s.id)))
+            for stage in members:
+                stage.fused_with = fused_with
+
+    @staticmethod
+    def execute_plan(plan: StageGraph, news_text: str,
+                     concurrent: Optional[bool] = None,
+                     on_stage_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     on_stage_delta: Optional[Callable[[Dict[str, Any]], None]] = None,
+                     deadline: Optional[Deadline] = None,
+                     ready_results: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Выполнить подготовленный план для одной новости
+
+        Args:
+            plan: Результат build_plan
+            news_text: Текст новости
+            concurrent, on_stage_result, on_stage_delta, deadline, ready_results: см. process_news
+
+        Returns:
+            Dict с результатами обработки (формат process_news)
+        """
         results = {
             "success": True,
             "results": [],
             "error": None
         }
 
-        # Проверяем что этапы выбраны
-        if not stage_ids:
-            results["success"] = False
-            results["error"] = "Не выбраны этапы обработки"
-            return results
-
-        # Проверяем что текст новости не пустой
         if not news_text or not news_text.strip():
             results["success"] = False
             results["error"] = "Текст новости не может быть пустым"
             return results
 
-        # Загружаем этапы из БД в правильном порядке
-        stages = Stage.query.filter(
-            Stage.id.in_(stage_ids),
-            Stage.is_active == True
-        ).order_by(Stage.order).all()
+        if concurrent is None:
+            concurrent = current_app.config.get("PIPELINE_CONCURRENT", True)
 
-        if not stages:
-            results["success"] = False
-            results["error"] = "Выбранные этапы не найдены или неактивны"
-            return results
+        if not current_app.config.get("PIPELINE_STREAMING", True):
+            on_stage_delta = None
 
-        # Обрабатываем каждый этап последовательно
-        for stage in stages:
-            stage_result = PipelineProcessor._process_stage(
-                user_id=user_id,
-                stage=stage,
-                news_text=news_text
-            )
+        if deadline is None:
+            deadline = Deadline.after(current_app.config.get("PIPELINE_DEADLINE_SECONDS", 0))
+
+        # Результаты похожей новости, уже прошедшей конвейер (NEAR_DUPLICATE_*)
+        signature = None
+        reused: Dict[int, Dict[str, Any]] = {}
+        if current_app.config.get("NEAR_DUPLICATE_ENABLED", False):
+            signature = NearDuplicateIndex.signature(news_text)
+            if signature is not None:
+                reused = PipelineProcessor._find_reusable_results(plan, signature)
+                if reused:
+                    results["near_duplicate"] = next(iter(reused.values()))["reused_from"]
+
+        if ready_results:
+            PipelineProcessor._attach_ready_results(plan, ready_results, reused)
+
+        def notify(stage_id: int, stage_result: Dict[str, Any]):
+            if stage_id not in plan.selected_ids:
+                stage_result["auto_included"] = True
+            if on_stage_result:
+                on_stage_result(stage_result)
+
+        if concurrent and len(plan.nodes) - len(reused) > 1:
+            stage_results = PipelineProcessor._execute_graph_concurrently(plan, news_text, notify,
+                                                                          on_stage_delta, deadline, reused)
+        else:
+            stage_results = PipelineProcessor._execute_graph_sequentially(plan, news_text, notify,
+                                                                          on_stage_delta, deadline, reused)
+
+        if signature is not None:
+            PipelineProcessor._remember_results(plan, signature, stage_results, reused)
+
+        # Результаты возвращаем в порядке Stage.order
+        for stage_id in plan.display_order():
+            stage_result = stage_results[stage_id]
             results["results"].append(stage_result)
 
             # Если этап завершился с ошибкой, помечаем общий результат как неуспешный
@@ -85,19 +327,514 @@ class PipelineProcessor:
         return results
 
     @staticmethod
-    def _process_stage(user_id: int, stage: Stage, news_text: str) -> Dict[str, Any]:
+    def _execute_graph_sequentially(graph: StageGraph, news_text: str,
+                                    notify: Callable[[int, Dict[str, Any]], None],
+                                    on_stage_delta: Optional[Callable] = None,
+                                    deadline: Optional[Deadline] = None,
+                                    reused: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[int, Dict[str, Any]]:
         """
-        Обработать один этап
+        Выполнить граф этапов последовательно в топологическом порядке
+        (этапы из reused не выполняются — берутся готовые результаты)
 
-        Args:
-            user_id: ID пользователя
-            stage: Объект Stage из БД
-            news_text: Текст новости
+        Returns:
+            Dict {stage_id: результат этапа}
+        """
+        reused = reused or {}
+        stage_results = {}
+        order = graph.topological_order()
+        position = {stage_id: index for index, stage_id in enumerate(order)}
+
+        for stage_id in order:
+            stage = graph.nodes[stage_id]
+
+            group = PipelineProcessor._fusion_members(stage, reused)
+            if group:
+                # Объединённые этапы выполняются вместе, когда подходит очередь последнего из них
+                if stage_id != max(group, key=position.get):
+                    continue
+                for member_id, member_result in PipelineProcessor._run_group(
+                        graph, group, stage_results, news_text, on_stage_delta, deadline).items():
+                    stage_results[member_id] = member_result
+                    notify(member_id, member_result)
+                continue
+
+            stage_result = reused.get(stage_id) or PipelineProcessor._blocked_result(graph, stage, stage_results)
+            if not stage_result:
+                dependency_results = [stage_results[dep_id] for dep_id in graph.dependencies[stage_id]]
+                stage_result = PipelineProcessor._run_node(stage, news_text, dependency_results,
+                                                           on_stage_delta, deadline)
+
+            stage_results[stage_id] = stage_result
+            notify(stage_id, stage_result)
+
+        return stage_results
+
+    @staticmethod
+    def _execute_graph_concurrently(graph: StageGraph, news_text: str,
+                                    notify: Callable[[int, Dict[str, Any]], None],
+                                    on_stage_delta: Optional[Callable] = None,
+                                    deadline: Optional[Deadline] = None,
+                                    reused: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Выполнить граф этапов в ограниченном пуле потоков
+        (этапы из reused не выполняются — берутся готовые результаты)
+
+        Каждый этап стартует, как только готовы результаты всех его зависимостей
+        (объединённые этапы — когда готовы зависимости всех этапов группы),
+        поэтому независимые этапы и цепочки (например, freshness_check → поиск →
+        freshness_analysis) выполняются параллельно. Каждый поток работает в
+        собственном app context, а значит и в собственной сессии SQLAlchemy
+        (сессия Flask-SQLAlchemy привязана к контексту приложения).
+
+        Если этапы не завершились за DEADLINE_GRACE_SECONDS после deadline, они
+        считаются timed_out, и ответ возвращается, не дожидаясь их потоков.
 
         Returns:
-            Dict с результатом обработки этапа
+            Dict {stage_id: результат этапа}
+        """
+        app = current_app._get_current_object()
+        max_workers = max(1, min(len(graph.nodes), app.config.get("PIPELINE_MAX_WORKERS", 5)))
+
+        stage_results: Dict[int, Dict[str, Any]] = {}
+        waiting_for = {stage_id: set(deps) for stage_id, deps in graph.dependencies.items()}
+        # Future -> ID этапа или кортеж ID объединённых этапов (тогда результат — {stage_id: результат})
+        running: Dict[Future, Any] = {}
+        ready_for_fusion = set()
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+
+        reused = reused or {}
+
+        def schedule(stage_id: int):
+            if stage_id in reused:
+                complete(stage_id, reused[stage_id])
+                return
+
+            stage = graph.nodes[stage_id]
+            group = PipelineProcessor._fusion_members(stage, reused)
+            if group:
+                ready_for_fusion.add(stage_id)
+                if ready_for_fusion.issuperset(group):
+                    schedule_group(group)
+                return
+
+            blocked = PipelineProcessor._blocked_result(graph, stage, stage_results)
+            if blocked:
+                complete(stage_id, blocked)
+                return
+
+            submit(stage_id)
+
+        def schedule_group(group: List[int]):
+            blocked, runnable = PipelineProcessor._split_group(graph, group, stage_results)
+            if len(runnable) > 1:
+                dependency_results = {stage_id: [stage_results[dep_id] for dep_id in graph.dependencies[stage_id]]
+                                      for stage_id in runnable}
+                future = executor.submit(PipelineProcessor._run_fused_in_context,
+                                         app, [graph.nodes[stage_id] for stage_id in runnable], news_text,
+                                         dependency_results, on_stage_delta, deadline)
+                running[future] = tuple(runnable)
+            elif runnable:
+                submit(runnable[0])
+            for stage_id, blocked_result in blocked.items():
+                complete(stage_id, blocked_result)
+
+        def submit(stage_id: int):
+            dependency_results = [stage_results[dep_id] for dep_id in graph.dependencies[stage_id]]
+            future = executor.submit(PipelineProcessor._run_node_in_context,
+                                     app, graph.nodes[stage_id], news_text, dependency_results,
+                                     on_stage_delta, deadline)
+            running[future] = stage_id
+
+        def complete(stage_id: int, stage_result: Dict[str, Any]):
+            stage_results[stage_id] = stage_result
+            notify(stage_id, stage_result)
+            for dependent_id in graph.dependents[stage_id]:
+                waiting_for[dependent_id].discard(stage_id)
+                if not waiting_for[dependent_id]:
+                    schedule(dependent_id)
+
+        try:
+            for stage_id in graph.topological_order():
+                if not graph.dependencies[stage_id]:
+                    schedule(stage_id)
+
+            while running:
+                timeout = deadline.remaining() + PipelineProcessor.DEADLINE_GRACE_SECONDS if deadline else None
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    # Потоки зависли дольше deadline — не ждём их
+                    for future, key in list(running.items()):
+                        running.pop(future)
+                        future.cancel()
+                        for stage_id in (key if isinstance(key, tuple) else (key,)):
+                            complete(stage_id, PipelineProcessor._timed_out_result(graph.nodes[stage_id]))
+                    break
+
+                for future in done:
+                    key = running.pop(future)
+                    if isinstance(key, tuple):
+                        for stage_id, stage_result in future.result().items():
+                            complete(stage_id, stage_result)
+                    else:
+                        complete(key, future.result())
+        finally:
+            executor.shutdown(wait=False)
+
+        return stage_results
+
+    @staticmethod
+    def _fusion_members(stage: PlannedStage, reused: Dict[int, Dict[str, Any]]) -> List[int]:
+        """ID этапов, выполняемых одним запросом вместе с этим (пусто, если объединять нечего)"""
+        members = [stage_id for stage_id in stage.fused_with if stage_id not in reused]
+        return members if len(members) > 1 else []
+
+    @staticmethod
+    def _split_group(graph: StageGraph, group: List[int],
+                     stage_results: Dict[int, Dict[str, Any]]) -> Tuple[Dict[int, Dict[str, Any]], List[int]]:
+        """
+        Разделить объединённые этапы на заблокированные (зависимости не выполнены)
+        и готовые к запуску
+
+        Returns:
+            Tuple ({stage_id: результат-ошибка}, [ID этапов для запуска])
+        """
+        blocked = {}
+        runnable = []
+        for stage_id in group:
+            blocked_result = PipelineProcessor._blocked_result(graph, graph.nodes[stage_id], stage_results)
+            if blocked_result:
+                blocked[stage_id] = blocked_result
+            else:
+                runnable.append(stage_id)
+        return blocked, runnable
+
+    @staticmethod
+    def _run_group(graph: StageGraph, group: List[int], stage_results: Dict[int, Dict[str, Any]],
+                   news_text: str, on_stage_delta: Optional[Callable] = None,
+                   deadline: Optional[Deadline] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Выполнить объединённые этапы в текущем потоке
+
+        Returns:
+            Dict {stage_id: результат этапа} в порядке группы
+        """
+        blocked, runnable = PipelineProcessor._split_group(graph, group, stage_results)
+        dependency_results = {stage_id: [stage_results[dep_id] for dep_id in graph.dependencies[stage_id]]
+                              for stage_id in runnable}
+
+        if len(runnable) > 1:
+            group_results = PipelineProcessor._run_fused([graph.nodes[stage_id] for stage_id in runnable],
+                                                         news_text, dependency_results, on_stage_delta, deadline)
+        else:
+            group_results = {stage_id: PipelineProcessor._run_node(graph.nodes[stage_id], news_text,
+                                                                   dependency_results[stage_id],
+                                                                   on_stage_delta, deadline)
+                             for stage_id in runnable}
+
+        group_results.update(blocked)
+        return {stage_id: group_results[stage_id] for stage_id in group}
+
+    @staticmethod
+    def _find_reusable_results(plan: StageGraph, signature) -> Dict[int, Dict[str, Any]]:
+        """
+        Найти похожую обработанную новость и взять её результаты этапов
+        из NEAR_DUPLICATE_STAGES
+
+        Результат переиспользуется, только если этап выполнялся той же моделью с
+        тем же промптом (PlannedStage.result_key) и все его зависимости тоже
+        переиспользованы — иначе он мог бы опираться на другие входные данные.
+
+        Returns:
+            Dict {stage_id: готовый результат этапа}
+        """
+        config = current_app.config
+        match = NearDuplicateIndex.lookup(signature, config.get("NEAR_DUPLICATE_THRESHOLD", 0.8),
+                                          config.get("NEAR_DUPLICATE_MAX_AGE_HOURS", 0))
+        if not match:
+            return {}
+
+        fingerprint, similarity = match
+        saved_results = fingerprint.get_results()
+        reusable = PipelineProcessor._reusable_stage_names()
+        reused_from = {"fingerprint_id": fingerprint.id, "similarity": round(similarity, 3)}
+
+        reused = {}
+        for stage_id in plan.topological_order():
+            stage = plan.nodes[stage_id]
+            saved = saved_results.get(stage.name)
+            if (stage.name not in reusable or not saved or saved.get("key") != stage.result_key()
+                    or stage.id in plan.missing
+                    or any(dep_id not in reused for dep_id in plan.dependencies[stage_id])):
+                continue
+
+            result = PipelineProcessor._empty_result(stage)
+            result["success"] = True
+            result["content"] = saved["content"]
+            result["model_used"] = saved.get("model_used")
+            result["reused_from"] = reused_from
+            result["started_at"] = datetime.utcnow().isoformat()
+            result["duration_ms"] = 0
+            reused[stage_id] = result
+
+        return reused
+
+    @staticmethod
+    def _attach_ready_results(plan: StageGraph, ready_results: Dict[int, Dict[str, Any]],
+                              reused: Dict[int, Dict[str, Any]]) -> None:
+        """
+        Добавить в reused готовые результаты этапов этого же текста (упреждающий прогон)
+
+        Как и для похожих новостей, результат берётся, только если этап выполнялся
+        той же моделью с тем же промптом и все его зависимости тоже уже готовы.
+        """
+        for stage_id in plan.topological_order():
+            entry = ready_results.get(stage_id)
+            if (not entry or entry["key"] != plan.nodes[stage_id].result_key()
+                    or any(dep_id not in reused for dep_id in plan.dependencies[stage_id])):
+                continue
+
+            result = dict(entry["result"])
+            result.pop("auto_included", None)
+            reused[stage_id] = result
+
+    @staticmethod
+    def _remember_results(plan: StageGraph, signature, stage_results: Dict[int, Dict[str, Any]],
+                          reused: Dict[int, Dict[str, Any]]) -> None:
+        """
+        Сохранить отпечаток новости с успешными результатами этапов из
+        NEAR_DUPLICATE_STAGES (если хотя бы один из них выполнялся заново)
+        """
+        reusable = PipelineProcessor._reusable_stage_names()
+        saved = {}
+        for stage_id, stage_result in stage_results.items():
+            stage = plan.nodes[stage_id]
+            if stage.name in reusable and stage_result["success"]:
+                saved[stage.name] = {
+                    "key": stage.result_key(),
+                    "content": stage_result["content"],
+                    "model_used": stage_result["model_used"]
+                }
+
+        if any(plan.nodes[stage_id].name in saved for stage_id in stage_results if stage_id not in reused):
+            NearDuplicateIndex.remember(signature, saved)
+
+    @staticmethod
+    def _reusable_stage_names() -> set:
+        """Этапы, результаты которых можно брать у похожей новости (NEAR_DUPLICATE_STAGES)"""
+        names = current_app.config.get("NEAR_DUPLICATE_STAGES", "")
+        return {name.strip() for name in names.split(",") if name.strip()}
+
+    @staticmethod
+    def _blocked_result(graph: StageGraph, stage: PlannedStage,
+                        stage_results: Dict[int, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Проверить, можно ли запускать этап: все зависимости доступны и успешны
+
+        Returns:
+            Dict с результатом-ошибкой, если этап запускать нельзя, иначе None
+        """
+        error = None
+        if stage.id in graph.missing:
+            error = f"Недоступны этапы, от которых зависит этот этап: {', '.join(graph.missing[stage.id])}"
+        else:
+            failed = [stage_results[dep_id]["stage_display_name"]
+                      for dep_id in graph.dependencies[stage.id]
+                      if not stage_results[dep_id]["success"]]
+            if failed:
+                error = f"Не выполнены этапы, от которых зависит этот этап: {', '.join(failed)}"
+
+        if not error:
+            return None
+
+        result = PipelineProcessor._empty_result(stage)
+        result["error"] = error
+        return result
+
+    @staticmethod
+    def _run_node_in_context(app, stage: PlannedStage, news_text: str,
+                             dependency_results: List[Dict[str, Any]],
+                             on_stage_delta: Optional[Callable] = None,
+                             deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Выполнить этап в отдельном потоке с собственным app context
+        (запросы к моделям и провайдерам идут через сессию этого потока)
+        """
+        with app.app_context():
+            return PipelineProcessor._run_node(stage, news_text, dependency_results, on_stage_delta, deadline)
+
+    @staticmethod
+    def _run_node(stage: PlannedStage, news_text: str,
+                  dependency_results: List[Dict[str, Any]],
+                  on_stage_delta: Optional[Callable] = None,
+                  deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Выполнить узел графа в зависимости от типа этапа и замерить время
+
+        Срок этапа — более ранний из общего deadline и лимита времени этапа
+        (отсчитывается от его старта).
+        """
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+
+        if deadline and deadline.expired:
+            result = PipelineProcessor._timed_out_result(stage)
+        else:
+            stage_deadline = Deadline.earliest(deadline, stage.timeout_seconds)
+            if stage.kind == Stage.KIND_SEARCH:
+                result = PipelineProcessor._process_search_stage(stage, dependency_results, stage_deadline)
+            else:
+                result = PipelineProcessor._process_stage(stage, news_text, dependency_results,
+                                                          on_stage_delta, stage_deadline)
+
+        result["started_at"] = started_at.isoformat()
+        result["duration_ms"] = int((time.monotonic() - started) * 1000)
+        return result
+
+    @staticmethod
+    def _run_fused_in_context(app, stages: List[PlannedStage], news_text: str,
+                              dependency_results: Dict[int, List[Dict[str, Any]]],
+                              on_stage_delta: Optional[Callable] = None,
+                              deadline: Optional[Deadline] = None) -> Dict[int, Dict[str, Any]]:
+        """Выполнить объединённые этапы в отдельном потоке с собственным app context"""
+        with app.app_context():
+            return PipelineProcessor._run_fused(stages, news_text, dependency_results, on_stage_delta, deadline)
+
+    @staticmethod
+    def _run_fused(stages: List[PlannedStage], news_text: str,
+                   dependency_results: Dict[int, List[Dict[str, Any]]],
+                   on_stage_delta: Optional[Callable] = None,
+                   deadline: Optional[Deadline] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Выполнить несколько этапов с одной моделью одним запросом: инструкции
+        этапов — разделами системного промпта, ответ — разделами "=== имя этапа ==="
+
+        Если ответ не удалось разделить на все этапы (или запрос завершился
+        ошибкой), этапы выполняются обычными отдельными запросами. Ответ
+        объединённого запроса приходит целиком, без потоковых фрагментов.
+
+        Returns:
+            Dict {stage_id: результат этапа} (формат _process_stage)
+        """
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+
+        if deadline and deadline.expired:
+            return {stage.id: PipelineProcessor._timed_out_result(stage) for stage in stages}
+
+        if len(PipelineProcessor._split_news(news_text)) > 1:
+            # Длинный текст обрабатывается по фрагментам — каждым этапом отдельно
+            return {stage.id: PipelineProcessor._run_node(stage, news_text, dependency_results[stage.id],
+                                                          on_stage_delta, deadline)
+                    for stage in stages}
+
+        timeouts = [stage.timeout_seconds for stage in stages if stage.timeout_seconds]
+        fused_deadline = Deadline.earliest(deadline, min(timeouts) if timeouts else None)
+
+        candidates = route_models((stages[0].model_id, *stages[0].fallback_chain), stages[0].routing_policy)
+        model = ConfigSnapshot.get().models.get(candidates[0])
+        model_max_tokens = model.default_params.get("max_tokens") if model else None
+        # Лимит ответа — сумма лимитов этапов: заданных в назначении или параметрах модели,
+        # иначе выученных для отдельных запросов
+        max_tokens = sum(stage.max_tokens or model_max_tokens or OutputTokenLimits.limit(stage.id, candidates[0])
+                         or DEFAULT_MAX_TOKENS for stage in stages)
+
+        try:
+            ai_result = send_ai_request(
+                model_id=candidates[0],
+                messages=PipelineProcessor._build_fused_messages(stages, news_text, dependency_results),
+                use_fallback=True,
+                fallback_chain=candidates[1:],
+                deadline=fused_deadline,
+                cache_ttl=min(stage.cache_ttl_seconds for stage in stages),
+                priority=stages[0].priority,
+                max_tokens=max_tokens
+            )
+        except Exception as e:
+            ai_result = {"success": False, "error": f"Ошибка обработки: {str(e)}"}
+
+        sections = None
+        if ai_result["success"]:
+            sections = PipelineProcessor._split_fused_answer(ai_result["content"], [stage.name for stage in stages])
+        elif ai_result.get("timed_out"):
+            return {stage.id: PipelineProcessor._timed_out_result(stage) for stage in stages}
+
+        if sections is None:
+            # Не удалось разделить ответ — отдельные запросы на остаток времени
+            return {stage.id: PipelineProcessor._run_node(stage, news_text, dependency_results[stage.id],
+                                                          on_stage_delta, deadline)
+                    for stage in stages}
+
+        results = {}
+        for stage in stages:
+            result = PipelineProcessor._empty_result(stage)
+            result["success"] = True
+            result["content"] = sections[stage.name]
+            result["model_used"] = ai_result.get("model", "Unknown")
+            result["fused"] = True
+            if ai_result.get("fallback_used"):
+                result["fallback_used"] = True
+                result["original_error"] = ai_result.get("original_error")
+            if ai_result.get("cached"):
+                result["cached"] = True
+            if ai_result.get("retries"):
+                result["retries"] = ai_result["retries"]
+            if ai_result.get("input_tokens"):
+                result["input_tokens"] = ai_result["input_tokens"]
+            result["started_at"] = started_at.isoformat()
+            result["duration_ms"] = int((time.monotonic() - started) * 1000)
+            results[stage.id] = result
+        return results
+
+    @staticmethod
+    def _build_fused_messages(stages: List[PlannedStage], news_text: str,
+                              dependency_results: Dict[int, List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+        """Сообщения объединённого запроса: инструкции всех этапов и общий текст новости"""
+        layout = "\n".join(f"=== {stage.name} ===\n<ответ на задачу {stage.name}>" for stage in stages)
+        tasks = "\n\n".join(f"### Задача {stage.name} ({stage.display_name})\n{stage.prompt_text}"
+                             for stage in stages)
+        system_prompt = (
+            "Выполни несколько независимых задач по одной новости. Инструкции каждой задачи "
+            "приведены в её разделе ниже, они же задают формат ответа на задачу.\n"
+            "Оформи ответ разделами строго в таком виде, без текста вне разделов:\n"
+            f"{layout}\n\n{tasks}"
+        )
+
+        # Результаты зависимостей всех этапов группы, без повторов
+        shared_results = {}
+        for stage in stages:
+            for dep_result in dependency_results[stage.id]:
+                shared_results.setdefault(dep_result["stage_id"], dep_result)
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": PipelineProcessor._build_user_message(news_text,
+                                                                              list(shared_results.values()))}
+        ]
+
+    @staticmethod
+    def _split_fused_answer(content: Optional[str], names: List[str]) -> Optional[Dict[str, str]]:
         """
-        result = {
+        Разделить ответ объединённого запроса по разделам "=== имя этапа ==="
+
+        Returns:
+            {имя этапа: текст раздела} или None, если хотя бы одного раздела нет или он пуст
+        """
+        content = content or ""
+        matches = list(PipelineProcessor.FUSED_SECTION_RE.finditer(content))
+        sections = {}
+        for index, match in enumerate(matches):
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(content)
+            sections.setdefault(match.group(1), content[match.end():end].strip())
+
+        if any(not sections.get(name) for name in names):
+            return None
+        return {name: sections[name] for name in names}
+
+    @staticmethod
+    def _empty_result(stage: PlannedStage) -> Dict[str, Any]:
+        """Заготовка результата этапа"""
+        return {
             "stage_id": stage.id,
             "stage_name": stage.name,
             "stage_display_name": stage.display_name,
@@ -107,32 +844,106 @@ class PipelineProcessor:
             "error": None
         }
 
-        try:
-            # Получаем активное назначение модели для этапа
-            assignment = StageAssignment.query.filter_by(
-                stage_id=stage.id,
-                is_active=True
-            ).order_by(StageAssignment.priority.desc()).first()
+    @staticmethod
+    def _timed_out_result(stage: PlannedStage) -> Dict[str, Any]:
+        """Результат этапа, не уложившегося в отведённое время"""
+        result = PipelineProcessor._empty_result(stage)
+        result["error"] = "Превышено время выполнения этапа"
+        result["timed_out"] = True
+        return result
 
-            if not assignment:
-                result["error"] = f"Для этапа '{stage.display_name}' не назначена модель"
-                return result
+    @staticmethod
+    def _build_user_message(news_text: str, dependency_results: Optional[List[Dict[str, Any]]]) -> str:
+        """
+        Сформировать пользовательское сообщение: текст новости и результаты
+        этапов-зависимостей
+        """
+        if not dependency_results:
+            return news_text
 
-            # Получаем промпт для пользователя
-            prompt_text = PromptManager.get_prompt_for_processing(user_id, stage.id)
+        parts = [f"Текст новости:\n{news_text}"]
+        for dep_result in dependency_results:
+            parts.append(f"Результаты этапа «{dep_result['stage_display_name']}»:\n{dep_result['content']}")
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _process_stage(stage: PlannedStage, news_text: str,
+                       dependency_results: Optional[List[Dict[str, Any]]] = None,
+                       on_stage_delta: Optional[Callable[[Dict[str, Any]], None]] = None,
+                       deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Обработать один этап
+
+        Args:
+            stage: Этап из плана (с назначенной моделью и промптом)
+            news_text: Текст новости
+            dependency_results: Результаты этапов, от которых зависит этап
+            on_stage_delta: Callback для фрагментов ответа (включает потоковую генерацию)
+            deadline: Крайний срок этапа (основная модель и fallback вместе)
+
+        Returns:
+            Dict с результатом обработки этапа
+        """
+        result = PipelineProcessor._empty_result(stage)
+
+        if stage.error:
+            result["error"] = stage.error
+            return result
+
+        stage_info = {
+            "stage_id": stage.id,
+            "stage_name": stage.name,
+            "stage_display_name": stage.display_name
+        }
+        on_delta = (lambda event: on_stage_delta({**stage_info, **event})) if on_stage_delta else None
+
+        try:
+            # Лимит ответа из назначения; без него send_ai_request подберёт его для каждой модели сам
+            params = {"max_tokens": stage.max_tokens} if stage.max_tokens else {}
+
+            # Основная и резервные модели в порядке попыток (по политике назначения)
+            candidates = route_models((stage.model_id, *stage.fallback_chain), stage.routing_policy)
 
             # Формируем сообщения для AI
             messages = [
-                {"role": "system", "content": prompt_text},
-                {"role": "user", "content": news_text}
+                {"role": "system", "content": stage.prompt_text},
+                {"role": "user", "content": PipelineProcessor._build_user_message(news_text, dependency_results)}
             ]
 
-            # Отправляем запрос к AI (с поддержкой fallback)
-            ai_result = send_ai_request(
-                model_id=assignment.model_id,
-                messages=messages,
-                use_fallback=True
-            )
+            chunks = PipelineProcessor._split_news(news_text)
+            if len(chunks) > 1:
+                # Длинный текст: этап по фрагментам параллельно, затем объединение ответов
+                ai_result = PipelineProcessor._map_reduce(stage, chunks, candidates, dependency_results,
+                                                          on_delta, deadline, params)
+            elif stage.hedge_after_ms is not None and len(candidates) > 1:
+                # Хеджирование: вторая модель стартует параллельно, если первая медлит
+                ai_result = send_hedged_request(
+                    model_id=candidates[0],
+                    fallback_model_id=candidates[1],
+                    fallback_chain=candidates[2:],
+                    messages=messages,
+                    hedge_after=stage.hedge_after_ms / 1000 if stage.hedge_after_ms else None,
+                    on_delta=on_delta,
+                    deadline=deadline,
+                    stage_id=stage.id,
+                    cache_ttl=stage.cache_ttl_seconds,
+                    priority=stage.priority,
+                    **params
+                )
+            else:
+                # Отправляем запрос к AI (с поддержкой fallback)
+                ai_result = send_ai_request(
+                    model_id=candidates[0],
+                    messages=messages,
+                    use_fallback=True,
+                    fallback_chain=candidates[1:],
+                    on_delta=on_delta,
+                    deadline=deadline,
+                    stage_id=stage.id,
+                    cache_ttl=stage.cache_ttl_seconds,
+                    priority=stage.priority,
+                    **params
+                )
 
             if ai_result["success"]:
                 result["success"] = True
@@ -143,18 +954,243 @@ class PipelineProcessor:
                 if ai_result.get("fallback_used"):
                     result["fallback_used"] = True
                     result["original_error"] = ai_result.get("original_error")
+                if ai_result.get("hedged"):
+                    result["hedged"] = True
+                if ai_result.get("cached"):
+                    result["cached"] = True
+                if ai_result.get("chunks"):
+                    result["chunks"] = ai_result["chunks"]
+            elif ai_result.get("timed_out"):
+                return PipelineProcessor._timed_out_result(stage)
             else:
                 result["error"] = ai_result.get("error", "Неизвестная ошибка AI")
+                if ai_result.get("error_type"):
+                    result["error_type"] = ai_result["error_type"]
+
+            if ai_result.get("retries"):
+                result["retries"] = ai_result["retries"]
+            for key in ("input_tokens", "input_limit"):
+                if ai_result.get(key) is not None:
+                    result[key] = ai_result[key]
 
         except Exception as e:
             result["error"] = f"Ошибка обработки: {str(e)}"
 
         return result
 
+    @staticmethod
+    def _split_news(news_text: str) -> List[str]:
+        """
+        Фрагменты текста новости для обработки по частям (PIPELINE_CHUNKING)
+
+        Текст не длиннее PIPELINE_CHUNK_TOKENS — один фрагмент. Фрагменты
+        укрупняются, если иначе их было бы больше PIPELINE_CHUNK_MAX_CHUNKS.
+        """
+        config = current_app.config
+        chunk_tokens = config.get("PIPELINE_CHUNK_TOKENS", 3000)
+        if not config.get("PIPELINE_CHUNKING", True):
+            return [news_text]
+
+        total_tokens = TokenBudget.estimate(news_text)
+        if total_tokens <= chunk_tokens:
+            return [news_text]
+        chunk_tokens = max(chunk_tokens, math.ceil(total_tokens / config.get("PIPELINE_CHUNK_MAX_CHUNKS", 16)))
+        return split_text(news_text, chunk_tokens, config.get("PIPELINE_CHUNK_OVERLAP_TOKENS", 200))
+
+    @staticmethod
+    def _map_reduce(stage: PlannedStage, chunks: List[str], candidates: List[int],
+                    dependency_results: Optional[List[Dict[str, Any]]],
+                    on_delta: Optional[Callable[[Dict[str, Any]], None]],
+                    deadline: Optional[Deadline], params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполнить этап над длинным текстом по частям
+
+        Map: запрос этапа к каждому фрагменту, параллельно (не больше
+        PIPELINE_CHUNK_WORKERS одновременно; лимиты провайдера соблюдает
+        send_ai_request). Reduce: ещё один запрос объединяет ответы по
+        фрагментам в ответ на весь текст — только он отдаётся потоком в on_delta.
+        Время этапа определяется размером фрагмента, а не всего текста.
+
+        Returns:
+            Результат reduce-запроса в формате send_ai_request с полем chunks
+            или результат первого невыполненного фрагмента
+        """
+        app = current_app._get_current_object()
+        map_deadline = Deadline.child(deadline)
+
+        def run_chunk(index: int) -> Dict[str, Any]:
+            with app.app_context():
+                return send_ai_request(
+                    model_id=candidates[0],
+                    messages=PipelineProcessor._build_chunk_messages(stage, chunks, index, dependency_results),
+                    use_fallback=True,
+                    fallback_chain=candidates[1:],
+                    deadline=map_deadline,
+                    stage_id=stage.id,
+                    cache_ttl=stage.cache_ttl_seconds,
+                    priority=stage.priority,
+                    # Ответ по фрагменту короче ответа на весь текст: не учитываем его в выученном
+                    # лимите этапа и не ограничиваем им запрос (действует лимит назначения или модели)
+                    output_learning=False,
+                    **params
+                )
+
+        partials: List[Optional[Dict[str, Any]]] = [None] * len(chunks)
+        workers = max(1, min(len(chunks), current_app.config.get("PIPELINE_CHUNK_WORKERS", 4)))
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk")
+        try:
+            futures = {executor.submit(run_chunk, index): index for index in range(len(chunks))}
+            for future in as_completed(futures):
+                index = futures[future]
+                partial = future.result()
+                if not partial["success"]:
+                    # Без ответа по одному фрагменту весь текст не обработать — остальные отменяем
+                    map_deadline.cancel()
+                    return {**partial, "error": f"Фрагмент {index + 1} из {len(chunks)}: {partial.get('error')}"}
+                partials[index] = partial
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        result = send_ai_request(
+            model_id=candidates[0],
+            messages=PipelineProcessor._build_reduce_messages(stage, partials),
+            use_fallback=True,
+            fallback_chain=candidates[1:],
+            on_delta=on_delta,
+            deadline=deadline,
+            stage_id=stage.id,
+            cache_ttl=stage.cache_ttl_seconds,
+            priority=stage.priority,
+            **params
+        )
+        result["chunks"] = len(chunks)
+        retries = result.get("retries", 0) + sum(partial.get("retries", 0) for partial in partials)
+        if retries:
+            result["retries"] = retries
+        if result.get("cached") and not all(partial.get("cached") for partial in partials):
+            result["cached"] = False
+        return result
+
+    @staticmethod
+    def _build_chunk_messages(stage: PlannedStage, chunks: List[str], index: int,
+                              dependency_results: Optional[List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+        """Сообщения map-запроса: инструкция этапа для одного фрагмента текста"""
+        system_prompt = (
+            f"Текст новости длинный и разбит на {len(chunks)} фрагментов (соседние фрагменты немного "
+            "перекрываются). Выполни задачу только по переданному фрагменту: ответы по всем фрагментам "
+            "потом будут объединены в ответ на весь текст.\n\n"
+            f"{stage.prompt_text}"
+        )
+        chunk_text = f"Фрагмент {index + 1} из {len(chunks)}:\n{chunks[index]}"
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": PipelineProcessor._build_user_message(chunk_text, dependency_results)}
+        ]
+
+    @staticmethod
+    def _build_reduce_messages(stage: PlannedStage, partials: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Сообщения reduce-запроса: инструкция этапа и ответы по фрагментам по порядку"""
+        system_prompt = (
+            f"{stage.prompt_text}\n\n"
+            "Текст новости был разбит на фрагменты, и задача выполнена по каждому из них. Ниже — ответы "
+            "по фрагментам по порядку. Объедини их в один ответ на задачу для всего текста: убери повторы "
+            "из перекрывающихся фрагментов, согласуй противоречия и соблюдай формат ответа из инструкции."
+        )
+        answers = "\n\n".join(f"### Фрагмент {index + 1}\n{partial['content']}"
+                               for index, partial in enumerate(partials))
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": answers}
+        ]
+
+    @staticmethod
+    def _process_search_stage(stage: PlannedStage, dependency_results: List[Dict[str, Any]],
+                              deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Выполнить шаг поиска: взять поисковый запрос из результата этапа-зависимости
+        (freshness_check) и найти похожие публикации через поисковый провайдер
+
+        Args:
+            stage: Этап из плана (kind="search")
+            dependency_results: Результаты этапов, от которых зависит шаг
+            deadline: Крайний срок шага
+
+        Returns:
+            Dict с результатом в формате этапа; content — JSON
+            {"search_query": str, "results": [...], "total": int}
+        """
+        result = PipelineProcessor._empty_result(stage)
+        result["model_used"] = "Brave Search"
+
+        try:
+            if not current_app.config.get("BRAVE_SEARCH_ENABLED"):
+                result["error"] = "Поиск Brave Search отключён в настройках"
+                return result
+
+            query = None
+            for dep_result in dependency_results:
+                query = PipelineProcessor._extract_search_query(dep_result.get("content") or "")
+                if query:
+                    break
+
+            if not query:
+                # Без запроса не ищем: поиск по всему ответу модели нашёл бы что угодно
+                result["error"] = ("Поиск пропущен: в ответе предыдущего этапа нет поискового запроса "
+                                   "(поле search_query или строка «Поисковый запрос: ...»)")
+                return result
+
+            search_result = search_news(query, count=current_app.config.get("BRAVE_SEARCH_COUNT", 10),
+                                        deadline=deadline)
+
+            if search_result["success"]:
+                result["success"] = True
+                result["content"] = json.dumps({
+                    "search_query": query,
+                    "results": search_result["results"],
+                    "total": search_result["total"]
+                }, ensure_ascii=False)
+            elif search_result.get("timed_out"):
+                return PipelineProcessor._timed_out_result(stage)
+            else:
+                result["error"] = search_result.get("error", "Неизвестная ошибка поиска")
+
+        except Exception as e:
+            result["error"] = f"Ошибка поиска: {str(e)}"
+
+        return result
+
+    @staticmethod
+    def _extract_search_query(content: str) -> Optional[str]:
+        """
+        Извлечь поисковый запрос из ответа модели: JSON с полем search_query
+        либо строка «Поисковый запрос: ...» (формат системного промпта, в том
+        числе с markdown-выделением: **Поисковый запрос:** ...)
+        """
+        text = content.strip()
+        if text.startswith("```"):
+            text = re.sub(r"^```(?:json)?\s*", "", text, flags=re.IGNORECASE)
+            text = re.sub(r"```\s*$", "", text).strip()
+
+        try:
+            data = json.loads(text)
+            if isinstance(data, dict) and data.get("search_query"):
+                return str(data["search_query"]).strip()
+        except (json.JSONDecodeError, ValueError):
+            pass
+
+        # Выделение (**, __, `) мешает найти метку и попадает в запрос
+        plain = re.sub(r"\*+|__+|`+", "", text)
+        match = re.search(r"Поисковый запрос\s*:\s*(.+)", plain, re.IGNORECASE)
+        if match:
+            return match.group(1).strip().strip("[]\"'«»“”„ ").strip() or None
+
+        return None
+
     @staticmethod
     def get_available_stages() -> List[Dict[str, Any]]:
         """
-        Получить список доступных активных этапов для отображения в форме
+        Получить список доступных активных AI-этапов для отображения в форме
+        (служебные шаги вроде поиска выполняются автоматически как зависимости)
 
         Returns:
             List с информацией об этапах:
@@ -165,19 +1201,18 @@ class PipelineProcessor:
                     "display_name": str,
                     "description": str,
                     "order": int,
-                    "has_model": bool
+                    "has_model": bool,
+                    "requires": [str]  # AI-этапы, которые должны быть выбраны вместе с этим
                 }
             ]
         """
-        stages = Stage.query.filter_by(is_active=True).order_by(Stage.order).all()
+        stages = ConfigSnapshot.get().active_stages()
+        by_name = {stage.name: stage for stage in stages}
 
         result = []
         for stage in stages:
-            # Проверяем, есть ли активное назначение модели
-            has_assignment = StageAssignment.query.filter_by(
-                stage_id=stage.id,
-                is_active=True
-            ).first() is not None
+            if not stage.is_llm:
+                continue
 
             result.append({
                 "id": stage.id,
@@ -185,7 +1220,26 @@ class PipelineProcessor:
                 "display_name": stage.display_name,
                 "description": stage.description,
                 "order": stage.order,
-                "has_model": has_assignment
+                "has_model": stage.assignment is not None,
+                "requires": PipelineProcessor._required_llm_stages(stage, by_name)
             })
 
-        return result
\ No newline at end of file
+        return result
+
+    @staticmethod
+    def _required_llm_stages(stage: StageConfig, by_name: Dict[str, StageConfig]) -> List[str]:
+        """Имена AI-этапов, от которых этап зависит (транзитивно, через служебные шаги)"""
+        required = []
+        seen = set()
+        stack = list(stage.dependencies)
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in by_name:
+                continue
+            seen.add(name)
+            dep = by_name[name]
+            if dep.is_llm:
+                required.append(name)
+            else:
+                stack.extend(dep.dependencies)
+        return required
\ No newline at end of file
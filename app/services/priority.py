@@ -0,0 +1,172 @@
+"""
+Классы приоритета запросов к AI провайдерам
+
+interactive — редактор ждёт ответ (молния), normal — обычные задания,
+bulk — пакетная и фоновая переобработка. Класс задаётся в запросе и
+ограничивается ролью пользователя (PRIORITY_BY_ROLE), а дальше идёт с
+планом обработки до каждого запроса к модели.
+
+Когда к провайдеру упирается лимит одновременных запросов, свободный слот
+получает следующий запрос по взвешенной справедливой очереди (PRIORITY_WEIGHTS):
+interactive обслуживается чаще, но bulk не голодает — запрос, прождавший
+дольше PRIORITY_AGING_SECONDS, обслуживается первым независимо от класса.
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+from flask import current_app
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BULK = "bulk"
+
+# От высшего к низшему
+CLASSES = (INTERACTIVE, NORMAL, BULK)
+
+
+def normalize(priority: Optional[str], default: str = NORMAL) -> str:
+    """Класс приоритета из строки запроса (неизвестное значение — default)"""
+    priority = (priority or "").strip().lower()
+    return priority if priority in CLASSES else default
+
+
+def for_user(user, requested: Optional[str] = None, default: Optional[str] = None) -> str:
+    """
+    Класс приоритета запроса пользователя
+
+    Роль (admin, staff, user) задаёт наивысший доступный класс (PRIORITY_BY_ROLE);
+    запрос может понизить его, но не повысить.
+
+    Args:
+        user: Пользователь (User)
+        requested: Класс из запроса (необязательно)
+        default: Класс, если в запросе не указан (по умолчанию — класс роли)
+    """
+    role = "admin" if user.is_admin else "staff" if user.is_staff else "user"
+    role_classes = parse_pairs(current_app.config.get("PRIORITY_BY_ROLE", ""))
+    allowed = normalize(role_classes.get(role), NORMAL)
+
+    priority = normalize(requested, normalize(default, allowed))
+    return priority if CLASSES.index(priority) >= CLASSES.index(allowed) else allowed
+
+
+def parse_pairs(value: str) -> Dict[str, str]:
+    """'admin:interactive,user:normal' -> {"admin": "interactive", "user": "normal"}"""
+    pairs = {}
+    for item in value.split(","):
+        name, _, rest = item.partition(":")
+        if name.strip() and rest.strip():
+            pairs[name.strip()] = rest.strip()
+    return pairs
+
+
+class _Waiter:
+    """Запрос в очереди (сравнивается по identity)"""
+
+    __slots__ = ("since",)
+
+    def __init__(self):
+        self.since = time.monotonic()
+
+
+class PriorityGate:
+    """
+    Ограничение одновременных запросов с очередью по классам приоритета
+
+    Взвешенная справедливая очередь: у каждого класса «виртуальное время»,
+    которое при выдаче слота растёт на 1 / вес класса; слот получает голова
+    очереди класса с наименьшим временем. Класс, только что вставший в
+    очередь, не получает накопленного «кредита» — его время подтягивается к
+    текущему. bulk не может занять последние reserved_slots слотов.
+    """
+
+    def __init__(self, limit: int, weights: Dict[str, float], aging_seconds: float, reserved_slots: int):
+        self.limit = limit
+        self.weights = weights
+        self.aging_seconds = aging_seconds
+        self.bulk_limit = max(1, limit - reserved_slots)
+        self._condition = threading.Condition()
+        self._queues: Dict[str, deque] = {name: deque() for name in CLASSES}
+        self._vtime: Dict[str, float] = {name: 0.0 for name in CLASSES}
+        self._clock = 0.0
+        self._active: Dict[str, int] = {name: 0 for name in CLASSES}
+        self._stats: Dict[str, Dict[str, float]] = {
+            name: {"granted": 0, "timed_out": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0} for name in CLASSES
+        }
+
+    def acquire(self, priority: str, timeout: Optional[float] = None) -> bool:
+        """
+        Дождаться слота (не дольше timeout секунд)
+
+        Returns:
+            True, если слот получен
+        """
+        queue = self._queues[priority]
+        waiter = _Waiter()
+        with self._condition:
+            if not queue:
+                self._vtime[priority] = max(self._vtime[priority], self._clock)
+            queue.append(waiter)
+
+            while self._select() != priority or queue[0] is not waiter:
+                remaining = None if timeout is None else timeout - (time.monotonic() - waiter.since)
+                if remaining is not None and remaining <= 0:
+                    queue.remove(waiter)
+                    self._stats[priority]["timed_out"] += 1
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+
+            queue.popleft()
+            self._active[priority] += 1
+            self._clock = self._vtime[priority]
+            self._vtime[priority] += 1.0 / max(self.weights.get(priority, 1.0), 0.001)
+
+            waited = time.monotonic() - waiter.since
+            stats = self._stats[priority]
+            stats["granted"] += 1
+            stats["wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+            # Следующий в очереди мог стать первым — пусть проверит
+            self._condition.notify_all()
+            return True
+
+    def release(self, priority: str) -> None:
+        with self._condition:
+            self._active[priority] -= 1
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Занятые слоты, длина очередей и время ожидания по классам"""
+        with self._condition:
+            classes = {}
+            for name in CLASSES:
+                stats = self._stats[name]
+                classes[name] = {
+                    "active": self._active[name],
+                    "waiting": len(self._queues[name]),
+                    "granted": int(stats["granted"]),
+                    "timed_out": int(stats["timed_out"]),
+                    "avg_wait_ms": int(stats["wait_seconds"] / stats["granted"] * 1000) if stats["granted"] else 0,
+                    "max_wait_ms": int(stats["max_wait_seconds"] * 1000)
+                }
+            return {"limit": self.limit, "classes": classes}
+
+    def _select(self) -> Optional[str]:
+        """Класс, чья голова очереди получает следующий свободный слот (под _condition)"""
+        if sum(self._active.values()) >= self.limit:
+            return None
+
+        candidates: List[str] = [name for name in CLASSES if self._queues[name]
+                                 and not (name == BULK and self._active[BULK] >= self.bulk_limit)]
+        if not candidates:
+            return None
+
+        # Старение: давно ждущий запрос обслуживается первым
+        oldest = min(candidates, key=lambda name: self._queues[name][0].since)
+        if time.monotonic() - self._queues[oldest][0].since >= self.aging_seconds:
+            return oldest
+
+        return min(candidates, key=lambda name: (self._vtime[name], CLASSES.index(name)))
@@ -4,6 +4,8 @@
 from typing import Optional
 from app.extensions import db
 from app.models import SystemPrompt, UserPrompt, Stage, User
+from app.services.config_snapshot import ConfigSnapshot, UserPromptCache
+from app.services.llm_cache import LLMCache
 
 
 class PromptManager:
@@ -103,6 +105,8 @@ class PromptManager:
             db.session.add(system_prompt)
 
         db.session.commit()
+        ConfigSnapshot.bump_version()
+        LLMCache.invalidate(stage_id=stage_id)
         return system_prompt
 
     @staticmethod
@@ -123,6 +127,8 @@ class PromptManager:
         user_prompt.is_customized = True
 
         db.session.commit()
+        # Только промпты этого пользователя: снимок конфигурации (и кэш ответов) не перестраивается
+        UserPromptCache.invalidate(user_id)
         return user_prompt
 
     @staticmethod
@@ -147,6 +153,8 @@ class PromptManager:
         user_prompt.is_customized = False
 
         db.session.commit()
+        # Только промпты этого пользователя: снимок конфигурации (и кэш ответов) не перестраивается
+        UserPromptCache.invalidate(user_id)
         return user_prompt
 
     @staticmethod
@@ -158,7 +166,7 @@ class PromptManager:
         Args:
             user_id: ID пользователя
         """
-        stages = Stage.query.filter_by(is_active=True).all()
+        stages = Stage.query.filter_by(is_active=True, kind=Stage.KIND_LLM).all()
 
         for stage in stages:
             # Создаём промпт только если его еще нет
@@ -179,4 +187,4 @@ class PromptManager:
             Текст промпта
         """
         user_prompt = PromptManager.get_or_create_user_prompt(user_id, stage_id)
-        return user_prompt.prompt_text
\ No newline at end of file
+        return user_prompt.prompt_text
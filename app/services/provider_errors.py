@@ -0,0 +1,84 @@
+"""
+Классы ошибок AI провайдеров
+
+Каждый неуспешный результат send_message / send_ai_request помечается полем
+error_type. По нему конвейер решает, что делать дальше: временные ошибки
+(TRANSIENT) засчитываются автомату отключения (CircuitBreaker), а на ошибку
+в самом запросе (bad_request) резервная модель не вызывается — она получила
+бы тот же некорректный запрос.
+"""
+from typing import Optional
+
+AUTH = "auth"                # 401, 403: неверный или отозванный ключ
+BAD_REQUEST = "bad_request"  # 400, 413, 422: некорректный запрос
+NOT_FOUND = "not_found"      # 404: модель или endpoint не найдены
+RATE_LIMIT = "rate_limit"    # 429: превышен лимит провайдера
+OVERLOADED = "overloaded"    # 503, 529: провайдер перегружен
+SERVER = "server"            # прочие 5xx и ошибки в потоке ответа
+TIMEOUT = "timeout"          # таймаут ответа или истёк deadline
+NETWORK = "network"          # соединение не установлено или оборвано
+UNAVAILABLE = "unavailable"  # запрос не отправлялся: провайдер или модель отключены автоматом
+TOO_LARGE = "too_large"      # запрос не отправлялся: вход больше окна контекста или бюджета модели
+UNKNOWN = "unknown"
+
+# Ошибки, которые говорят о состоянии провайдера, а не запроса
+TRANSIENT = frozenset({RATE_LIMIT, OVERLOADED, SERVER, TIMEOUT, NETWORK})
+
+# Типы ошибок в теле ответа (Anthropic error.type, OpenAI error.type, Google error.status)
+_NAMED = {
+    "authentication_error": AUTH,
+    "permission_error": AUTH,
+    "invalid_api_key": AUTH,
+    "UNAUTHENTICATED": AUTH,
+    "PERMISSION_DENIED": AUTH,
+    "invalid_request_error": BAD_REQUEST,
+    "request_too_large": BAD_REQUEST,
+    "INVALID_ARGUMENT": BAD_REQUEST,
+    "FAILED_PRECONDITION": BAD_REQUEST,
+    "not_found_error": NOT_FOUND,
+    "NOT_FOUND": NOT_FOUND,
+    "rate_limit_error": RATE_LIMIT,
+    "rate_limit_exceeded": RATE_LIMIT,
+    "RESOURCE_EXHAUSTED": RATE_LIMIT,
+    "overloaded_error": OVERLOADED,
+    "UNAVAILABLE": OVERLOADED,
+    "api_error": SERVER,
+    "server_error": SERVER,
+    "INTERNAL": SERVER,
+    "DEADLINE_EXCEEDED": TIMEOUT,
+}
+
+
+def classify_status(status_code: int) -> str:
+    """Класс ошибки по HTTP-статусу ответа провайдера"""
+    if status_code in (401, 403):
+        return AUTH
+    if status_code == 404:
+        return NOT_FOUND
+    if status_code == 408:
+        return TIMEOUT
+    if status_code == 429:
+        return RATE_LIMIT
+    if status_code in (503, 529):
+        return OVERLOADED
+    if status_code >= 500 or status_code in (409, 425):
+        return SERVER
+    if status_code >= 400:
+        return BAD_REQUEST
+    return UNKNOWN
+
+
+def is_provider_failure(result, deadline=None) -> bool:
+    """
+    Говорит ли неуспешный результат о сбое провайдера: временная ошибка,
+    кроме таймаута, вызванного истечением deadline самого запроса
+    """
+    error_type = result.get("error_type")
+    if result["success"] or error_type not in TRANSIENT:
+        return False
+    return not (error_type == TIMEOUT and deadline is not None and deadline.expired)
+
+
+def classify_name(name: Optional[str], default: str = SERVER) -> str:
+    """Класс ошибки по её типу из тела ответа или события потока"""
+    return _NAMED.get(name or "", default)
@@ -0,0 +1,176 @@
+"""
+Лимиты частоты запросов к провайдерам: запросов в минуту (rpm) и токенов в минуту (tpm)
+
+Каждый лимит — корзина токенов (token bucket) в таблице rate_limit_buckets:
+ёмкость равна лимиту в минуту, корзина равномерно наполняется, запрос
+забирает из неё свою стоимость (1 для rpm, оценку токенов для tpm).
+Списание — один условный UPDATE на корзину в общей транзакции, поэтому лимит
+соблюдают все процессы вместе. Если токенов не хватает, вызывающий поток
+ждёт, пока корзина наполнится (не дольше RATE_LIMIT_MAX_WAIT_SECONDS и
+deadline), вместо запроса, который провайдер всё равно отклонит с 429.
+
+Лимиты задаются ключами "rpm" и "tpm" в Provider.additional_config (на весь
+провайдер) и в AIModel.default_params (на модель); для поиска — BRAVE_SEARCH_RPM.
+"""
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import case, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app.extensions import db
+from app.models import RateLimitBucket
+
+# (ключ корзины, лимит в минуту, стоимость запроса)
+Limit = Tuple[str, float, float]
+
+
+class RateLimiter:
+    """
+    Общие для процессов лимиты запросов и токенов в минуту
+    """
+
+    LIMIT_KEYS = ("rpm", "tpm")
+
+    _known_keys: set = set()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def limits(prefix: str, config: Dict[str, Any], tokens: float = 0) -> List[Limit]:
+        """
+        Лимиты из конфигурации провайдера или модели
+
+        Args:
+            prefix: Префикс ключей корзин ("provider:3", "model:5")
+            config: additional_config провайдера или default_params модели
+            tokens: Оценка токенов запроса (стоимость для tpm)
+
+        Returns:
+            [(ключ, лимит в минуту, стоимость)] для заданных положительных лимитов
+        """
+        limits = []
+        for name in RateLimiter.LIMIT_KEYS:
+            try:
+                per_minute = float(config.get(name) or 0)
+            except (TypeError, ValueError):
+                continue
+            if per_minute > 0:
+                limits.append((f"{prefix}:{name}", per_minute, 1.0 if name == "rpm" else max(float(tokens), 1.0)))
+        return limits
+
+    @classmethod
+    def acquire(cls, limits: List[Limit], deadline=None) -> Tuple[bool, Optional[float]]:
+        """
+        Списать стоимость запроса из всех корзин сразу, дожидаясь наполнения при нехватке
+
+        Ошибка БД не блокирует запрос (лимит пропускается, пишется предупреждение).
+
+        Args:
+            limits: Лимиты запроса (limits)
+            deadline: Крайний срок ожидания
+
+        Returns:
+            Tuple (списана ли стоимость — только тогда запрос сверяется через settle;
+            None, если запрос можно выполнять, иначе сколько секунд ещё пришлось
+            бы ждать: ожидание вышло за RATE_LIMIT_MAX_WAIT_SECONDS или deadline)
+        """
+        if not limits:
+            return False, None
+
+        give_up_at = time.monotonic() + current_app.config.get("RATE_LIMIT_MAX_WAIT_SECONDS", 20)
+        while True:
+            try:
+                wait = cls._try_take(limits)
+            except SQLAlchemyError as e:
+                current_app.logger.warning("Rate limiter: %s", e)
+                return False, None
+
+            if wait <= 0:
+                return True, None
+
+            remaining = give_up_at - time.monotonic()
+            if deadline is not None:
+                remaining = min(remaining, deadline.remaining())
+            if wait > remaining:
+                return False, wait
+
+            time.sleep(wait)
+
+    @classmethod
+    def settle(cls, limits: List[Limit], used_tokens: Optional[float]) -> None:
+        """
+        Сверить оценку токенов с фактическим расходом (usage ответа): разница
+        возвращается в корзины tpm (или дополнительно списывается)
+
+        Args:
+            limits: Лимиты, стоимость которых списал acquire
+            used_tokens: Фактическое число токенов (0 — запрос не выполнен; None — неизвестно)
+        """
+        if used_tokens is None:
+            return
+
+        table = RateLimitBucket.__table__
+        try:
+            with db.engine.begin() as connection:
+                for key, per_minute, cost in limits:
+                    if not key.endswith(":tpm"):
+                        continue
+                    refund = min(cost, per_minute) - used_tokens
+                    tokens = case((table.c.tokens + refund > per_minute, per_minute), else_=table.c.tokens + refund)
+                    connection.execute(table.update().where(table.c.key == key).values(tokens=tokens))
+        except SQLAlchemyError as e:
+            current_app.logger.warning("Rate limiter: %s", e)
+
+    @classmethod
+    def _try_take(cls, limits: List[Limit]) -> float:
+        """
+        Одна попытка списания
+
+        Returns:
+            0, если стоимость списана из всех корзин; иначе через сколько секунд
+            в самой пустой корзине наберётся нужное количество
+        """
+        now = time.time()
+        cls._ensure_buckets(limits, now)
+
+        table = RateLimitBucket.__table__
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            for key, per_minute, cost in limits:
+                rate = per_minute / 60.0
+                cost = min(cost, per_minute)  # запрос больше ёмкости ждёт полную корзину
+                refilled = table.c.tokens + (now - table.c.updated_at) * rate
+                available = case((refilled > per_minute, per_minute), else_=refilled)
+
+                taken = connection.execute(
+                    table.update()
+                    .where(table.c.key == key, available >= cost)
+                    .values(tokens=available - cost, updated_at=now)
+                ).rowcount
+                if not taken:
+                    transaction.rollback()
+                    row = connection.execute(select(table.c.tokens, table.c.updated_at)
+                                             .where(table.c.key == key)).first()
+                    tokens = min(per_minute, row.tokens + max(0.0, now - row.updated_at) * rate) if row else 0.0
+                    return max((cost - tokens) / rate, 0.01)
+
+            transaction.commit()
+            return 0.0
+
+    @classmethod
+    def _ensure_buckets(cls, limits: List[Limit], now: float) -> None:
+        """Создать недостающие корзины (полными)"""
+        missing = [(key, per_minute) for key, per_minute, _ in limits if key not in cls._known_keys]
+        if not missing:
+            return
+
+        table = RateLimitBucket.__table__
+        for key, per_minute in missing:
+            try:
+                with db.engine.begin() as connection:
+                    if connection.execute(select(table.c.key).where(table.c.key == key)).first() is None:
+                        connection.execute(table.insert().values(key=key, tokens=per_minute, updated_at=now))
+            except IntegrityError:
+                pass  # корзину одновременно создал другой процесс
+            with cls._lock:
+                cls._known_keys.add(key)
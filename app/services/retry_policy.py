@@ -0,0 +1,152 @@
+"""
+Повтор запросов к провайдерам при временных ошибках
+
+429, 5xx, 529 (overloaded) и обрывы соединения часто проходят через секунду,
+поэтому запрос повторяется, прежде чем конвейер перейдёт на резервную модель.
+Пауза берётся из ответа провайдера (Retry-After, retry-after-ms, заголовки
+лимитов anthropic-ratelimit-* и x-ratelimit-*), а если её нет — экспоненциальная
+с полным джиттером. Повторы укладываются в deadline запроса: если пауза не
+помещается в оставшееся время, ошибка возвращается сразу.
+"""
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+from flask import current_app, has_app_context
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class RetryPolicy:
+    """
+    Параметры повторов одного провайдера
+
+    Значения по умолчанию — RETRY_* из конфигурации приложения; провайдер может
+    переопределить их ключами max_retries, retry_base_delay, retry_max_delay
+    в дополнительной конфигурации.
+    """
+
+    RETRYABLE_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 529})
+
+    def __init__(self, max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 10.0):
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(0.0, float(max_delay))
+
+    @classmethod
+    def from_config(cls, additional_config: Optional[Dict[str, Any]] = None) -> "RetryPolicy":
+        config = current_app.config if has_app_context() else {}
+        additional_config = additional_config or {}
+        try:
+            return cls(
+                max_retries=additional_config.get("max_retries", config.get("RETRY_MAX_RETRIES", 2)),
+                base_delay=additional_config.get("retry_base_delay", config.get("RETRY_BASE_DELAY_SECONDS", 0.5)),
+                max_delay=additional_config.get("retry_max_delay", config.get("RETRY_MAX_DELAY_SECONDS", 10))
+            )
+        except (TypeError, ValueError):
+            return cls()
+
+    def is_retryable(self, status_code: int) -> bool:
+        return status_code in self.RETRYABLE_STATUSES
+
+    def next_delay(self, retries: int, response=None, deadline=None) -> Optional[float]:
+        """
+        Пауза перед следующей попыткой
+
+        Args:
+            retries: Сколько повторов уже сделано
+            response: Ответ с ошибкой (None — ошибка соединения)
+            deadline: Крайний срок запроса
+
+        Returns:
+            Пауза, сек, или None — больше не повторять (попытки кончились, провайдер
+            просит ждать дольше max_delay или пауза не помещается в deadline)
+        """
+        if retries >= self.max_retries:
+            return None
+
+        delay = self.server_delay(response) if response is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retries))
+        elif delay > self.max_delay:
+            return None
+
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
+
+    @staticmethod
+    def sleep(delay: float, deadline=None) -> bool:
+        """
+        Подождать перед повтором
+
+        Returns:
+            False, если deadline отменён или истёк за время ожидания
+        """
+        time.sleep(delay)
+        return not (deadline and deadline.expired)
+
+    @staticmethod
+    def server_delay(response) -> Optional[float]:
+        """
+        Пауза, о которой просит провайдер: Retry-After (секунды или HTTP-дата),
+        retry-after-ms, а при исчерпанном лимите — время его сброса из заголовков
+        anthropic-ratelimit-*-reset (RFC 3339) и x-ratelimit-reset-* (1m30s)
+
+        Returns:
+            Секунды или None, если провайдер ничего не сообщил
+        """
+        headers = response.headers
+
+        if headers.get("retry-after-ms"):
+            try:
+                return max(0.0, float(headers["retry-after-ms"]) / 1000)
+            except ValueError:
+                pass
+
+        retry_after = headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+
+        resets = []
+        for kind in ("requests", "tokens", "input-tokens", "output-tokens"):
+            if headers.get(f"anthropic-ratelimit-{kind}-remaining") == "0":
+                reset_at = RetryPolicy._parse_timestamp(headers.get(f"anthropic-ratelimit-{kind}-reset"))
+                if reset_at is not None:
+                    resets.append((reset_at - datetime.now(timezone.utc)).total_seconds())
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset_in = RetryPolicy._parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset_in is not None:
+                    resets.append(reset_in)
+
+        return max(0.0, max(resets)) if resets else None
+
+    @staticmethod
+    def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+        """RFC 3339: 2026-10-16T12:00:30Z"""
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def _parse_duration(value: Optional[str]) -> Optional[float]:
+        """Длительность OpenAI: 1s, 6m0s, 120ms, 1h2m3.5s"""
+        if not value:
+            return None
+        parts = _DURATION_RE.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
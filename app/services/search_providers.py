@@ -4,6 +4,10 @@
 import requests
 from typing import Dict, List, Any, Optional, Tuple
 from abc import ABC, abstractmethod
+from app.services.deadline import Deadline
+from app.services.http_transport import HttpTransport
+from app.services.rate_limiter import RateLimiter
+from app.services.retry_policy import RetryPolicy
 
 
 class SearchProviderError(Exception):
@@ -24,11 +28,41 @@ class BaseSearchProvider(ABC):
         """
         Args:
             api_key: API ключ провайдера
-            additional_config: Дополнительная конфигурация (dict)
+            additional_config: Дополнительная конфигурация (dict); max_retries, retry_base_delay,
+                               retry_max_delay — повторы при временных ошибках (RetryPolicy)
         """
         self.api_key = api_key
         self.additional_config = additional_config or {}
         self.timeout = self.additional_config.get('timeout', 10)
+        self.connect_timeout = self.additional_config.get('connect_timeout', 5)
+        self.retry_policy = RetryPolicy.from_config(self.additional_config)
+
+    def _get(self, url: str, deadline: Optional[Deadline] = None, **kwargs) -> Tuple[requests.Response, int]:
+        """
+        GET-запрос с повторами при временных ошибках (429, 5xx, обрыв соединения)
+
+        Returns:
+            Tuple (последний ответ, число повторов). Таймаут и ошибка соединения
+            после исчерпания повторов пробрасываются как исключения requests
+        """
+        retries = 0
+        while True:
+            try:
+                response = HttpTransport.get(url, timeout=Deadline.http_timeout(deadline, self.connect_timeout,
+                                                                                self.timeout), **kwargs)
+            except requests.exceptions.Timeout:
+                raise
+            except requests.exceptions.ConnectionError:
+                delay = self.retry_policy.next_delay(retries, None, deadline)
+                if delay is None or not self.retry_policy.sleep(delay, deadline):
+                    raise
+            else:
+                delay = None
+                if self.retry_policy.is_retryable(response.status_code):
+                    delay = self.retry_policy.next_delay(retries, response, deadline)
+                if delay is None or not self.retry_policy.sleep(delay, deadline):
+                    return response, retries
+            retries += 1
 
     @abstractmethod
     def get_provider_name(self) -> str:
@@ -96,6 +130,7 @@ class BraveSearchProvider(BaseSearchProvider):
         - freshness: 'pd' (past day), 'pw' (past week), 'pm' (past month), 'py' (past year)
         - country: код страны (например, 'ru', 'us')
         - search_lang: язык поиска (например, 'ru', 'en')
+        - deadline: крайний срок запроса (Deadline), таймауты урезаются до остатка
         """
         endpoint = f"{self.BASE_URL}/web/search"
 
@@ -120,12 +155,8 @@ class BraveSearchProvider(BaseSearchProvider):
             params["search_lang"] = kwargs["search_lang"]
 
         try:
-            response = requests.get(
-                endpoint,
-                headers=headers,
-                params=params,
-                timeout=self.timeout
-            )
+            response, retries = self._get(endpoint, kwargs.get("deadline"), headers=headers, params=params)
+            retries_info = {"retries": retries} if retries else {}
 
             if response.status_code == 200:
                 data = response.json()
@@ -149,7 +180,8 @@ class BraveSearchProvider(BaseSearchProvider):
                     "query": query,
                     "results": results,
                     "total": len(results),
-                    "error": None
+                    "error": None,
+                    **retries_info
                 }
 
             elif response.status_code == 401:
@@ -166,7 +198,8 @@ class BraveSearchProvider(BaseSearchProvider):
                     "query": query,
                     "results": [],
                     "total": 0,
-                    "error": "Превышен лимит запросов"
+                    "error": "Превышен лимит запросов",
+                    **retries_info
                 }
             else:
                 error_text = response.text[:200] if response.text else "Unknown error"
@@ -175,7 +208,8 @@ class BraveSearchProvider(BaseSearchProvider):
                     "query": query,
                     "results": [],
                     "total": 0,
-                    "error": f"Brave Search API Error {response.status_code}: {error_text}"
+                    "error": f"Brave Search API Error {response.status_code}: {error_text}",
+                    **retries_info
                 }
 
         except requests.exceptions.Timeout:
@@ -184,7 +218,8 @@ class BraveSearchProvider(BaseSearchProvider):
                 "query": query,
                 "results": [],
                 "total": 0,
-                "error": "Превышено время ожидания ответа"
+                "error": "Превышено время ожидания ответа",
+                "timed_out": True
             }
         except requests.exceptions.ConnectionError:
             return {
@@ -320,6 +355,20 @@ def search_news(query: str,
                 "error": f"API ключ для провайдера {provider} не настроен"
             }
 
+    # Общий для процессов лимит запросов в минуту (BRAVE_SEARCH_RPM): ждём, а не получаем 429
+    from flask import current_app
+    rate_limits = RateLimiter.limits(f"search:{provider}",
+                                     {"rpm": current_app.config.get(f"{provider.upper()}_SEARCH_RPM", 0)})
+    _, rate_limit_wait = RateLimiter.acquire(rate_limits, kwargs.get("deadline"))
+    if rate_limit_wait is not None:
+        return {
+            "success": False,
+            "query": query,
+            "results": [],
+            "total": 0,
+            "error": f"Превышен лимит запросов (до освобождения {rate_limit_wait:.0f} с)"
+        }
+
     try:
         search_provider = SearchProviderFactory.create_provider(provider, api_key)
         return search_provider.search(query, **kwargs)
@@ -0,0 +1,204 @@
+"""
+Упреждающая обработка новости, пока редактор ещё вводит или вставляет текст
+
+Браузер с задержкой (debounce) отправляет текст на POST /process/speculative,
+и дешёвые этапы (SPECULATIVE_STAGES, например классификация) запускаются в
+фоне сразу. Результаты хранятся по хешу текста; когда редактор нажимает
+«Обработать», задание с тем же текстом забирает готовые результаты (или ждёт
+ещё выполняющийся прогон) вместо повторных запросов к моделям.
+
+Прогоны хранятся в памяти процесса, поэтому работают только с исполнителем
+заданий в веб-процессе (JOB_EXECUTOR=thread).
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, List, Optional
+from flask import current_app
+from app.services.config_snapshot import ConfigSnapshot
+from app.services.deadline import Deadline
+from app.services.pipeline_processor import PipelineProcessor
+from app.services import priority as priorities
+
+
+class SpeculativeRun:
+    """Упреждающий прогон этапов для одного текста"""
+
+    __slots__ = ("key", "user_id", "stage_names", "deadline", "future", "results", "started")
+
+    def __init__(self, key: str, user_id: int, stage_names: List[str], deadline: Deadline):
+        self.key = key
+        self.user_id = user_id
+        self.stage_names = stage_names
+        self.deadline = deadline
+        self.future: Optional[Future] = None
+        self.results: Dict[int, Dict[str, Any]] = {}  # stage_id -> {"key": result_key, "result": результат}
+        self.started = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "stages": self.stage_names,
+            "status": "done" if self.future and self.future.done() else "running"
+        }
+
+
+class SpeculativeRuns:
+    """
+    Упреждающие прогоны пользователей (в памяти процесса)
+
+    У пользователя одновременно не больше SPECULATIVE_MAX_PER_USER прогонов:
+    новый текст (редактор продолжает печатать) отменяет самый старый прогон.
+    Незабранные прогоны удаляются через SPECULATIVE_TTL_SECONDS.
+    """
+
+    _runs: Dict[str, SpeculativeRun] = {}
+    _lock = threading.Lock()
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def make_key(user_id: int, news_text: str) -> str:
+        """Ключ прогона: пользователь + sha256 текста (результаты верны только для этого текста)"""
+        digest = hashlib.sha256(news_text.strip().encode("utf-8")).hexdigest()
+        return f"{user_id}:{digest}"
+
+    @classmethod
+    def start(cls, user_id: int, news_text: str, stage_ids: List[int],
+              priority: str = priorities.NORMAL) -> Optional[SpeculativeRun]:
+        """
+        Запустить в фоне дешёвые этапы из выбранных для текста новости
+
+        Повторный вызов с тем же текстом возвращает уже запущенный прогон.
+
+        Args:
+            user_id: ID пользователя
+            news_text: Текущий текст новости
+            stage_ids: Этапы, выбранные в форме; из них запускаются только
+                       SPECULATIVE_STAGES (вместе с зависимостями, если они тоже дешёвые)
+            priority: Класс приоритета запросов к провайдерам
+
+        Returns:
+            SpeculativeRun или None, если запускать нечего
+        """
+        config = current_app.config
+        news_text = news_text.strip()
+        if len(news_text) < config.get("SPECULATIVE_MIN_CHARS", 0):
+            return None
+
+        key = cls.make_key(user_id, news_text)
+        with cls._lock:
+            cls._drop_expired()
+            run = cls._runs.get(key)
+            if run is not None:
+                return run
+
+        cheap = cls._stage_names()
+        snapshot = ConfigSnapshot.get()
+        speculative_ids = [stage_id for stage_id in stage_ids
+                           if stage_id in snapshot.stages and snapshot.stages[stage_id].name in cheap]
+        if not speculative_ids:
+            return None
+
+        plan, error = PipelineProcessor.build_plan(user_id, speculative_ids, priority)
+        if error or any(stage.name not in cheap for stage in plan.nodes.values()):
+            return None
+
+        run = SpeculativeRun(key, user_id, [plan.nodes[stage_id].name for stage_id in plan.display_order()],
+                             Deadline(time.monotonic() + config.get("SPECULATIVE_TTL_SECONDS", 120)))
+        with cls._lock:
+            if key in cls._runs:
+                return cls._runs[key]
+
+            # Прогоны считаются в лимите пользователя: новый текст вытесняет самые старые
+            user_runs = sorted((r for r in cls._runs.values() if r.user_id == user_id), key=lambda r: r.started)
+            for stale in user_runs[:max(0, len(user_runs) - config.get("SPECULATIVE_MAX_PER_USER", 1) + 1)]:
+                cls._discard(stale)
+
+            cls._runs[key] = run
+            app = current_app._get_current_object()
+            run.future = cls._get_executor(app).submit(cls._execute, app, run, plan, news_text)
+
+        return run
+
+    @classmethod
+    def cancel(cls, user_id: int) -> int:
+        """
+        Отменить все прогоны пользователя (текст очищен или заменён)
+
+        Returns:
+            Количество отменённых прогонов
+        """
+        with cls._lock:
+            runs = [run for run in cls._runs.values() if run.user_id == user_id]
+            for run in runs:
+                cls._discard(run)
+        return len(runs)
+
+    @classmethod
+    def claim(cls, user_id: int, news_text: str,
+              deadline: Optional[Deadline] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Забрать результаты прогона для текста задания; если прогон ещё
+        выполняется — дождаться его, но не дольше deadline
+
+        Returns:
+            Dict {stage_id: {"key": PlannedStage.result_key(), "result": результат этапа}}
+            (только успешные этапы; пустой, если прогона для этого текста нет)
+        """
+        with cls._lock:
+            run = cls._runs.pop(cls.make_key(user_id, news_text), None)
+        if run is None or run.future is None:
+            return {}
+
+        try:
+            run.future.result(timeout=deadline.remaining() if deadline and deadline.expires_at else None)
+        except FutureTimeoutError:
+            run.deadline.cancel()
+        except Exception as e:
+            current_app.logger.warning("Speculative run failed: %s", e)
+
+        return {stage_id: entry for stage_id, entry in list(run.results.items()) if entry["result"]["success"]}
+
+    @classmethod
+    def _execute(cls, app, run: SpeculativeRun, plan, news_text: str) -> None:
+        """Выполнить план прогона в потоке пула, сохраняя результаты этапов по мере готовности"""
+        with app.app_context():
+            def save(stage_result: Dict[str, Any]):
+                stage = plan.nodes[stage_result["stage_id"]]
+                stage_result["speculative"] = True
+                run.results[stage.id] = {"key": stage.result_key(), "result": stage_result}
+
+            PipelineProcessor.execute_plan(plan, news_text, on_stage_result=save, deadline=run.deadline)
+
+    @classmethod
+    def _discard(cls, run: SpeculativeRun) -> None:
+        """Убрать прогон и прервать его запросы (под _lock)"""
+        cls._runs.pop(run.key, None)
+        run.deadline.cancel()
+        if run.future is not None:
+            run.future.cancel()
+
+    @classmethod
+    def _drop_expired(cls) -> None:
+        """Удалить прогоны, которые так и не забрали (под _lock)"""
+        ttl = current_app.config.get("SPECULATIVE_TTL_SECONDS", 120)
+        now = time.monotonic()
+        for run in [run for run in cls._runs.values() if now - run.started > ttl]:
+            cls._discard(run)
+
+    @staticmethod
+    def _stage_names() -> set:
+        """Этапы, которые можно запускать до отправки формы (SPECULATIVE_STAGES)"""
+        names = current_app.config.get("SPECULATIVE_STAGES", "")
+        return {name.strip() for name in names.split(",") if name.strip()}
+
+    @classmethod
+    def _get_executor(cls, app) -> ThreadPoolExecutor:
+        """Пул упреждающих прогонов (создаётся лениво, один на процесс; под _lock)"""
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=app.config.get("SPECULATIVE_WORKERS", 2),
+                thread_name_prefix="speculative"
+            )
+        return cls._executor
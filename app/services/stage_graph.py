@@ -0,0 +1,127 @@
+"""
+Граф зависимостей этапов конвейера обработки
+"""
+import heapq
+from typing import Dict, List, Iterable, Set
+
+
+class StageGraphError(Exception):
+    """Ошибка построения графа этапов (например, циклическая зависимость)"""
+    pass
+
+
+class StageGraph:
+    """
+    Граф этапов для одного запуска конвейера
+
+    Содержит выбранные пользователем этапы и (транзитивно) все этапы,
+    от которых они зависят. Этапы описываются объектами с атрибутами
+    id, name, order и dependencies (список имён этапов-зависимостей).
+    """
+
+    def __init__(self, nodes: Dict[int, object], dependencies: Dict[int, List[int]],
+                 missing: Dict[int, List[str]], selected_ids: Set[int]):
+        """
+        Args:
+            nodes: Этапы графа {stage_id: stage}
+            dependencies: Зависимости {stage_id: [stage_id, ...]}
+            missing: Недоступные зависимости {stage_id: [имя этапа, ...]}
+            selected_ids: ID этапов, выбранных явно (остальные добавлены как зависимости)
+        """
+        self.nodes = nodes
+        self.dependencies = dependencies
+        self.missing = missing
+        self.selected_ids = selected_ids
+        self.dependents: Dict[int, List[int]] = {stage_id: [] for stage_id in nodes}
+        for stage_id, deps in dependencies.items():
+            for dep_id in deps:
+                self.dependents[dep_id].append(stage_id)
+
+    @classmethod
+    def build(cls, stage_ids: Iterable[int], available_stages: Iterable[object]) -> "StageGraph":
+        """
+        Построить граф из выбранных этапов
+
+        Args:
+            stage_ids: ID выбранных этапов
+            available_stages: Все активные этапы (для разрешения зависимостей по имени)
+
+        Returns:
+            StageGraph
+
+        Raises:
+            StageGraphError: Если в зависимостях есть цикл
+        """
+        by_id = {stage.id: stage for stage in available_stages}
+        by_name = {stage.name: stage for stage in by_id.values()}
+
+        selected_ids = {stage_id for stage_id in stage_ids if stage_id in by_id}
+        nodes: Dict[int, object] = {}
+        dependencies: Dict[int, List[int]] = {}
+        missing: Dict[int, List[str]] = {}
+
+        stack = [by_id[stage_id] for stage_id in selected_ids]
+        while stack:
+            stage = stack.pop()
+            if stage.id in nodes:
+                continue
+            nodes[stage.id] = stage
+            dependencies[stage.id] = []
+
+            for dep_name in stage.dependencies:
+                dep = by_name.get(dep_name)
+                if dep is None:
+                    missing.setdefault(stage.id, []).append(dep_name)
+                    continue
+                dependencies[stage.id].append(dep.id)
+                stack.append(dep)
+
+        graph = cls(nodes, dependencies, missing, selected_ids)
+        graph.topological_order()  # проверка на циклы
+        return graph
+
+    def topological_order(self) -> List[int]:
+        """
+        Топологический порядок этапов (при равенстве — по Stage.order)
+
+        Raises:
+            StageGraphError: Если в графе есть цикл
+        """
+        indegree = {stage_id: len(deps) for stage_id, deps in self.dependencies.items()}
+        heap = [self._sort_key(stage_id) for stage_id, degree in indegree.items() if degree == 0]
+        heapq.heapify(heap)
+
+        order = []
+        while heap:
+            _, _, stage_id = heapq.heappop(heap)
+            order.append(stage_id)
+            for dependent_id in self.dependents[stage_id]:
+                indegree[dependent_id] -= 1
+                if indegree[dependent_id] == 0:
+                    heapq.heappush(heap, self._sort_key(dependent_id))
+
+        if len(order) != len(self.nodes):
+            cyclic = sorted(self.nodes[stage_id].name for stage_id, degree in indegree.items() if degree > 0)
+            raise StageGraphError(f"Циклическая зависимость этапов: {', '.join(cyclic)}")
+
+        return order
+
+    def ancestors(self, stage_id: int) -> Set[int]:
+        """ID всех этапов, от которых этап зависит (транзитивно)"""
+        seen: Set[int] = set()
+        stack = list(self.dependencies[stage_id])
+        while stack:
+            dep_id = stack.pop()
+            if dep_id in seen:
+                continue
+            seen.add(dep_id)
+            stack.extend(self.dependencies[dep_id])
+        return seen
+
+    def display_order(self) -> List[int]:
+        """ID этапов в порядке отображения (Stage.order)"""
+        return [stage_id for _, _, stage_id in sorted(self._sort_key(stage_id) for stage_id in self.nodes)]
+
+    def _sort_key(self, stage_id: int):
+        stage = self.nodes[stage_id]
+        return stage.order, stage.id, stage_id
@@ -0,0 +1,214 @@
+"""
+Оценка числа токенов и проверка размера входа до запроса к провайдеру
+
+- перед постановкой задания текст новости сверяется с INPUT_MAX_TOKENS:
+  длиннее — отклоняется или обрезается (INPUT_OVERFLOW = reject | trim);
+  при PIPELINE_CHUNKING лимит относится к фрагменту, а не ко всему тексту;
+- перед каждым запросом к модели сообщения сверяются с её окном контекста
+  (за вычетом max_tokens ответа) и бюджетом входа (INPUT_TOKEN_BUDGET или
+  max_input_tokens модели); не поместившийся запрос не отправляется (провайдер
+  отклонил бы его только после полного сетевого запроса) и получает
+  error_type too_large — резервная модель с большим окном может его выполнить.
+
+Токены считаются локально и приближённо: текст делится на слова, числа и
+знаки, а длина слова переводится в токены по среднему числу символов на
+токен у токенизатора семейства провайдера (кириллица делится на токены
+мельче латиницы). Оценка кэшируется по хешу текста, поэтому один и тот же
+текст новости во всех этапах считается один раз.
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from flask import current_app
+
+# Символов на токен: (латиница, прочие алфавиты) по семействам провайдеров
+_CHARS_PER_TOKEN = {
+    "openai": (4.0, 3.2),
+    "anthropic": (3.5, 2.3),
+    "google": (4.0, 3.5),
+}
+# Неизвестное семейство и проверка текста до выбора модели — самая осторожная оценка
+_DEFAULT_CHARS_PER_TOKEN = (3.5, 2.3)
+
+# Окно контекста по семействам, если у модели не задан context_window
+_CONTEXT_WINDOWS = {
+    "openai": 128000,
+    "anthropic": 200000,
+    "google": 1048576,
+}
+_DEFAULT_CONTEXT_WINDOW = 128000
+
+# Служебные токены на каждое сообщение (роль, разделители) и на ответ
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]+|\s+")
+
+TRIM_MARKER = "\n[…текст сокращён]"
+
+
+class TokenBudget:
+    """
+    Оценка токенов (с кэшем в памяти процесса) и лимиты входа моделей
+    """
+
+    # Ключи default_params модели, которые задают лимиты входа, а не параметры API
+    MODEL_KEYS = ("context_window", "max_input_tokens")
+
+    # Сколько оценок текстов хранить в памяти процесса
+    CACHE_SIZE = 4096
+
+    # (семейство, sha1 текста) -> токенов
+    _cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def estimate(cls, text: Optional[str], family: Optional[str] = None) -> int:
+        """
+        Оценка числа токенов текста
+
+        Args:
+            text: Текст
+            family: Семейство провайдера (Provider.name: openai, anthropic, google);
+                    None — самая осторожная оценка
+        """
+        if not text:
+            return 0
+
+        key = (family or "", hashlib.sha1(text.encode("utf-8")).hexdigest())
+        with cls._lock:
+            tokens = cls._cache.get(key)
+            if tokens is not None:
+                cls._cache.move_to_end(key)
+                return tokens
+
+        tokens = cls._count(text, family)
+        with cls._lock:
+            cls._cache[key] = tokens
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return tokens
+
+    @classmethod
+    def estimate_messages(cls, messages: List[Dict[str, str]], family: Optional[str] = None) -> int:
+        """Оценка входных токенов запроса (сообщения и служебные токены)"""
+        return sum(cls.estimate(message.get("content"), family) + _MESSAGE_OVERHEAD for message in messages) + \
+            _REPLY_OVERHEAD
+
+    @classmethod
+    def input_limit(cls, model, max_tokens: int) -> Optional[int]:
+        """
+        Сколько входных токенов можно отправить модели
+
+        Окно контекста (context_window модели или типичное для семейства) за
+        вычетом max_tokens ответа, но не больше бюджета входа (max_input_tokens
+        модели или INPUT_TOKEN_BUDGET; 0 — без бюджета).
+
+        Args:
+            model: ModelConfig из ConfigSnapshot
+            max_tokens: Лимит ответа запроса
+        """
+        params = model.default_params
+        family = model.provider.name
+        window = cls._positive_int(params.get("context_window")) or _CONTEXT_WINDOWS.get(family,
+                                                                                         _DEFAULT_CONTEXT_WINDOW)
+        budget = cls._positive_int(params.get("max_input_tokens")) or \
+            current_app.config.get("INPUT_TOKEN_BUDGET", 0)
+        limit = window - max_tokens
+        return min(limit, budget) if budget else limit
+
+    @classmethod
+    def guard(cls, news_text: str) -> Tuple[str, Dict[str, Any], Optional[str]]:
+        """
+        Проверить текст новости до постановки в обработку
+
+        Returns:
+            Tuple (текст — обрезанный при INPUT_OVERFLOW=trim, {"input_tokens",
+            "max_input_tokens", "trimmed"}, сообщение об ошибке или None)
+        """
+        config = current_app.config
+        max_input_tokens = cls.max_input_tokens()
+        input_tokens = cls.estimate(news_text)
+        info = {"input_tokens": input_tokens, "max_input_tokens": max_input_tokens or None, "trimmed": False}
+        if not max_input_tokens or input_tokens <= max_input_tokens:
+            return news_text, info, None
+
+        if config.get("INPUT_OVERFLOW", "reject") != "trim":
+            return news_text, info, (f"Текст новости слишком длинный: около {input_tokens} токенов "
+                                     f"при лимите {max_input_tokens}")
+
+        news_text = cls.trim(news_text, max_input_tokens)
+        info["trimmed"] = True
+        info["input_tokens"] = cls.estimate(news_text)
+        return news_text, info, None
+
+    @staticmethod
+    def max_input_tokens() -> int:
+        """
+        Лимит размера текста новости (0 — без лимита)
+
+        INPUT_MAX_TOKENS ограничивает то, что уходит модели за один запрос. При
+        PIPELINE_CHUNKING длинный текст делится не больше чем на
+        PIPELINE_CHUNK_MAX_CHUNKS фрагментов, поэтому лимит применяется к
+        фрагменту: текст проходит, пока каждый фрагмент не длиннее INPUT_MAX_TOKENS.
+        """
+        config = current_app.config
+        max_input_tokens = config.get("INPUT_MAX_TOKENS", 0)
+        if not max_input_tokens or not config.get("PIPELINE_CHUNKING", True):
+            return max_input_tokens
+        if config.get("PIPELINE_CHUNK_TOKENS", 3000) > max_input_tokens:
+            return max_input_tokens  # фрагмент сам длиннее лимита
+        return max_input_tokens * max(config.get("PIPELINE_CHUNK_MAX_CHUNKS", 16), 1)
+
+    @classmethod
+    def trim(cls, text: str, max_tokens: int, family: Optional[str] = None) -> str:
+        """
+        Обрезать текст до max_tokens (по оценке) на границе предложения или слова
+        и пометить сокращение (TRIM_MARKER)
+        """
+        budget = max_tokens - cls.estimate(TRIM_MARKER, family)
+        latin, other = _CHARS_PER_TOKEN.get(family, _DEFAULT_CHARS_PER_TOKEN)
+        tokens = 0
+        end = 0
+        for match in _PIECE_RE.finditer(text):
+            tokens += cls._piece_tokens(match.group(), latin, other)
+            if tokens > budget:
+                break
+            end = match.end()
+        else:
+            return text
+
+        cut = text[:end]
+        boundary = max(cut.rfind(". "), cut.rfind("\n"))
+        if boundary > len(cut) * 0.8:
+            cut = cut[:boundary + 1]
+        return cut.rstrip() + TRIM_MARKER
+
+    @classmethod
+    def _count(cls, text: str, family: Optional[str]) -> int:
+        latin, other = _CHARS_PER_TOKEN.get(family, _DEFAULT_CHARS_PER_TOKEN)
+        return sum(cls._piece_tokens(match.group(), latin, other) for match in _PIECE_RE.finditer(text))
+
+    @staticmethod
+    def _piece_tokens(piece: str, latin: float, other: float) -> int:
+        """Токенов в слове, числе, знаках или пробелах"""
+        first = piece[0]
+        if first.isspace():
+            # Одиночный пробел входит в токен следующего слова
+            return 0 if piece == " " else 1
+        if first.isdigit():
+            return 1
+        if first.isalpha():
+            return math.ceil(len(piece) / (latin if piece.isascii() else other))
+        return math.ceil(len(piece) / 2)
+
+    @staticmethod
+    def _positive_int(value) -> int:
+        try:
+            value = int(value or 0)
+        except (TypeError, ValueError):
+            return 0
+        return value if value > 0 else 0
@@ -13,6 +13,9 @@ document.addEventListener('DOMContentLoaded', function() {
   const resultsContent = document.getElementById('resultsContent');
   const newsTextDiv = document.getElementById('newsText');
 
+  // Интервал опроса фонового задания обработки
+  const JOB_POLL_INTERVAL_MS = 1000;
+
   // Placeholder для contenteditable
   if (newsTextDiv) {
     newsTextDiv.addEventListener('focus', function() {
@@ -30,37 +33,91 @@ document.addEventListener('DOMContentLoaded', function() {
     });
   }
 
-  // Логика зависимости чекбоксов
-  const freshnessCheckbox = document.querySelector('input[data-stage-name="freshness_check"]');
-  const freshnessAnalysisCheckbox = document.querySelector('input[data-stage-name="freshness_analysis"]');
-  const freshnessAnalysisLabel = document.querySelector('label[data-stage-name="freshness_analysis"]');
+  // Логика зависимости чекбоксов: этап доступен, только если выбраны
+  // все этапы, от которых он зависит (data-requires)
+  const dependentCheckboxes = Array.from(
+    document.querySelectorAll('input[name="stage_ids"][data-requires]')
+  ).filter(cb => cb.dataset.requires);
+
+  function updateDependentStates() {
+    dependentCheckboxes.forEach(cb => {
+      const label = document.querySelector(`label[data-stage-name="${cb.dataset.stageName}"]`);
+      const satisfied = cb.dataset.requires.split(',').every(name => {
+        const required = document.querySelector(`input[name="stage_ids"][data-stage-name="${name}"]`);
+        return required && required.checked && !required.disabled;
+      });
 
-  if (freshnessCheckbox && freshnessAnalysisCheckbox) {
-    // Функция обновления состояния зависимого чекбокса
-    function updateFreshnessAnalysisState() {
-      if (!freshnessCheckbox.checked) {
-        freshnessAnalysisCheckbox.checked = false;
-        freshnessAnalysisCheckbox.disabled = true;
-        if (freshnessAnalysisLabel) {
-          freshnessAnalysisLabel.classList.add('disabled');
-        }
-      } else {
-        freshnessAnalysisCheckbox.disabled = false;
-        if (freshnessAnalysisLabel) {
-          freshnessAnalysisLabel.classList.remove('disabled');
-        }
+      if (!satisfied) {
+        cb.checked = false;
+        cb.disabled = true;
+        if (label) label.classList.add('disabled');
+      } else if (cb.dataset.hasModel !== '0') {
+        cb.disabled = false;
+        if (label) label.classList.remove('disabled');
       }
-    }
+    });
+  }
 
+  if (dependentCheckboxes.length > 0) {
     // Инициализация при загрузке
-    updateFreshnessAnalysisState();
+    updateDependentStates();
+
+    // Обработчик изменения состояния любого этапа
+    document.querySelectorAll('input[name="stage_ids"]').forEach(cb => {
+      cb.addEventListener('change', updateDependentStates);
+    });
+  }
 
-    // Обработчик изменения состояния
-    freshnessCheckbox.addEventListener('change', updateFreshnessAnalysisState);
+  // Упреждающая обработка: пока редактор вводит или вставляет текст, дешёвые
+  // этапы запускаются на сервере заранее, и задание заберёт их результаты
+  const speculativeUrl = form.dataset.speculativeUrl;
+  const speculativeDebounceMs = parseInt(form.dataset.speculativeDebounceMs || '800');
+  const speculativeMinChars = parseInt(form.dataset.speculativeMinChars || '0');
+  let speculativeTimer = null;
+  let speculativeText = '';
+
+  function postSpeculative(url, payload) {
+    const csrfToken = document.querySelector('input[name="csrf_token"]')?.value || '';
+    return fetch(url, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': csrfToken
+      },
+      body: JSON.stringify(payload)
+    }).catch(() => null);  // упреждающий запуск — только оптимизация, ошибки не показываем
+  }
+
+  function startSpeculative() {
+    const newsText = newsTextDiv.textContent.trim();
+    if (newsText === speculativeText) return;
+
+    if (newsText.length < speculativeMinChars) {
+      if (speculativeText) postSpeculative(form.dataset.speculativeCancelUrl, {});
+      speculativeText = '';
+      return;
+    }
+
+    speculativeText = newsText;
+    const stageIds = Array.from(document.querySelectorAll('input[name="stage_ids"]:checked:not([disabled])'))
+      .map(cb => parseInt(cb.value));
+    postSpeculative(speculativeUrl, { news_text: newsText, stage_ids: stageIds });
+  }
+
+  function scheduleSpeculative(delayMs) {
+    clearTimeout(speculativeTimer);
+    speculativeTimer = setTimeout(startSpeculative, delayMs);
+  }
+
+  if (speculativeUrl && newsTextDiv) {
+    newsTextDiv.addEventListener('input', () => scheduleSpeculative(speculativeDebounceMs));
+    // Вставленный текст обычно уже окончательный — запускаем почти сразу
+    newsTextDiv.addEventListener('paste', () => scheduleSpeculative(100));
   }
 
   form.addEventListener('submit', async function(e) {
     e.preventDefault();
+    clearTimeout(speculativeTimer);
 
     // Получаем текст из contenteditable
     const newsText = newsTextDiv.textContent.trim();
@@ -103,8 +160,19 @@ document.addEventListener('DOMContentLoaded', function() {
 
       const data = await response.json();
 
-      // Отображаем результаты
-      displayResults(data);
+      if (!data.success || !data.status_url) {
+        displayResults(data);
+        return;
+      }
+
+      // Задание поставлено в очередь — показываем этапы по мере готовности
+      // (SSE-поток, а если он недоступен — опрос состояния задания)
+      const job = data.events_url && window.EventSource
+        ? await streamJob(data.events_url, data.status_url)
+        : await pollJob(data.status_url);
+
+      // Отображаем итоговые результаты
+      displayResults({ success: job.success, error: job.error, results: job.results });
 
     } catch (error) {
       resultsContent.innerHTML = `
@@ -119,10 +187,99 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   });
 
+  /**
+   * Получение состояния задания обработки
+   */
+  async function fetchJob(statusUrl) {
+    const response = await fetch(statusUrl, { headers: { 'Accept': 'application/json' } });
+    const data = await response.json();
+
+    if (!data.success) {
+      throw new Error(data.error || 'Задание не найдено');
+    }
+    return data.job;
+  }
+
+  /**
+   * Получение результатов этапов через Server-Sent Events:
+   * каждый этап отображается сразу, как только он завершился
+   */
+  function streamJob(eventsUrl, statusUrl) {
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(eventsUrl);
+      const stageResults = [];
+      const pendingStages = {};  // stage_id -> { stage_display_name, text }
+      let renderScheduled = false;
+      let scrolled = false;
+
+      function render() {
+        renderScheduled = false;
+        displayResults({ success: true, results: stageResults }, !scrolled, Object.values(pendingStages));
+        scrolled = true;
+      }
+
+      function scheduleRender() {
+        if (!renderScheduled) {
+          renderScheduled = true;
+          requestAnimationFrame(render);
+        }
+      }
+
+      // Фрагменты ответа модели, пока этап ещё генерируется
+      source.addEventListener('delta', event => {
+        const delta = JSON.parse(event.data);
+        const pending = pendingStages[delta.stage_id] ||
+          (pendingStages[delta.stage_id] = { stage_display_name: delta.stage_display_name, text: '' });
+        pending.text = delta.type === 'reset' ? '' : pending.text + delta.text;
+        scheduleRender();
+      });
+
+      source.addEventListener('stage', event => {
+        const stageResult = JSON.parse(event.data);
+        delete pendingStages[stageResult.stage_id];
+        stageResults.push(stageResult);
+        scheduleRender();
+      });
+
+      source.addEventListener('done', () => {
+        source.close();
+        // Итоговые результаты забираем из задания — они упорядочены по этапам
+        fetchJob(statusUrl).then(resolve, reject);
+      });
+
+      source.onerror = () => {
+        source.close();
+        pollJob(statusUrl).then(resolve, reject);
+      };
+    });
+  }
+
+  /**
+   * Опрос задания обработки до завершения
+   */
+  async function pollJob(statusUrl) {
+    let shownResults = 0;
+
+    while (true) {
+      const job = await fetchJob(statusUrl);
+      if (job.status === 'done' || job.status === 'failed') {
+        return job;
+      }
+
+      // Частичные результаты: показываем этапы, которые уже завершились
+      if (job.results.length > shownResults) {
+        shownResults = job.results.length;
+        displayResults({ success: true, results: job.results }, false);
+      }
+
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  }
+
   /**
    * Отображение результатов обработки
    */
-  function displayResults(data) {
+  function displayResults(data, scroll = true, pendingStages = []) {
     if (!data.success && data.error) {
       resultsContent.innerHTML = `
         <div class="alert alert--error">
@@ -133,7 +290,7 @@ document.addEventListener('DOMContentLoaded', function() {
       return;
     }
 
-    if (!data.results || data.results.length === 0) {
+    if ((!data.results || data.results.length === 0) && pendingStages.length === 0) {
       resultsContent.innerHTML = `
         <div class="alert alert--warning">
           Нет результатов обработки
@@ -154,7 +311,7 @@ document.addEventListener('DOMContentLoaded', function() {
           <div class="result-header">
             <div class="result-title">${escapeHtml(result.stage_display_name)}</div>
             <span class="badge ${isSuccess ? 'badge--success' : 'badge--warning'}">
-              ${isSuccess ? '✓ Успешно' : '✗ Ошибка'}
+              ${isSuccess ? '✓ Успешно' : (result.timed_out ? '⏱ Время истекло' : '✗ Ошибка')}
             </span>
           </div>
       `;
@@ -167,7 +324,15 @@ document.addEventListener('DOMContentLoaded', function() {
           <div class="result-content">${formattedContent}</div>
           <div class="result-meta">
             Модель: ${escapeHtml(result.model_used || 'Неизвестно')}
+            ${result.duration_ms !== undefined ? ` · ${(result.duration_ms / 1000).toFixed(1)} с` : ''}
             ${result.fallback_used ? ' <span style="color: var(--warn);">(использован резервный вариант)</span>' : ''}
+            ${result.cached ? ' · из кэша' : ''}
+            ${result.retries ? ` · повторов: ${result.retries}` : ''}
+            ${result.input_tokens ? ` · ~${result.input_tokens} токенов на входе` : ''}
+            ${result.fused ? ' · объединённый запрос' : ''}
+            ${result.chunks ? ` · по фрагментам: ${result.chunks}` : ''}
+            ${result.speculative ? ' · выполнен заранее' : ''}
+            ${result.reused_from ? ` · результат похожей новости (сходство ${Math.round(result.reused_from.similarity * 100)}%)` : ''}
           </div>
         `;
       } else {
@@ -179,11 +344,26 @@ document.addEventListener('DOMContentLoaded', function() {
       html += `</div>`;
     });
 
+    // Этапы, ответ которых ещё генерируется
+    pendingStages.forEach(pending => {
+      html += `
+        <div class="result-item">
+          <div class="result-header">
+            <div class="result-title">${escapeHtml(pending.stage_display_name)}</div>
+            <span class="badge badge--warning">… Генерация</span>
+          </div>
+          <div class="result-content"><div class="formatted-result">${escapeHtml(pending.text)}</div></div>
+        </div>
+      `;
+    });
+
     resultsContent.innerHTML = html;
     resultsContainer.style.display = 'block';
 
     // Прокручиваем к результатам
-    resultsContainer.scrollIntoView({ behavior: 'smooth', block: 'start' });
+    if (scroll) {
+      resultsContainer.scrollIntoView({ behavior: 'smooth', block: 'start' });
+    }
   }
 
   /**
@@ -210,6 +390,7 @@ document.addEventListener('DOMContentLoaded', function() {
       case 'classification':
         return formatClassification(jsonData);
       case 'freshness_check':
+      case 'freshness_search':
         return formatFreshnessCheck(jsonData);
       case 'freshness_analysis':
         return formatFreshnessAnalysis(jsonData);
@@ -264,7 +445,23 @@ document.addEventListener('DOMContentLoaded', function() {
 
     if (data.results && Array.isArray(data.results)) {
       html += `<h3>Найдено публикаций: ${data.results.length}</h3>`;
-      // Можно добавить список результатов поиска если нужно
+      html += '<div class="issue-list">';
+      data.results.forEach(item => {
+        const url = safeUrl(item.url);
+        const title = url
+          ? `<a class="issue-type" href="${escapeHtml(url)}" target="_blank" rel="noopener noreferrer">${escapeHtml(item.title)}</a>`
+          : `<span class="issue-type">${escapeHtml(item.title)}</span>`;
+        html += `
+          <div class="issue-item">
+            <div class="issue-header">
+              ${title}
+              <span class="issue-type">${escapeHtml(item.source)}${item.published ? ' · ' + escapeHtml(item.published) : ''}</span>
+            </div>
+            <div class="issue-description">${escapeHtml(item.description)}</div>
+          </div>
+        `;
+      });
+      html += '</div>';
     }
 
     html += '</div>';
@@ -589,6 +786,20 @@ function formatRecommendations(data) {
     return html;
   }
 
+  /**
+   * Ссылка из ответа поискового провайдера: только http(s), иначе null
+   * (экранирование не защищает от javascript: и data: в href)
+   */
+  function safeUrl(url) {
+    if (!url) return null;
+    try {
+      const parsed = new URL(String(url));
+      return parsed.protocol === 'http:' || parsed.protocol === 'https:' ? parsed.href : null;
+    } catch (e) {
+      return null;
+    }
+  }
+
   /**
    * Экранирование HTML для безопасного вывода
    */
@@ -4,6 +4,7 @@
 from app.app import create_app
 from app.models import Stage, SystemPrompt, User
 from app.services.prompt_manager import PromptManager
+from app.services.config_snapshot import ConfigSnapshot
 from app.extensions import db
 
 # Дефолтные системные промпты для каждого этапа
@@ -154,6 +155,7 @@ def init_system_prompts():
             print(f"⚠️  Нет дефолтного промпта для этапа '{stage.name}'")
 
     db.session.commit()
+    ConfigSnapshot.bump_version()
 
     print("\n" + "=" * 60)
     print(f"Создано: {created}")
@@ -1,10 +1,12 @@
 # manage.py
+import os
 import click
 from flask import Flask
 from app.app import create_app
 from app.extensions import db, mail
 from app.models import User, Provider, AIModel, Stage
 from app.auth.services import hash_password
+from app.services.config_snapshot import ConfigSnapshot
 from flask_mail import Message
 
 app: Flask = create_app()
@@ -109,6 +111,108 @@ def send_test_mail(to_addr):
         click.echo(f"Отправлено на {to_addr}")
 
 
+@app.cli.command("jobs-worker")
+@click.option("--workers", type=int, default=None, help="Размер пула (по умолчанию JOB_WORKERS)")
+@click.option("--poll-interval", type=float, default=1.0, show_default=True, help="Пауза между опросами очереди, сек")
+def jobs_worker(workers, poll_interval):
+    """Выполнять задания обработки из очереди (для JOB_EXECUTOR=external)."""
+    from app.services.job_queue import JobQueue
+
+    click.echo(f"Исполнитель заданий запущен (workers={workers or app.config['JOB_WORKERS']})")
+    JobQueue.run_worker(app, workers=workers, poll_interval=poll_interval)
+
+
+@app.cli.command("process-batch")
+@click.argument("input_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", "-o", "output_path", required=True, type=click.Path(dir_okay=False),
+              help="Файл результатов (JSONL)")
+@click.option("--user", "user_email", required=True, help="E-mail пользователя, чьи промпты используются")
+@click.option("--stages", default=None, help="Этапы через запятую (имена или ID); по умолчанию все AI-этапы")
+@click.option("--format", "file_format", type=click.Choice(["jsonl", "csv"]), default=None,
+              help="Формат входного файла (по умолчанию — по расширению)")
+@click.option("--text-field", default="news_text", show_default=True, help="Поле с текстом новости")
+@click.option("--id-field", default="id", show_default=True, help="Поле с идентификатором новости")
+@click.option("--workers", type=int, default=None, help="Сколько новостей обрабатывать одновременно (по умолчанию BATCH_MAX_WORKERS)")
+@click.option("--checkpoint", "checkpoint_path", default=None, type=click.Path(dir_okay=False),
+              help="Файл контрольной точки (по умолчанию <output>.checkpoint)")
+@click.option("--checkpoint-every", type=int, default=20, show_default=True,
+              help="Сохранять контрольную точку каждые N записей")
+@click.option("--resume/--no-resume", default=True, help="Продолжить с контрольной точки, если она есть")
+@click.option("--overwrite", is_flag=True,
+              help="Перезаписать существующий файл результатов, если продолжать не с чего")
+@click.option("--deadline", type=float, default=None,
+              help="Лимит времени на одну новость, сек (по умолчанию PIPELINE_DEADLINE_SECONDS)")
+@click.option("--priority", type=click.Choice(["interactive", "normal", "bulk"]), default="bulk", show_default=True,
+              help="Класс приоритета запросов к провайдерам")
+def process_batch(input_path, output_path, user_email, stages, file_format, text_field, id_field,
+                  workers, checkpoint_path, checkpoint_every, resume, overwrite, deadline, priority):
+    """Обработать новости из файла JSONL/CSV, записывая результаты в JSONL по мере готовности."""
+    import json
+    from app.services.batch_processor import BatchProcessor, BatchCheckpoint
+    from app.services.pipeline_processor import PipelineProcessor
+
+    with app.app_context():
+        user = User.query.filter_by(email=user_email.strip().lower()).first()
+        if not user:
+            raise click.ClickException("Пользователь не найден")
+
+        llm_stages = Stage.query.filter_by(is_active=True, kind=Stage.KIND_LLM).all()
+        if stages:
+            wanted = [name.strip() for name in stages.split(",") if name.strip()]
+            known = {stage.name for stage in llm_stages} | {str(stage.id) for stage in llm_stages}
+            unknown = [name for name in wanted if name not in known]
+            if unknown:
+                raise click.ClickException(f"Нет активных AI-этапов: {', '.join(unknown)}")
+            stage_ids = [stage.id for stage in llm_stages if stage.name in wanted or str(stage.id) in wanted]
+        else:
+            stage_ids = [stage.id for stage in llm_stages]
+
+        plan, error = PipelineProcessor.build_plan(user.id, stage_ids, priority)
+        if error:
+            raise click.ClickException(error)
+
+        checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        checkpoint = None
+        if resume:
+            try:
+                checkpoint = BatchCheckpoint.load(checkpoint_path, input_path)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+
+        if checkpoint:
+            click.echo(f"Продолжение с контрольной точки: обработано {checkpoint.processed} записей")
+        else:
+            # Без контрольной точки файл результатов пишется заново — не затираем его молча
+            if os.path.exists(output_path) and os.path.getsize(output_path) > 0 and not overwrite:
+                raise click.ClickException(f"Файл {output_path} уже существует, а контрольной точки нет; "
+                                           f"укажите --overwrite, чтобы перезаписать его")
+            checkpoint = BatchCheckpoint(checkpoint_path, input_path)
+
+        items = (item for item in BatchProcessor.read_items(input_path, file_format, text_field, id_field)
+                 if not checkpoint.is_done(item["index"]))
+
+        failed = 0
+        with open(output_path, "ab") as output:
+            # Отбрасываем результаты, записанные после последней контрольной точки
+            output.truncate(checkpoint.output_offset)
+            output.seek(checkpoint.output_offset)
+
+            for count, item_result in enumerate(BatchProcessor.iter_results(plan, items, workers, deadline), 1):
+                output.write((json.dumps(item_result, ensure_ascii=False) + "\n").encode("utf-8"))
+                output.flush()
+                checkpoint.mark_done(item_result["index"], output.tell())
+                if not item_result["success"]:
+                    failed += 1
+
+                if count % checkpoint_every == 0:
+                    os.fsync(output.fileno())
+                    checkpoint.save()
+                    click.echo(f"  обработано {checkpoint.processed} (ошибок в этом запуске: {failed})")
+
+        checkpoint.remove()
+        click.echo(f"✨ Готово: обработано {checkpoint.processed} записей, ошибок в этом запуске: {failed}")
+
+
 @app.cli.command("init-assistants")
 def init_assistants():
     """Инициализировать базовые данные для системы ассистентов."""
@@ -200,6 +304,7 @@ def init_assistants():
                 click.echo(f"  ⏭️  Модель уже существует: {model_data['display_name']}")
 
         db.session.commit()
+        ConfigSnapshot.bump_version()
 
         click.echo("\n✨ Инициализация завершена!")
         click.echo("\nСледующие шаги:")
@@ -0,0 +1,70 @@
+"""add stage graph (kind, depends_on) and freshness_search step
+
+Revision ID: 3c7f1a9d2b64
+Revises: e8b078bb3666
+Create Date: 2026-10-16 10:12:41.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7f1a9d2b64'
+down_revision = 'e8b078bb3666'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Этапы получают тип (llm/search) и список зависимостей.
+    Поиск через Brave становится явным шагом freshness_search между
+    freshness_check и freshness_analysis.
+    """
+    with op.batch_alter_table('stages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('kind', sa.String(length=16), nullable=False, server_default='llm'))
+        batch_op.add_column(sa.Column('depends_on', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+
+    # Сдвигаем этапы после freshness_check, чтобы освободить позицию 3
+    conn.execute(sa.text("UPDATE stages SET `order` = 6 WHERE name = 'recommendations'"))
+    conn.execute(sa.text("UPDATE stages SET `order` = 5 WHERE name = 'analysis'"))
+    conn.execute(sa.text("UPDATE stages SET `order` = 4 WHERE name = 'freshness_analysis'"))
+
+    conn.execute(
+        sa.text("""
+            INSERT INTO stages (name, display_name, description, `order`, is_active, kind, depends_on,
+                                created_at, updated_at)
+            VALUES (
+                'freshness_search',
+                'Поиск публикаций',
+                'Поиск похожих публикаций через Brave Search по запросу из проверки на свежесть',
+                3,
+                1,
+                'search',
+                '["freshness_check"]',
+                :created_at,
+                :updated_at
+            )
+        """),
+        {"created_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+    )
+    conn.execute(
+        sa.text("UPDATE stages SET depends_on = '[\"freshness_search\"]' WHERE name = 'freshness_analysis'")
+    )
+
+
+def downgrade():
+    conn = op.get_bind()
+
+    conn.execute(sa.text("DELETE FROM stages WHERE name = 'freshness_search'"))
+    conn.execute(sa.text("UPDATE stages SET `order` = 3 WHERE name = 'freshness_analysis'"))
+    conn.execute(sa.text("UPDATE stages SET `order` = 4 WHERE name = 'analysis'"))
+    conn.execute(sa.text("UPDATE stages SET `order` = 5 WHERE name = 'recommendations'"))
+
+    with op.batch_alter_table('stages', schema=None) as batch_op:
+        batch_op.drop_column('depends_on')
+        batch_op.drop_column('kind')
@@ -0,0 +1,36 @@
+"""add config_state table
+
+Revision ID: 5b9e04c7d1f2
+Revises: 8d21e5b07c3a
+Create Date: 2026-10-16 14:37:52.118406
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e04c7d1f2'
+down_revision = '8d21e5b07c3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    config_state = op.create_table('config_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    now = datetime.utcnow()
+    op.bulk_insert(config_state, [
+        {'id': 1, 'version': 1, 'created_at': now, 'updated_at': now}
+    ])
+
+
+def downgrade():
+    op.drop_table('config_state')
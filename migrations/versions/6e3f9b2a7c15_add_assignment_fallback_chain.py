@@ -0,0 +1,43 @@
+"""add fallback_chain and routing_policy to stage_assignments
+
+Revision ID: 6e3f9b2a7c15
+Revises: 2d6e8a1f5c90
+Create Date: 2026-10-16 23:41:08.306127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e3f9b2a7c15'
+down_revision = '2d6e8a1f5c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Цепочка резервных моделей этапа (JSON-список ID по порядку) и политика
+    выбора модели. Существующая резервная модель становится цепочкой из одной модели.
+    """
+    with op.batch_alter_table('stage_assignments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fallback_chain', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('routing_policy', sa.String(length=16), nullable=False,
+                                      server_default='ordered'))
+
+    conn = op.get_bind()
+    rows = conn.execute(sa.text(
+        "SELECT id, fallback_model_id FROM stage_assignments WHERE fallback_model_id IS NOT NULL"
+    )).fetchall()
+    for assignment_id, fallback_model_id in rows:
+        conn.execute(
+            sa.text("UPDATE stage_assignments SET fallback_chain = :chain WHERE id = :id"),
+            {"chain": f"[{fallback_model_id}]", "id": assignment_id}
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('stage_assignments', schema=None) as batch_op:
+        batch_op.drop_column('routing_policy')
+        batch_op.drop_column('fallback_chain')
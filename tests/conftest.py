@@ -0,0 +1,37 @@
+"""
+Общие фикстуры модульных тестов
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def flask_app(tmp_path):
+    """Минимальное приложение для кода, читающего current_app.config (без БД)"""
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config.update(
+        TESTING=True,
+        INPUT_MAX_TOKENS=0,
+        INPUT_OVERFLOW="reject",
+        NEAR_DUPLICATE_INDEX_PATH=str(tmp_path / "near_duplicates.idx")
+    )
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def db_app(flask_app, tmp_path):
+    """Приложение с пустой SQLite-БД во временном каталоге"""
+    from app.extensions import db
+
+    flask_app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'test.db'}"
+    db.init_app(flask_app)
+    db.create_all()
+    yield flask_app
+    db.session.remove()
+    db.engine.dispose()
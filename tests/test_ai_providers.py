@@ -0,0 +1,64 @@
+"""
+Тесты запросов к моделям с хеджированием
+"""
+import time
+
+from app.services import ai_providers
+
+
+def make_result(success, content=None, error=None):
+    return {"success": success, "content": content, "model": "test", "usage": {}, "error": error}
+
+
+def test_hedge_falls_back_when_stream_owner_fails(flask_app, monkeypatch):
+    def fake_send(model_id, messages, use_fallback=True, on_delta=None, **kwargs):
+        if model_id == 1:
+            # Основная модель начинает поток, медлит и падает
+            on_delta({"type": "delta", "text": "Нача"})
+            time.sleep(0.3)
+            return make_result(False, error="Соединение разорвано")
+        time.sleep(0.05)
+        return make_result(True, content="Готовый ответ")
+
+    monkeypatch.setattr(ai_providers, "send_ai_request", fake_send)
+    events = []
+
+    result = ai_providers.send_hedged_request(1, 2, [{"role": "user", "content": "Новость"}],
+                                              hedge_after=0.1, on_delta=events.append)
+
+    assert result["success"] and result["content"] == "Готовый ответ"
+    assert result["hedged"] and result["fallback_used"]
+    assert result["original_error"] == "Соединение разорвано"
+    assert events == [{"type": "delta", "text": "Нача"}, {"type": "reset"},
+                      {"type": "delta", "text": "Готовый ответ"}]
+
+
+def test_hedge_keeps_stream_owner_answer(flask_app, monkeypatch):
+    def fake_send(model_id, messages, use_fallback=True, on_delta=None, **kwargs):
+        if model_id == 1:
+            on_delta({"type": "delta", "text": "Ответ основной"})
+            time.sleep(0.3)
+            return make_result(True, content="Ответ основной")
+        time.sleep(0.05)
+        return make_result(True, content="Ответ резервной")
+
+    monkeypatch.setattr(ai_providers, "send_ai_request", fake_send)
+    events = []
+
+    result = ai_providers.send_hedged_request(1, 2, [{"role": "user", "content": "Новость"}],
+                                              hedge_after=0.1, on_delta=events.append)
+
+    assert result["content"] == "Ответ основной" and not result.get("fallback_used")
+    assert events == [{"type": "delta", "text": "Ответ основной"}]
+
+
+def test_hedge_fails_when_both_attempts_fail(flask_app, monkeypatch):
+    def fake_send(model_id, messages, use_fallback=True, on_delta=None, **kwargs):
+        time.sleep(0.2 if model_id == 1 else 0.05)
+        return make_result(False, error=f"Ошибка модели {model_id}")
+
+    monkeypatch.setattr(ai_providers, "send_ai_request", fake_send)
+
+    result = ai_providers.send_hedged_request(1, 2, [{"role": "user", "content": "Новость"}], hedge_after=0.1)
+
+    assert not result["success"] and result["error"] == "Ошибка модели 1" and result["hedged"]
@@ -0,0 +1,63 @@
+"""
+Тесты контрольной точки пакетной обработки
+"""
+import pytest
+
+from app.services.batch_processor import BatchCheckpoint
+
+
+def test_mark_done_advances_over_contiguous_records(tmp_path):
+    checkpoint = BatchCheckpoint(str(tmp_path / "cp.json"), str(tmp_path / "news.jsonl"))
+
+    checkpoint.mark_done(1, 100)
+    checkpoint.mark_done(3, 200)
+    assert checkpoint.done_below == 0 and checkpoint.done == {1, 3}
+
+    checkpoint.mark_done(0, 300)
+    assert checkpoint.done_below == 2 and checkpoint.done == {3}
+
+    checkpoint.mark_done(2, 400)
+    assert checkpoint.done_below == 4 and checkpoint.done == set()
+    assert checkpoint.output_offset == 400 and checkpoint.processed == 4
+
+
+def test_is_done(tmp_path):
+    checkpoint = BatchCheckpoint(str(tmp_path / "cp.json"), str(tmp_path / "news.jsonl"))
+    checkpoint.mark_done(0, 10)
+    checkpoint.mark_done(5, 20)
+
+    assert [index for index in range(7) if checkpoint.is_done(index)] == [0, 5]
+
+
+def test_resume_after_save(tmp_path):
+    path = str(tmp_path / "cp.json")
+    source = str(tmp_path / "news.jsonl")
+    checkpoint = BatchCheckpoint(path, source)
+    for index, offset in ((0, 10), (1, 20), (4, 50)):
+        checkpoint.mark_done(index, offset)
+    checkpoint.save()
+
+    resumed = BatchCheckpoint.load(path, source)
+    assert (resumed.done_below, resumed.done, resumed.output_offset, resumed.processed) == (2, {4}, 50, 3)
+    assert not (tmp_path / "cp.json.tmp").exists()
+
+
+def test_load_missing_checkpoint(tmp_path):
+    assert BatchCheckpoint.load(str(tmp_path / "cp.json"), str(tmp_path / "news.jsonl")) is None
+
+
+def test_load_rejects_other_source(tmp_path):
+    path = str(tmp_path / "cp.json")
+    BatchCheckpoint(path, str(tmp_path / "news.jsonl")).save()
+
+    with pytest.raises(ValueError):
+        BatchCheckpoint.load(path, str(tmp_path / "other.jsonl"))
+
+
+def test_remove(tmp_path):
+    checkpoint = BatchCheckpoint(str(tmp_path / "cp.json"), str(tmp_path / "news.jsonl"))
+    checkpoint.save()
+    checkpoint.remove()
+    checkpoint.remove()
+
+    assert not (tmp_path / "cp.json").exists()
@@ -0,0 +1,44 @@
+"""
+Тесты разбиения длинного текста на фрагменты
+"""
+from app.services.chunking import split_text
+from app.services.token_budget import TokenBudget
+
+
+def paragraph(number, sentences=6):
+    return " ".join(f"Абзац {number}, предложение {index} о событиях дня." for index in range(sentences))
+
+
+def test_short_text_is_one_chunk():
+    assert split_text("Короткая новость.", 100) == ["Короткая новость."]
+
+
+def test_chunks_fit_limit_and_keep_paragraph_order():
+    text = "\n\n".join(paragraph(number) for number in range(6))
+    chunks = split_text(text, 120)
+
+    assert len(chunks) > 1
+    assert all(TokenBudget.estimate(chunk) <= 120 for chunk in chunks)
+    assert [number for number in range(6) if f"Абзац {number}," in "".join(chunks)] == list(range(6))
+    assert chunks[0].startswith("Абзац 0")
+    assert chunks[-1].endswith("Абзац 5, предложение 5 о событиях дня.")
+
+
+def test_overlap_repeats_end_of_previous_chunk():
+    text = "\n\n".join(paragraph(number, sentences=2) for number in range(8))
+    chunks = split_text(text, 80, overlap_tokens=30)
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        last_sentence = previous.split("\n\n")[-1].split(". ")[-1]
+        assert last_sentence in current
+    assert all(TokenBudget.estimate(chunk) <= 80 for chunk in chunks)
+
+
+def test_long_sentence_is_split_by_words():
+    text = " ".join(f"слово{index}" for index in range(300))
+    chunks = split_text(text, 50)
+
+    assert len(chunks) > 1
+    assert all(TokenBudget.estimate(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
@@ -0,0 +1,34 @@
+"""
+Тесты ключа кэша ответов моделей
+"""
+from app.services.llm_cache import LLMCache
+
+MESSAGES = [{"role": "system", "content": "Ты редактор."}, {"role": "user", "content": "Новость"}]
+
+
+def test_key_is_stable_sha256():
+    key = LLMCache.make_key("gpt-4o", MESSAGES, {"temperature": 0.2})
+
+    assert key == LLMCache.make_key("gpt-4o", MESSAGES, {"temperature": 0.2})
+    assert len(key) == 64 and int(key, 16) >= 0
+
+
+def test_key_ignores_line_endings_outer_whitespace_and_param_order():
+    messages = [{"role": "system", "content": "  Ты редактор.\r\n"}, {"role": "user", "content": "Новость\n"}]
+
+    assert LLMCache.make_key("gpt-4o", messages, {"max_tokens": 100, "temperature": 0.2}) == \
+        LLMCache.make_key("gpt-4o", MESSAGES, {"temperature": 0.2, "max_tokens": 100})
+
+
+def test_key_depends_on_model_messages_roles_and_params():
+    key = LLMCache.make_key("gpt-4o", MESSAGES, {"temperature": 0.2})
+    swapped_roles = [{"role": "user", "content": "Ты редактор."}, {"role": "user", "content": "Новость"}]
+
+    assert key != LLMCache.make_key("gpt-4o-mini", MESSAGES, {"temperature": 0.2})
+    assert key != LLMCache.make_key("gpt-4o", MESSAGES[1:], {"temperature": 0.2})
+    assert key != LLMCache.make_key("gpt-4o", swapped_roles, {"temperature": 0.2})
+    assert key != LLMCache.make_key("gpt-4o", MESSAGES, {"temperature": 0.3})
+
+
+def test_key_treats_missing_content_as_empty():
+    assert LLMCache.make_key("m", [{"role": "user"}], {}) == LLMCache.make_key("m", [{"role": "user", "content": None}], {})
@@ -0,0 +1,76 @@
+"""
+Тесты индекса почти-дубликатов (файл индекса пишется напрямую, без БД)
+"""
+import os
+from array import array
+
+import pytest
+
+from app.services.near_duplicates import NearDuplicateIndex
+
+NEWS = ("Центральный банк России в пятницу сохранил ключевую ставку на уровне шестнадцати процентов "
+        "и пообещал удерживать жёсткие денежно-кредитные условия до замедления инфляции")
+
+
+@pytest.fixture(autouse=True)
+def fresh_index():
+    NearDuplicateIndex._close()
+    NearDuplicateIndex._path = None
+    yield
+    NearDuplicateIndex._close()
+    NearDuplicateIndex._path = None
+
+
+def record(fingerprint_id, signature):
+    return array("I", [fingerprint_id] + list(signature)).tobytes()
+
+
+def write_index(flask_app, *records, mode="wb"):
+    with open(flask_app.config["NEAR_DUPLICATE_INDEX_PATH"], mode) as f:
+        f.write(b"".join(records))
+
+
+def test_signature():
+    signature = NearDuplicateIndex.signature(NEWS)
+
+    assert len(signature) == NearDuplicateIndex.NUM_PERM
+    assert signature == NearDuplicateIndex.signature(NEWS.upper())
+    assert NearDuplicateIndex.signature("  ...  ") is None
+
+
+def test_find_similar_and_skips_different(flask_app):
+    other = NearDuplicateIndex.signature("Сборная по футболу выиграла товарищеский матч в Казани со счётом три ноль")
+    write_index(flask_app, record(1, NearDuplicateIndex.signature(NEWS)), record(2, other))
+
+    matches = NearDuplicateIndex.find(NearDuplicateIndex.signature(NEWS + " Об этом сообщил регулятор."), 0.5)
+
+    assert [fingerprint_id for fingerprint_id, _ in matches] == [1]
+    assert 0.5 <= matches[0][1] < 1.0
+    assert NearDuplicateIndex.find(NearDuplicateIndex.signature(NEWS), 0.99) == [(1, 1.0)]
+
+
+def test_sync_picks_up_appended_records(flask_app):
+    signature = NearDuplicateIndex.signature(NEWS)
+    write_index(flask_app, record(1, signature))
+    assert NearDuplicateIndex.find(signature, 0.99) == [(1, 1.0)]
+
+    # Запись другого процесса и недописанный хвост следующей
+    write_index(flask_app, record(2, signature), record(3, signature)[:40], mode="ab")
+
+    assert sorted(NearDuplicateIndex.find(signature, 0.99)) == [(1, 1.0), (2, 1.0)]
+    assert NearDuplicateIndex._records == 2
+
+
+def test_sync_rebuilds_after_file_is_replaced(flask_app):
+    signature = NearDuplicateIndex.signature(NEWS)
+    write_index(flask_app, record(1, signature), record(2, signature))
+    assert len(NearDuplicateIndex.find(signature, 0.99)) == 2
+
+    # Сжатие другим процессом: новый файл на месте старого
+    path = flask_app.config["NEAR_DUPLICATE_INDEX_PATH"]
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(record(2, signature))
+    os.replace(f"{path}.tmp", path)
+
+    assert NearDuplicateIndex.find(signature, 0.99) == [(2, 1.0)]
+    assert NearDuplicateIndex._records == 1
@@ -0,0 +1,51 @@
+"""
+Тесты разбора ответов моделей в конвейере
+"""
+from app.services.pipeline_processor import PipelineProcessor
+
+
+def test_split_fused_answer():
+    content = "Вступление модели\n=== title ===\nЗаголовок\n\n=== summary ===\n  Кратко.\nЕщё строка\n"
+
+    assert PipelineProcessor._split_fused_answer(content, ["title", "summary"]) == {
+        "title": "Заголовок",
+        "summary": "Кратко.\nЕщё строка"
+    }
+
+
+def test_split_fused_answer_keeps_first_section_and_allows_spaces():
+    content = "  ===  title  ===\nПервый\n=== title ===\nВторой\n===summary===\nТекст"
+
+    assert PipelineProcessor._split_fused_answer(content, ["title", "summary"]) == {
+        "title": "Первый",
+        "summary": "Текст"
+    }
+
+
+def test_split_fused_answer_requires_every_section():
+    assert PipelineProcessor._split_fused_answer("=== title ===\nЗаголовок", ["title", "summary"]) is None
+    assert PipelineProcessor._split_fused_answer("=== title ===\n\n=== summary ===\nТекст",
+                                                 ["title", "summary"]) is None
+    assert PipelineProcessor._split_fused_answer(None, ["title"]) is None
+
+
+def test_split_fused_answer_ignores_inline_markers():
+    content = "=== title === Заголовок\n=== title ===\nЗаголовок"
+
+    assert PipelineProcessor._split_fused_answer(content, ["title"]) == {"title": "Заголовок"}
+
+
+def test_extract_search_query_from_json():
+    content = '```json\n{"search_query": " выборы в Москве "}\n```'
+
+    assert PipelineProcessor._extract_search_query(content) == "выборы в Москве"
+
+
+def test_extract_search_query_from_markdown_line():
+    assert PipelineProcessor._extract_search_query("**Поисковый запрос:** «выборы в Москве»") == "выборы в Москве"
+    assert PipelineProcessor._extract_search_query("Анализ...\nпоисковый запрос: `курс рубля`\n") == "курс рубля"
+
+
+def test_extract_search_query_missing():
+    assert PipelineProcessor._extract_search_query("Поисковый запрос: []") is None
+    assert PipelineProcessor._extract_search_query('{"query": "x"}') is None
@@ -0,0 +1,96 @@
+"""
+Тесты очереди запросов по классам приоритета
+"""
+
+from app.services.priority import BULK, INTERACTIVE, NORMAL, PriorityGate, _Waiter
+
+
+def make_gate(limit=1, aging_seconds=60.0, reserved_slots=0):
+    return PriorityGate(limit, {INTERACTIVE: 4.0, NORMAL: 2.0, BULK: 1.0}, aging_seconds, reserved_slots)
+
+
+def enqueue(gate, priority, age=0.0):
+    waiter = _Waiter()
+    waiter.since -= age
+    gate._queues[priority].append(waiter)
+    return waiter
+
+
+def test_free_slot_is_granted_immediately():
+    gate = make_gate(limit=2)
+
+    assert gate.acquire(NORMAL, timeout=0.1)
+    assert gate.acquire(INTERACTIVE, timeout=0.1)
+    stats = gate.stats()["classes"]
+    assert stats[NORMAL]["active"] == 1 and stats[NORMAL]["granted"] == 1
+    assert stats[INTERACTIVE]["active"] == 1
+
+
+def test_timeout_when_all_slots_are_busy():
+    gate = make_gate(limit=1)
+    assert gate.acquire(NORMAL)
+
+    assert not gate.acquire(INTERACTIVE, timeout=0.05)
+    stats = gate.stats()["classes"][INTERACTIVE]
+    assert stats["timed_out"] == 1 and stats["waiting"] == 0
+
+    gate.release(NORMAL)
+    assert gate.acquire(INTERACTIVE, timeout=0.05)
+
+
+def test_bulk_does_not_take_reserved_slots():
+    gate = make_gate(limit=2, reserved_slots=1)
+    assert gate.acquire(BULK)
+
+    assert not gate.acquire(BULK, timeout=0.05)
+    assert gate.acquire(INTERACTIVE, timeout=0.05)
+
+
+def test_virtual_time_grows_by_inverse_weight():
+    gate = make_gate(limit=10)
+    gate.acquire(BULK)
+    gate.acquire(INTERACTIVE)
+    gate.acquire(INTERACTIVE)
+
+    assert gate._vtime[BULK] == 1.0
+    assert gate._vtime[INTERACTIVE] == 0.5
+
+
+def test_idle_class_gets_no_accumulated_credit():
+    gate = make_gate(limit=10)
+    for _ in range(8):
+        gate.acquire(INTERACTIVE)
+
+    gate.acquire(BULK)
+
+    # Время bulk подтянуто к текущему (1.75), а не начато с нуля
+    assert gate._vtime[BULK] == 1.75 + 1.0
+
+
+def test_select_prefers_lowest_virtual_time():
+    gate = make_gate(limit=1)
+    enqueue(gate, INTERACTIVE)
+    enqueue(gate, BULK)
+
+    gate._vtime.update({INTERACTIVE: 0.5, BULK: 0.25})
+    assert gate._select() == BULK
+
+    gate._vtime.update({INTERACTIVE: 0.25, BULK: 0.25})
+    assert gate._select() == INTERACTIVE  # при равенстве — по порядку классов
+
+
+def test_aging_overrides_weights():
+    gate = make_gate(limit=1, aging_seconds=5.0)
+    enqueue(gate, BULK, age=10.0)
+    enqueue(gate, INTERACTIVE)
+    gate._vtime.update({INTERACTIVE: 0.0, BULK: 100.0})
+
+    assert gate._select() == BULK
+
+
+def test_select_waits_for_free_slot():
+    gate = make_gate(limit=1)
+    gate._active[NORMAL] = 1
+    enqueue(gate, INTERACTIVE)
+
+    assert gate._select() is None
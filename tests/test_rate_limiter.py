@@ -0,0 +1,110 @@
+"""
+Тесты лимитов запросов и токенов в минуту
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.extensions import db
+from app.models import RateLimitBucket
+from app.services import ai_providers
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.config_snapshot import ConfigSnapshot
+from app.services.rate_limiter import RateLimiter
+
+TPM_KEY = "model:5:tpm"
+
+
+@pytest.fixture(autouse=True)
+def fresh_buckets():
+    RateLimiter._known_keys = set()
+    yield
+    RateLimiter._known_keys = set()
+
+
+def put_bucket(tokens):
+    db.session.add(RateLimitBucket(key=TPM_KEY, tokens=tokens, updated_at=time.time()))
+    db.session.commit()
+
+
+def bucket():
+    db.session.expire_all()
+    row = db.session.get(RateLimitBucket, TPM_KEY)
+    return row.tokens, row.updated_at
+
+
+def test_acquire_debits_and_settle_refunds(db_app):
+    limits = RateLimiter.limits("model:5", {"tpm": 1000}, tokens=300)
+
+    assert RateLimiter.acquire(limits) == (True, None)
+    assert bucket()[0] == pytest.approx(700, abs=1)
+
+    RateLimiter.settle(limits, 100)
+    assert bucket()[0] == pytest.approx(900, abs=1)
+
+
+def test_rejected_acquire_leaves_bucket_unchanged(db_app):
+    db_app.config["RATE_LIMIT_MAX_WAIT_SECONDS"] = 0
+    put_bucket(10)
+    before = bucket()
+
+    acquired, wait = RateLimiter.acquire(RateLimiter.limits("model:5", {"tpm": 1000}, tokens=500))
+
+    assert not acquired and wait > 0
+    assert bucket() == before
+
+
+def test_database_error_skips_limit_without_debit(db_app, monkeypatch):
+    def broken(cls, limits):
+        raise SQLAlchemyError("database is locked")
+
+    monkeypatch.setattr(RateLimiter, "_try_take", classmethod(broken))
+
+    assert RateLimiter.acquire(RateLimiter.limits("model:5", {"tpm": 1000}, tokens=10)) == (False, None)
+
+
+def test_no_limits_are_not_acquired(db_app):
+    assert RateLimiter.acquire([]) == (False, None)
+
+
+@pytest.fixture
+def settled(db_app, monkeypatch):
+    """Модель с лимитом tpm без обращения к провайдеру; список вызовов settle"""
+    provider = SimpleNamespace(id=3, name="openai", display_name="OpenAI", is_active=True, additional_config={})
+    model = SimpleNamespace(id=5, api_identifier="gpt-test", display_name="GPT", is_active=True,
+                            default_params={"tpm": 1000}, provider=provider)
+    monkeypatch.setattr(ConfigSnapshot, "get", classmethod(lambda cls: SimpleNamespace(models={5: model},
+                                                                                      version=1)))
+    monkeypatch.setattr(ai_providers.ProviderRegistry, "acquire", classmethod(lambda cls, provider: object()))
+    monkeypatch.setattr(ai_providers.ProviderRegistry, "release", classmethod(lambda cls, client: None))
+    settled = []
+    monkeypatch.setattr(RateLimiter, "settle", classmethod(lambda cls, limits, used: settled.append(used)))
+    return settled
+
+
+def test_circuit_breaker_block_does_not_refill_bucket(settled, monkeypatch):
+    monkeypatch.setattr(CircuitBreaker, "allow", classmethod(lambda cls, keys: 30.0))
+    put_bucket(10)
+    before = bucket()
+
+    result = ai_providers.send_ai_request(5, [{"role": "user", "content": "Новость"}], use_fallback=False)
+
+    assert not result["success"]
+    assert settled == []
+    assert bucket() == before
+
+
+def test_rate_limit_rejection_does_not_refill_bucket(db_app, settled, monkeypatch):
+    monkeypatch.setattr(CircuitBreaker, "allow", classmethod(lambda cls, keys: None))
+    db_app.config["RATE_LIMIT_MAX_WAIT_SECONDS"] = 0
+    put_bucket(10)
+    before = bucket()
+
+    result = ai_providers.send_ai_request(5, [{"role": "user", "content": "Новость"}], use_fallback=False,
+                                          max_tokens=500)
+
+    assert not result["success"] and "лимит" in result["error"]
+    assert settled == []
+    assert bucket() == before
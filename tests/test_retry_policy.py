@@ -0,0 +1,76 @@
+"""
+Тесты разбора заголовков паузы перед повтором
+"""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.retry_policy import RetryPolicy
+
+
+def response(**headers):
+    return SimpleNamespace(headers=headers)
+
+
+def test_no_headers():
+    assert RetryPolicy.server_delay(response()) is None
+
+
+def test_retry_after_ms_has_priority():
+    delay = RetryPolicy.server_delay(response(**{"retry-after-ms": "1500", "Retry-After": "30"}))
+    assert delay == 1.5
+
+
+def test_retry_after_seconds():
+    assert RetryPolicy.server_delay(response(**{"Retry-After": "7"})) == 7.0
+
+
+def test_retry_after_http_date():
+    at = datetime.now(timezone.utc) + timedelta(seconds=60)
+    delay = RetryPolicy.server_delay(response(**{"Retry-After": format_datetime(at, usegmt=True)}))
+    assert 55 <= delay <= 60
+
+
+def test_retry_after_in_the_past_is_zero():
+    assert RetryPolicy.server_delay(response(**{"Retry-After": "-5"})) == 0.0
+
+
+def test_invalid_retry_after_is_ignored():
+    assert RetryPolicy.server_delay(response(**{"Retry-After": "soon", "retry-after-ms": "x"})) is None
+
+
+def test_anthropic_reset_only_when_limit_exhausted():
+    reset = (datetime.now(timezone.utc) + timedelta(seconds=20)).isoformat().replace("+00:00", "Z")
+    exhausted = response(**{"anthropic-ratelimit-tokens-remaining": "0",
+                            "anthropic-ratelimit-tokens-reset": reset})
+    left = response(**{"anthropic-ratelimit-tokens-remaining": "100",
+                       "anthropic-ratelimit-tokens-reset": reset})
+
+    assert 15 <= RetryPolicy.server_delay(exhausted) <= 20
+    assert RetryPolicy.server_delay(left) is None
+
+
+def test_openai_reset_takes_longest_exhausted_limit():
+    delay = RetryPolicy.server_delay(response(**{
+        "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1s",
+        "x-ratelimit-remaining-tokens": "0", "x-ratelimit-reset-tokens": "6m0s"
+    }))
+    assert delay == 360.0
+
+
+@pytest.mark.parametrize("value, seconds", [("1s", 1.0), ("6m0s", 360.0), ("120ms", 0.12), ("1h2m3.5s", 3723.5)])
+def test_parse_duration(value, seconds):
+    assert RetryPolicy._parse_duration(value) == pytest.approx(seconds)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_invalid_duration(value):
+    assert RetryPolicy._parse_duration(value) is None
+
+
+def test_parse_timestamp_without_zone_is_utc():
+    assert RetryPolicy._parse_timestamp("2026-10-16T12:00:30") == datetime(2026, 10, 16, 12, 0, 30,
+                                                                          tzinfo=timezone.utc)
+    assert RetryPolicy._parse_timestamp("not a date") is None
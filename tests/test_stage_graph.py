@@ -0,0 +1,61 @@
+"""
+Тесты графа зависимостей этапов
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.stage_graph import StageGraph, StageGraphError
+
+
+def make_stage(stage_id, name, order, dependencies=()):
+    return SimpleNamespace(id=stage_id, name=name, order=order, dependencies=list(dependencies))
+
+
+def test_dependencies_come_first_and_ties_follow_order():
+    stages = [
+        make_stage(1, "summary", 30, ["search"]),
+        make_stage(2, "search", 20, ["query"]),
+        make_stage(3, "query", 10),
+        make_stage(4, "title", 5)
+    ]
+    graph = StageGraph.build([1, 4], stages)
+
+    assert graph.topological_order() == [4, 3, 2, 1]
+    assert graph.selected_ids == {1, 4}
+    assert graph.ancestors(1) == {2, 3}
+    assert graph.display_order() == [4, 3, 2, 1]
+
+
+def test_independent_stages_are_ordered_by_stage_order():
+    stages = [make_stage(1, "b", 20), make_stage(2, "a", 10), make_stage(3, "c", 10)]
+    graph = StageGraph.build([1, 2, 3], stages)
+
+    assert graph.topological_order() == [2, 3, 1]
+
+
+def test_missing_dependency_is_reported_not_raised():
+    stages = [make_stage(1, "summary", 10, ["search"])]
+    graph = StageGraph.build([1], stages)
+
+    assert graph.topological_order() == [1]
+    assert graph.missing == {1: ["search"]}
+
+
+def test_unknown_selected_ids_are_ignored():
+    graph = StageGraph.build([1, 99], [make_stage(1, "summary", 10)])
+
+    assert list(graph.nodes) == [1]
+
+
+def test_cycle_raises_with_stage_names():
+    stages = [
+        make_stage(1, "a", 10, ["c"]),
+        make_stage(2, "b", 20, ["a"]),
+        make_stage(3, "c", 30, ["b"]),
+        make_stage(4, "d", 40, ["a"])
+    ]
+    with pytest.raises(StageGraphError) as error:
+        StageGraph.build([4], stages)
+
+    assert "a, b, c" in str(error.value)
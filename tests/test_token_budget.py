@@ -0,0 +1,92 @@
+"""
+Тесты оценки и ограничения числа токенов
+"""
+from app.services.token_budget import TRIM_MARKER, TokenBudget
+
+LONG_TEXT = " ".join(f"Предложение номер {index} о новостях." for index in range(400))
+
+
+def test_estimate():
+    assert TokenBudget.estimate("") == 0
+    assert TokenBudget.estimate(None) == 0
+    assert 0 < TokenBudget.estimate("Hello world") < TokenBudget.estimate("Привет, мир! " * 10)
+
+
+def test_estimate_messages_adds_overhead():
+    messages = [{"role": "system", "content": "abc"}, {"role": "user", "content": "def"}]
+
+    assert TokenBudget.estimate_messages(messages) > TokenBudget.estimate("abc") + TokenBudget.estimate("def")
+
+
+def test_trim_short_text_is_unchanged():
+    assert TokenBudget.trim("Короткий текст.", 100) == "Короткий текст."
+
+
+def test_trim_fits_limit_and_marks_cut():
+    trimmed = TokenBudget.trim(LONG_TEXT, 200)
+
+    assert trimmed.endswith(TRIM_MARKER)
+    assert TokenBudget.estimate(trimmed) <= 200
+    assert LONG_TEXT.startswith(trimmed[:-len(TRIM_MARKER)])
+    assert trimmed[:-len(TRIM_MARKER)].endswith(".")  # обрезано на границе предложения
+
+
+def test_guard_without_limit(flask_app):
+    text, info, error = TokenBudget.guard(LONG_TEXT)
+
+    assert (text, error) == (LONG_TEXT, None)
+    assert info == {"input_tokens": TokenBudget.estimate(LONG_TEXT), "max_input_tokens": None, "trimmed": False}
+
+
+def test_guard_rejects_long_text(flask_app):
+    flask_app.config["INPUT_MAX_TOKENS"] = 100
+    text, info, error = TokenBudget.guard(LONG_TEXT)
+
+    assert text == LONG_TEXT
+    assert "слишком длинный" in error
+    assert info["max_input_tokens"] == 100 and not info["trimmed"]
+
+
+def test_guard_trims_long_text(flask_app):
+    flask_app.config.update(INPUT_MAX_TOKENS=100, INPUT_OVERFLOW="trim")
+    text, info, error = TokenBudget.guard(LONG_TEXT)
+
+    assert error is None
+    assert text.endswith(TRIM_MARKER)
+    assert info["trimmed"] and info["input_tokens"] == TokenBudget.estimate(text) <= 100
+
+
+def test_guard_limits_chunks_not_whole_text(flask_app):
+    from app.services.pipeline_processor import PipelineProcessor
+
+    flask_app.config.update(INPUT_MAX_TOKENS=1000, PIPELINE_CHUNKING=True, PIPELINE_CHUNK_TOKENS=800,
+                            PIPELINE_CHUNK_OVERLAP_TOKENS=50, PIPELINE_CHUNK_MAX_CHUNKS=16)
+    text, info, error = TokenBudget.guard(LONG_TEXT)
+
+    assert (text, error) == (LONG_TEXT, None)
+    assert info["max_input_tokens"] == 16000 and info["input_tokens"] > 1000
+    chunks = PipelineProcessor._split_news(text)
+    assert len(chunks) > 1
+    assert all(TokenBudget.estimate(chunk) <= 1000 for chunk in chunks)
+
+
+def test_guard_rejects_text_longer_than_all_chunks(flask_app):
+    flask_app.config.update(INPUT_MAX_TOKENS=1000, PIPELINE_CHUNKING=True, PIPELINE_CHUNK_TOKENS=800,
+                            PIPELINE_CHUNK_MAX_CHUNKS=4)
+    _, info, error = TokenBudget.guard(LONG_TEXT)
+
+    assert info["max_input_tokens"] == 4000
+    assert "слишком длинный" in error
+
+
+def test_guard_limits_whole_text_without_chunking(flask_app):
+    flask_app.config.update(INPUT_MAX_TOKENS=1000, PIPELINE_CHUNKING=False, PIPELINE_CHUNK_TOKENS=800)
+
+    assert TokenBudget.guard(LONG_TEXT)[2] is not None
+    assert TokenBudget.max_input_tokens() == 1000
+
+
+def test_chunk_larger_than_limit_keeps_limit(flask_app):
+    flask_app.config.update(INPUT_MAX_TOKENS=1000, PIPELINE_CHUNKING=True, PIPELINE_CHUNK_TOKENS=3000)
+
+    assert TokenBudget.max_input_tokens() == 1000